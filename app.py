@@ -1,35 +1,17 @@
-import subprocess
 import sys
+import time
 import streamlit as st
 from streamlit_option_menu import option_menu
-from dashboard import dashboard_page
-from driver_setup import driver_setup_page
-from interface_page import interface_page
-from terminal_page import terminal_page
-from rfid_generator import RFIDInterface  # Updated import
-from lap_timer import lap_timer_page  # Import the lap timer page function
+from page_registry import PAGES, DEFAULT_PAGE, get_page, load_page
+from metrics import metrics
 
-# Function to install packages
-def install_package(package):
-    subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-
-# List of required packages
-required_packages = [
-    "streamlit",
-    "streamlit_option_menu",
-]
-
-# Try to import required packages, install if not available
-for package in required_packages:
-    try:
-        __import__(package)
-    except ImportError:
-        install_package(package)
+# Dependencies are checked once with `python bootstrap.py`, not on every
+# rerun. Page modules are imported on navigation; see page_registry.
 
 # Redirect standard output and standard error to the log capturer
 from log_capturer import log_capturer
-sys.stdout = log_capturer
-sys.stderr = log_capturer
+sys.stdout = log_capturer.stdout
+sys.stderr = log_capturer.stderr
 
 # Set the page layout to wide mode
 st.set_page_config(layout="wide")
@@ -38,33 +20,37 @@ st.set_page_config(layout="wide")
 if 'interface' not in st.session_state:
     st.session_state.interface = None
 
-if 'rfid_interface' not in st.session_state:
-    st.session_state.rfid_interface = RFIDInterface(lambda rfid: st.write(f"RFID detected: {rfid}"))
-
 if 'listening' not in st.session_state:
     st.session_state.listening = False
 
 if 'mock_rfid' not in st.session_state:
     st.session_state.mock_rfid = None
 
+# The simulated reader is only needed by Driver Setup, so it is created the
+# first time that page is shown
+def get_rfid_interface():
+    if 'rfid_interface' not in st.session_state:
+        from rfid_generator import RFIDInterface
+        st.session_state.rfid_interface = RFIDInterface(lambda rfid: st.write(f"RFID detected: {rfid}"))
+    return st.session_state.rfid_interface
+
 # Page navigation
 with st.sidebar:
-    page = option_menu(
+    selected = option_menu(
         "Navigation",
-        ["Dashboard", "Driver Setup", "Interface", "Lap Timer", "Terminal"],
-        icons=["house", "gear", "antenna", "clock", "terminal"],
+        [page.name for page in PAGES],
+        icons=[page.icon for page in PAGES],
         menu_icon="cast",
-        default_index=0,
+        default_index=PAGES.index(DEFAULT_PAGE),
     )
 
 # Page routing
-if page == "Dashboard":
-    dashboard_page()
-elif page == "Driver Setup":
-    driver_setup_page(st.session_state.rfid_interface)
-elif page == "Interface":
-    interface_page()
-elif page == "Lap Timer":
-    lap_timer_page()
-elif page == "Terminal":
-    terminal_page()
+page = get_page(selected)
+render_started = time.perf_counter()
+render = load_page(page)
+if page.name == "Driver Setup":
+    render(get_rfid_interface())
+else:
+    render()
+if metrics.enabled:
+    metrics.histogram("sippycup_page_render_seconds", "Time to run a page script", labels={"page": page.name}).observe(time.perf_counter() - render_started)
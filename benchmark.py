@@ -0,0 +1,503 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+import numpy as np
+import storage as storage_module
+import driver_registry as driver_registry_module
+from ttl_interface import Frame
+from ingestion_hub import IngestionHub, get_ingestion_hub
+from lap_timer import lap_timer_page
+from driver_setup import driver_setup_page
+from storage import get_storage
+from load_generator import open_virtual_port, make_epc, TrafficGenerator, simulated_events, rate_events, run, LINE_ENDING
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARKS = ["latency", "throughput", "memory", "render", "startup", "export"]
+PIPELINE_SETTINGS = {"dedup_window_ms": 50, "min_lap_time": 0, "dedup_mode": "first"}
+BAUD_RATE = 115200  # Ignored by the pty, which runs at memory speed
+DRAIN_TIMEOUT = 5.0  # Seconds allowed after the last frame for the pipeline to catch up
+RENDER_LAPS = 5  # Laps per driver in the session rendered by the page benchmark
+RENDER_REPEATS = 3
+STARTUP_SHELL = ["streamlit", "streamlit_option_menu", "page_registry", "metrics", "log_capturer"]  # What app.py imports itself
+
+FULL = {
+    "latency_frames": 2000, "latency_rate": 500,
+    "throughput_rates": [1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000], "throughput_seconds": 2.0,
+    "memory_hours": 8, "memory_karts": 50,
+    "render_drivers": [10, 100, 1000],
+    "startup_repeats": 5,
+    "export_sessions": 30, "export_karts": 40, "export_laps": 30,
+}
+QUICK = {
+    "latency_frames": 300, "latency_rate": 300,
+    "throughput_rates": [1000, 5000], "throughput_seconds": 1.0,
+    "memory_hours": 1, "memory_karts": 20,
+    "render_drivers": [10, 100],
+    "startup_repeats": 2,
+    "export_sessions": 4, "export_karts": 20, "export_laps": 10,
+}
+
+def log(message):
+    print(message, file=sys.__stderr__, flush=True)
+
+def percentiles_ms(values_ns):
+    if not values_ns:
+        return {"count": 0}
+    values = np.asarray(values_ns, dtype=np.float64) / 1e6
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"count": len(values_ns), "p50_ms": p50, "p90_ms": p90, "p99_ms": p99, "max_ms": float(values.max())}
+
+# Every benchmark runs in a scratch directory with fresh storage and registry
+# singletons, so it never touches sippycup.db or rfid_database.csv
+@contextlib.contextmanager
+def workspace():
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="sippycup-bench-") as path:
+        os.chdir(path)
+        storage_module.storage = None
+        driver_registry_module.driver_registry = None
+        try:
+            yield path
+        finally:
+            os.chdir(previous)
+            storage_module.storage = None
+            driver_registry_module.driver_registry = None
+
+@contextlib.contextmanager
+def virtual_decoder(hub):
+    master, slave, path = open_virtual_port()
+    try:
+        hub.open_port(path, BAUD_RATE)
+        hub.start_race()
+        yield master
+    finally:
+        hub.stop_race()
+        hub.close_port(path)
+        os.close(master)
+        os.close(slave)
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+# Bytes on the port to a committed crossings row. Every frame carries a new
+# transponder so each one is a crossing, and the clock stops in the storage
+# commit hook. Transponders are interned before the clock starts, as they
+# would be for any kart already on the grid.
+def bench_latency(frames, rate):
+    with workspace():
+        hub = IngestionHub(PIPELINE_SETTINGS)
+        sent = {}
+        latencies = []
+
+        def committed(batch):
+            now = time.monotonic_ns()
+            for crossing in batch:
+                started = sent.pop(crossing[1], None)
+                if started is not None:
+                    latencies.append(now - started)
+
+        hub.storage.commit_listeners.append(committed)
+        with virtual_decoder(hub) as master:
+            start = time.monotonic()
+            for index in range(frames):
+                delay = start + index / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                rfid = make_epc(index)
+                sent[hub.transponders.intern(rfid)] = time.monotonic_ns()
+                os.write(master, rfid.encode("ascii") + LINE_ENDING)
+            wait_for(lambda: len(latencies) >= frames, DRAIN_TIMEOUT)
+        result = percentiles_ms(latencies)
+        result.update({"frames": frames, "rate": rate, "lost": frames - len(latencies)})
+        return result
+
+# Steps the offered read rate up until the pipeline stops keeping up: a step
+# is sustained when the generator held its schedule and every read was
+# processed and persisted within DRAIN_TIMEOUT. The generator shares the
+# process (and GIL) with the pipeline, so the ceiling is conservative.
+def bench_throughput(rates, seconds, karts=100):
+    steps = []
+    for rate in rates:
+        with workspace():
+            hub = IngestionHub(PIPELINE_SETTINGS)
+            with virtual_decoder(hub) as master:
+                generator = TrafficGenerator(master, random.Random(rate))
+                start = time.monotonic()
+                run(rate_events(karts, rate, random.Random(rate)), generator, duration=seconds)
+                elapsed = time.monotonic() - start
+                processed = wait_for(lambda: hub.get_filter_stats()["reads"] >= generator.frames, DRAIN_TIMEOUT)
+                drained = time.monotonic()
+                hub.storage.flush()
+                persisted = time.monotonic()
+                stats = hub.get_filter_stats()
+        achieved = generator.frames / elapsed if elapsed else 0.0
+        sustained = processed and achieved >= 0.95 * rate and persisted - start <= seconds + DRAIN_TIMEOUT
+        steps.append({
+            "offered_reads_per_s": rate,
+            "achieved_reads_per_s": achieved,
+            "frames": generator.frames,
+            "processed": stats["reads"],
+            "crossings": stats["reads"] - stats["dropped_reads"],
+            "drain_s": drained - start - elapsed,
+            "persist_s": persisted - drained,
+            "sustained": sustained,
+        })
+        log(f"throughput {rate}/s: achieved {achieved:.0f}/s, sustained={sustained}")
+        if not sustained:
+            break
+    sustained_rates = [step["offered_reads_per_s"] for step in steps if step["sustained"]]
+    return {"max_sustained_reads_per_s": max(sustained_rates, default=0), "steps": steps}
+
+# Feeds a simulated event straight into the hub on simulated time (no port,
+# no sleeping) and samples traced Python memory once per simulated hour
+def bench_memory(hours, karts, lap_time=40.0, burst=5):
+    with workspace():
+        hub = IngestionHub(PIPELINE_SETTINGS | {"min_lap_time": 5.0, "dedup_window_ms": 1000})
+        hub.start_race()
+        base_ns = time.monotonic_ns()
+        wall_offset = time.time_ns() - base_ns
+        events = simulated_events(karts, lap_time, 2.0, burst, 0.01, random.Random(0))
+        samples = []
+        frames = 0
+        started = time.perf_counter()
+        tracemalloc.start()
+        try:
+            for hour in range(hours + 1):
+                hub.storage.flush()
+                current, peak = tracemalloc.get_traced_memory()
+                samples.append({"hour": hour, "frames": frames, "traced_bytes": current, "peak_traced_bytes": peak})
+                if hour == hours:
+                    break
+                for offset, rfid in events:
+                    arrival_ns = base_ns + int(offset * 1e9)
+                    hub.handle_frame(Frame(rfid, arrival_ns, arrival_ns + wall_offset))
+                    frames += 1
+                    if offset >= (hour + 1) * 3600:
+                        break
+        finally:
+            tracemalloc.stop()
+        elapsed = time.perf_counter() - started
+        hub.stop_race()
+    # The first hour includes one-off allocations (sqlite caches, new states)
+    steady = samples[1:] if len(samples) > 2 else samples
+    growth = (steady[-1]["traced_bytes"] - steady[0]["traced_bytes"]) / max(steady[-1]["hour"] - steady[0]["hour"], 1)
+    return {
+        "hours": hours,
+        "karts": karts,
+        "frames": frames,
+        "elapsed_s": elapsed,
+        "growth_bytes_per_hour": growth,
+        "samples": samples,
+    }
+
+RENDER_SCRIPT = """
+import benchmark
+benchmark.render_page({page!r}, {drivers})
+"""
+
+class StaticRFIDs:
+    def __init__(self, rfids):
+        self.rfids = rfids
+
+    def get_detected_rfids(self):
+        return self.rfids
+
+def render_page(page, drivers):
+    if page == "lap_timer":
+        lap_timer_page()
+    else:
+        driver_setup_page(StaticRFIDs([make_epc(index) for index in range(drivers)]))
+
+def seed_drivers(drivers):
+    storage = get_storage()
+    rfids = [make_epc(index) for index in range(drivers)]
+    storage.upsert_drivers([
+        {"RFID": rfid, "Driver Name": f"Driver {index}", "Driver Number": str(index), "Driver Kart": "Kart 1", "Driver Kart CC": "125cc"}
+        for index, rfid in enumerate(rfids)
+    ])
+    session_id = storage.start_session("Benchmark")
+    rng = random.Random(drivers)
+    wall_ns = time.time_ns()
+    for rfid in rfids:
+        transponder_id = storage.transponder_id(rfid)
+        crossing_ns = rng.randrange(10**9)
+        for _ in range(RENDER_LAPS + 1):
+            storage.record_crossing(session_id, transponder_id, crossing_ns, wall_ns + crossing_ns)
+            crossing_ns += int(rng.gauss(40.0, 1.0) * 1e9)
+    storage.flush()
+
+# Whole-script runs through Streamlit's AppTest. The first run builds the hub
+# and registry caches and is reported as cold_ms; the reruns after it are what
+# a viewer sees on every interaction.
+def bench_render(sizes):
+    from streamlit.testing.v1 import AppTest
+    results = {}
+    for page in ["lap_timer", "driver_setup"]:
+        results[page] = {}
+        for drivers in sizes:
+            with workspace():
+                seed_drivers(drivers)
+                get_ingestion_hub.clear()
+                app = AppTest.from_string(RENDER_SCRIPT.format(page=page, drivers=drivers), default_timeout=300)
+                timings = []
+                for _ in range(RENDER_REPEATS + 1):
+                    started = time.perf_counter()
+                    app.run()
+                    if app.exception:
+                        raise RuntimeError(f"{page} failed to render with {drivers} drivers: {app.exception[0].message}")
+                    timings.append(time.perf_counter() - started)
+                get_ingestion_hub.clear()
+            cold, warm = timings[0], timings[1:]
+            results[page][str(drivers)] = {"cold_ms": cold * 1000, "median_ms": float(np.median(warm)) * 1000, "min_ms": min(warm) * 1000}
+            log(f"render {page} with {drivers} drivers: {results[page][str(drivers)]['median_ms']:.0f} ms")
+    return results
+
+# Runs the import statement in a fresh interpreter under -X importtime and
+# returns its wall time with (name, self_us, cumulative_us, depth) for every
+# module loaded, in load order; depth 0 is an import made by the statement
+# itself or by interpreter startup
+def import_times(statement):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], cwd=REPO_DIR, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode:
+        raise RuntimeError(f"{statement!r} failed: {result.stderr.strip().splitlines()[-1]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return elapsed, entries
+
+def top_level_ms(entries, modules):
+    return sum(cumulative for name, _, cumulative, depth in entries if depth == 0 and name in modules) / 1000
+
+def startup_statement(modules):
+    return "; ".join(f"import {module}" for module in modules)
+
+# Cold start is the app shell plus the default page, which is all app.py
+# imports before the first screen; eager_ms is what it cost when every page
+# was imported up front. Each page is measured on top of the shell, as it is
+# imported on first navigation. The reruns then time whole app.py runs
+# through AppTest, which is the overhead of every interaction.
+def bench_startup(repeats):
+    from streamlit.testing.v1 import AppTest
+    from page_registry import PAGES, DEFAULT_PAGE
+    pages = [page.module for page in PAGES]
+    cold, process, shell = [], [], []
+    per_page = {page.name: [] for page in PAGES}
+    eager = []
+    for _ in range(repeats):
+        elapsed, entries = import_times(startup_statement(STARTUP_SHELL + [DEFAULT_PAGE.module]))
+        process.append(elapsed * 1000)
+        shell.append(top_level_ms(entries, STARTUP_SHELL))
+        cold.append(top_level_ms(entries, STARTUP_SHELL + [DEFAULT_PAGE.module]))
+        for page in PAGES:
+            _, entries = import_times(startup_statement(STARTUP_SHELL + [page.module]))
+            per_page[page.name].append(top_level_ms(entries, [page.module]))
+        _, entries = import_times(startup_statement(STARTUP_SHELL + pages))
+        eager.append(top_level_ms(entries, STARTUP_SHELL + pages))
+    heaviest = sorted(entries, key=lambda entry: -entry[1])[:10]  # By own time, from the last every-page run
+    results = {
+        "repeats": repeats,
+        "cold_start_ms": float(np.median(cold)),
+        "process_ms": float(np.median(process)),
+        "shell_ms": float(np.median(shell)),
+        "eager_ms": float(np.median(eager)),
+        "pages_ms": {name: float(np.median(values)) for name, values in per_page.items()},
+        "heaviest_imports": [{"module": name, "self_ms": self_us / 1000} for name, self_us, _, _ in heaviest],
+    }
+    log(f"cold start {results['cold_start_ms']:.0f} ms of imports ({results['process_ms']:.0f} ms process), {results['eager_ms']:.0f} ms with every page")
+    stdout, stderr = sys.stdout, sys.stderr
+    with workspace():
+        get_ingestion_hub.clear()
+        app = AppTest.from_file(os.path.join(REPO_DIR, "app.py"), default_timeout=300)
+        timings = []
+        try:
+            for _ in range(RENDER_REPEATS + 1):
+                started = time.perf_counter()
+                app.run()
+                if app.exception:
+                    raise RuntimeError(f"app.py failed to run: {app.exception[0].message}")
+                timings.append(time.perf_counter() - started)
+        finally:
+            # app.py hands both streams to the log capturer
+            sys.stdout, sys.stderr = stdout, stderr
+            get_ingestion_hub.clear()
+    results["first_run_ms"] = timings[0] * 1000
+    results["rerun_ms"] = float(np.median(timings[1:])) * 1000
+    log(f"app.py first run {results['first_run_ms']:.0f} ms, rerun {results['rerun_ms']:.1f} ms")
+    return results
+
+def seed_event(sessions, karts, laps):
+    storage = get_storage()
+    rfids = [make_epc(index) for index in range(karts)]
+    storage.upsert_drivers([
+        {"RFID": rfid, "Driver Name": f"Driver {index}", "Driver Number": str(index), "Driver Kart": "Kart 1", "Driver Kart CC": "125cc"}
+        for index, rfid in enumerate(rfids)
+    ])
+    transponder_ids = [storage.transponder_id(rfid) for rfid in rfids]
+    rng = random.Random(sessions)
+    for session in range(sessions):
+        session_id = storage.start_session(f"Heat {session + 1}")
+        wall_ns = time.time_ns()
+        for transponder_id in transponder_ids:
+            crossing_ns = rng.randrange(10**9)
+            lap_ns = None
+            for _ in range(laps + 1):
+                storage.record_crossing(session_id, transponder_id, crossing_ns, wall_ns + crossing_ns, lap_ns)
+                lap_ns = int(rng.gauss(40.0, 1.0) * 1e9)
+                crossing_ns += lap_ns
+        storage.end_session(session_id)
+    storage.flush()
+
+def wait_for_job(job):
+    while job.running:
+        time.sleep(0.05)
+    if job.errors:
+        raise RuntimeError(f"{job.name} failed: {job.errors[0]}")
+    return job.elapsed
+
+# A whole event exported in every available format, then a second export in
+# which every session is unchanged, then the reports for one session through
+# the process pool the dashboard uses (pool start-up included)
+def bench_export(sessions, karts, laps):
+    from export import export_sessions, available_formats
+    from jobs import JobRunner
+    results = {"sessions": sessions, "karts": karts, "laps": laps, "formats": {}}
+    with workspace() as path:
+        seed_event(sessions, karts, laps)
+        for fmt in available_formats():
+            directory = os.path.join(path, "exports-" + fmt)
+            started = time.perf_counter()
+            exported = export_sessions(directory=directory, fmt=fmt)
+            elapsed = time.perf_counter() - started
+            started = time.perf_counter()
+            export_sessions(directory=directory, fmt=fmt)
+            unchanged = time.perf_counter() - started
+            size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+            results["formats"][fmt] = {
+                "rows": sum(result.rows for result in exported),
+                "export_ms": elapsed * 1000,
+                "unchanged_ms": unchanged * 1000,
+                "bytes": size,
+            }
+            log(f"export {fmt}: {results['formats'][fmt]['rows']} crossings in {elapsed * 1000:.0f} ms, {size} bytes")
+        runner = JobRunner({"report_dir": os.path.join(path, "reports")})
+        try:
+            elapsed = wait_for_job(runner.start_reports(get_storage().latest_session()))
+        finally:
+            runner.close()
+        results["reports_ms"] = elapsed * 1000
+        log(f"reports for {karts} drivers: {elapsed * 1000:.0f} ms")
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Headline numbers, flat so two result files can be compared key by key
+def summarize(results):
+    summary = {}
+    if "latency" in results:
+        summary["latency_p50_ms"] = results["latency"].get("p50_ms")
+        summary["latency_p99_ms"] = results["latency"].get("p99_ms")
+    if "throughput" in results:
+        summary["max_sustained_reads_per_s"] = results["throughput"]["max_sustained_reads_per_s"]
+    if "memory" in results:
+        summary["memory_growth_bytes_per_hour"] = results["memory"]["growth_bytes_per_hour"]
+    if "render" in results:
+        for page, sizes in results["render"].items():
+            for drivers, timing in sizes.items():
+                summary[f"render_{page}_{drivers}_ms"] = timing["median_ms"]
+    if "startup" in results:
+        summary["startup_cold_ms"] = results["startup"]["cold_start_ms"]
+        summary["startup_process_ms"] = results["startup"]["process_ms"]
+        summary["startup_rerun_ms"] = results["startup"]["rerun_ms"]
+    if "export" in results:
+        for fmt, timing in results["export"]["formats"].items():
+            summary[f"export_{fmt}_ms"] = timing["export_ms"]
+        summary["export_reports_ms"] = results["export"]["reports_ms"]
+    return summary
+
+def compare(summary, baseline_path):
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f).get("summary", {})
+    for key, value in summary.items():
+        previous = baseline.get(key)
+        if value is None or not previous:
+            continue
+        log(f"{key}: {previous:.3f} -> {value:.3f} ({(value - previous) / previous:+.1%})")
+
+def run_benchmarks(selected, sizes):
+    results = {}
+    if "latency" in selected:
+        log("Measuring port-to-storage latency...")
+        results["latency"] = bench_latency(sizes["latency_frames"], sizes["latency_rate"])
+    if "throughput" in selected:
+        log("Measuring sustained read throughput...")
+        results["throughput"] = bench_throughput(sizes["throughput_rates"], sizes["throughput_seconds"])
+    if "memory" in selected:
+        log(f"Simulating a {sizes['memory_hours']} hour event...")
+        results["memory"] = bench_memory(sizes["memory_hours"], sizes["memory_karts"])
+    if "render" in selected:
+        log("Timing page renders...")
+        results["render"] = bench_render(sizes["render_drivers"])
+    if "startup" in selected:
+        log("Measuring import time and reruns...")
+        results["startup"] = bench_startup(sizes["startup_repeats"])
+    if "export" in selected:
+        log("Exporting an event and generating reports...")
+        results["export"] = bench_export(sizes["export_sessions"], sizes["export_karts"], sizes["export_laps"])
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the timing pipeline and pages; results are written as JSON.")
+    parser.add_argument("benchmarks", nargs="*", help=f"Any of {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--quick", action="store_true", help="Smaller runs for a fast smoke check")
+    parser.add_argument("--output", help="Write results here instead of stdout")
+    parser.add_argument("--compare", help="Print changes against an earlier results file")
+    args = parser.parse_args()
+
+    sizes = QUICK if args.quick else FULL
+    selected = args.benchmarks or BENCHMARKS
+    unknown = sorted(set(selected) - set(BENCHMARKS))
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+    # The pipeline prints every read; keep that out of the results
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = run_benchmarks(selected, sizes)
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "summary": summarize(results),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2, default=float)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        compare(report["summary"], args.compare)
@@ -0,0 +1,62 @@
+import os
+import sys
+import argparse
+import compileall
+import subprocess
+import importlib.util
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+REQUIREMENTS_FILE = os.path.join(REPO_DIR, "requirements.txt")
+# Distribution names whose import name differs; anything else imports under
+# its name with dashes turned into underscores
+IMPORT_NAMES = {"pyserial": "serial"}
+# Not required; each is reported when missing along with what it enables
+OPTIONAL_PACKAGES = {"pyarrow": "Parquet and Arrow exports (CSV is used without it)"}
+
+def read_requirements(path=REQUIREMENTS_FILE):
+    packages = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                packages.append(line)
+    return packages
+
+def import_name(requirement):
+    name = requirement
+    for separator in "<>=!~[; ":
+        name = name.split(separator, 1)[0]
+    return IMPORT_NAMES.get(name.lower(), name.replace("-", "_"))
+
+# Looks each package up without importing it, so the check takes
+# milliseconds even for streamlit and pandas
+def missing_packages(requirements):
+    return [requirement for requirement in requirements if importlib.util.find_spec(import_name(requirement)) is None]
+
+def install(requirements):
+    subprocess.check_call([sys.executable, "-m", "pip", "install", *requirements])
+
+# One-time setup, run before the first `streamlit run app.py` and after
+# updating requirements.txt. app.py no longer checks or installs packages on
+# every rerun, so a missing one shows up here or as an ImportError.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that every package in requirements.txt is installed.")
+    parser.add_argument("--install", action="store_true", help="pip install any missing package")
+    parser.add_argument("--compile", action="store_true", help="Also byte-compile the app so the first start skips it")
+    args = parser.parse_args()
+
+    missing = missing_packages(read_requirements())
+    if missing and args.install:
+        print(f"Installing {', '.join(missing)}")
+        install(missing)
+        importlib.invalidate_caches()
+        missing = missing_packages(missing)
+    if missing:
+        print(f"Missing packages: {', '.join(missing)}. Run `python bootstrap.py --install` or `pip install -r requirements.txt`.")
+        sys.exit(1)
+    for package, purpose in OPTIONAL_PACKAGES.items():
+        if missing_packages([package]):
+            print(f"Optional package {package} is not installed: {purpose}")
+    if args.compile:
+        compileall.compile_dir(REPO_DIR, maxlevels=0, quiet=1)
+    print("All requirements are installed")
@@ -0,0 +1,94 @@
+import os
+import time
+import struct
+import datetime
+from collections import namedtuple
+
+CAPTURE_DIR = "captures"
+CAPTURE_MAGIC = b"SIPCAP01"
+CAPTURE_SUFFIX = ".sipcap"
+WRITE_BUFFER_SIZE = 64 * 1024
+
+KIND_FRAME = 0
+KIND_RACE_START = 1
+KIND_RACE_STOP = 2
+
+# Every record is a fixed 19-byte header followed by `length` bytes of frame
+# text (empty for race markers): kind, monotonic arrival_ns, wall_ns, length
+RECORD_HEADER = struct.Struct("<BqqH")
+
+CaptureRecord = namedtuple("CaptureRecord", ["kind", "arrival_ns", "wall_ns", "data"])
+
+def next_midnight_ns(wall_ns):
+    day = datetime.date.fromtimestamp(wall_ns / 1e9) + datetime.timedelta(days=1)
+    return int(time.mktime(day.timetuple())) * 1_000_000_000
+
+# Appends every raw frame, with the timestamps the reader gave it, to one
+# capture file per local day. Writes go through a 64 KiB buffer that is
+# flushed whenever the port goes idle, so a crash loses at most the reads of
+# the last busy stretch.
+class CaptureWriter:
+    def __init__(self, directory=CAPTURE_DIR):
+        self.directory = directory
+        self.file = None
+        self.path = None
+        self.rotate_at_ns = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def open_for(self, wall_ns):
+        self.close()
+        name = datetime.date.fromtimestamp(wall_ns / 1e9).isoformat() + CAPTURE_SUFFIX
+        self.path = os.path.join(self.directory, name)
+        self.file = open(self.path, "ab", buffering=WRITE_BUFFER_SIZE)
+        if self.file.tell() == 0:
+            self.file.write(CAPTURE_MAGIC)
+        self.rotate_at_ns = next_midnight_ns(wall_ns)
+
+    def write(self, kind, arrival_ns, wall_ns, data=b""):
+        if wall_ns >= self.rotate_at_ns:
+            self.open_for(wall_ns)
+        self.file.write(RECORD_HEADER.pack(kind, arrival_ns, wall_ns, len(data)))
+        if data:
+            self.file.write(data)
+
+    def write_frame(self, frame):
+        self.write(KIND_FRAME, frame.arrival_ns, frame.wall_ns, frame.data.encode("utf-8"))
+
+    def write_marker(self, kind):
+        self.write(kind, time.monotonic_ns(), time.time_ns())
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+# Yields CaptureRecords in file order. A record cut short by a crash ends the
+# file instead of raising.
+def read_capture(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(CAPTURE_MAGIC):
+        raise ValueError(f"{path} is not a capture file")
+    view = memoryview(data)
+    offset = len(CAPTURE_MAGIC)
+    header_size = RECORD_HEADER.size
+    end = len(data)
+    while offset + header_size <= end:
+        kind, arrival_ns, wall_ns, length = RECORD_HEADER.unpack_from(view, offset)
+        offset += header_size
+        if offset + length > end:
+            print(f"Ignoring a truncated record at the end of {path}")
+            break
+        yield CaptureRecord(kind, arrival_ns, wall_ns, str(view[offset:offset + length], "utf-8"))
+        offset += length
+
+def list_captures(directory=CAPTURE_DIR):
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.endswith(CAPTURE_SUFFIX))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in names]
@@ -1,5 +1,109 @@
 import streamlit as st
+import numpy as np
+import pandas as pd
+from lap_analytics import load_history, summarize, flag_outliers, rolling_mean
+from driver_registry import get_driver_registry
+from storage import get_storage, NOT_ASSIGNED
+from lap_timer import load_lap_table
+from live_refresh import live_fragment
+from jobs import get_job_runner
+
+ROLLING_WINDOW = 5
+JOB_REFRESH_INTERVAL = 1.0  # Seconds between progress updates while an export or report runs
+
+@st.cache_data(ttl=30, show_spinner=False)
+def load_lap_analytics(session_id):
+    drivers = get_driver_registry().all()
+    names = {row["RFID"]: row["Driver Name"] for row in drivers.to_dict("records") if row["Driver Name"] != NOT_ASSIGNED}
+    history = load_history(session_id, driver_names=names)
+    flags = flag_outliers(history)
+    clean = ~(flags[0] | flags[1] | flags[2])
+    return history, summarize(history, flags), clean
+
+# Exports and reports run off the script thread (see jobs.py); this panel
+# only starts them and polls their progress
+def results_panel(session_id):
+    runner = get_job_runner()
+    col1, col2 = st.columns(2)
+    with col1:
+        label = "Export All Sessions" if session_id is None else "Export Session"
+        if st.button(label, key="export_sessions", help="Write crossings and laps to the export dataset, one partition per session"):
+            runner.start_export(None if session_id is None else [session_id])
+    with col2:
+        if st.button("Generate Reports", key="generate_reports", disabled=session_id is None, help="Classification, lap chart and a sheet per driver for the selected session"):
+            runner.start_reports(session_id)
+    running = any(job is not None and job.running for job in (runner.job("export"), runner.job("reports")))
+    st.session_state.jobs_running = running
+    live_fragment(job_progress, run_every=JOB_REFRESH_INTERVAL if running else None)()
+
+def job_progress():
+    runner = get_job_runner()
+    jobs = [job for job in (runner.job("export"), runner.job("reports")) if job is not None]
+    for job in jobs:
+        if job.running:
+            st.progress(job.progress, text=f"{job.name}: {job.done}/{job.total or '?'}")
+        elif job.errors:
+            st.error(f"{job.name} finished with {len(job.errors)} errors: {job.errors[0]}")
+        else:
+            st.success(f"{job.name}: {len(job.outputs)} files written in {job.elapsed:.1f}s")
+    reports = runner.job("reports")
+    if reports is not None and not reports.running:
+        classification = next((path for path in reports.outputs if path.endswith("classification.html")), None)
+        if classification is not None:
+            st.caption(f"Reports in {classification.rsplit('classification.html', 1)[0]}")
+            try:
+                with open(classification, "rb") as f:
+                    st.download_button("Download Classification", f.read(), file_name="classification.html", mime="text/html", key="download_classification")
+            except OSError as e:
+                st.warning(f"Could not read {classification}: {e}")
+    # Stop polling once everything started from this page has finished
+    if st.session_state.get("jobs_running") and not any(job.running for job in jobs):
+        st.session_state.jobs_running = False
+        st.rerun()
 
 def dashboard_page():
     st.title("Dashboard")
-    st.write("This is the dashboard page.")
+
+    st.subheader("Live Leaderboard")
+    leaderboard = load_lap_table()
+    if not leaderboard.empty:
+        st.dataframe(leaderboard, hide_index=True)
+    else:
+        st.write("No crossings in the current session.")
+
+    sessions = get_storage().load_sessions()
+    session_options = [None] + sessions["id"].tolist()
+    session_names = dict(zip(sessions["id"], sessions["name"]))
+    session_id = st.selectbox("Session", session_options, format_func=lambda sid: "All sessions" if sid is None else session_names[sid])
+
+    st.subheader("Results")
+    results_panel(session_id)
+
+    history, summary, clean = load_lap_analytics(session_id)
+    if not history.laps.size:
+        st.write("No lap history yet.")
+        return
+
+    st.subheader("Driver Statistics")
+    column_config = {column: st.column_config.NumberColumn(format="%.3f") for column in ["Best", "Mean", "Std Dev", "P10", "P25", "Median", "P75", "P90"]}
+    column_config["Consistency %"] = st.column_config.NumberColumn(format="%.1f")
+    st.dataframe(summary, hide_index=True, column_config=column_config)
+
+    driver = st.selectbox("Driver", range(len(history.labels)), format_func=lambda g: history.labels[g])
+    start = history.starts[driver]
+    end = start + history.counts[driver]
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Lap Distribution")
+        laps = history.laps[start:end][clean[start:end]]
+        if laps.size:
+            counts, edges = np.histogram(laps, bins=min(50, max(laps.size // 5, 1)))
+            st.bar_chart(pd.DataFrame({"Laps": counts}, index=np.round((edges[:-1] + edges[1:]) / 2, 3)))
+        else:
+            st.write("No clean laps.")
+    with col2:
+        st.subheader(f"Rolling Average ({ROLLING_WINDOW} laps)")
+        rolling = rolling_mean(history, ROLLING_WINDOW, mask=clean)[start:end]
+        chart = pd.DataFrame({"Lap": history.laps[start:end], "Rolling Average": rolling})
+        st.line_chart(chart[clean[start:end]])
@@ -0,0 +1,440 @@
+import time
+import heapq
+import queue
+import asyncio
+import threading
+from collections import namedtuple
+import serial
+from serial import SerialException
+from ring_buffer import RingBuffer, DEFAULT_CAPACITY
+from metrics import metrics
+from ttl_interface import (
+    Frame, split_lines, decode_frame, READ_CHUNK_SIZE,
+    SERIAL_READS, SERIAL_BYTES, FRAME_PARSE_SECONDS, FRAME_QUEUE_SECONDS, FRAME_HANDLE_SECONDS,
+)
+from node_protocol import (
+    ClockOffset, DEFAULT_NODE_PORT, MSG_HELLO, MSG_FRAMES, MSG_ACK, MSG_PING, MSG_PONG,
+    HELLO, ACK, PING, PONG, pack_message, unpack_frames, read_message,
+)
+
+DEFAULT_MERGE_WINDOW_MS = 50  # How long a frame waits for earlier frames from slower loops
+MERGE_TICK = 0.005  # Seconds between releases of merged frames
+POLL_INTERVAL = 0.002  # Seconds between in_waiting checks where the loop cannot watch a port
+DEFAULT_NODE_WINDOW_MS = 250  # Added to the merge window when loops are read over the network
+PING_INTERVAL = 1.0  # Seconds between clock measurements of a connected node
+FAST_PING_INTERVAL = 0.1  # Until a node has half a window of samples
+
+# latency_ms is the decoder's own delay between a pass and its frame reaching
+# the port; it is taken off the frame's timestamps so loops with different
+# decoders line up. A loop is either a local serial port or a remote node
+# running node_agent.py.
+class TimingLoop(namedtuple("TimingLoop", ["loop_id", "com_port", "baud_rate", "latency_ms", "node"], defaults=(None,))):
+    __slots__ = ()
+
+    # The name the loop's frames are shown under
+    @property
+    def source(self):
+        return self.com_port or f"node:{self.node}"
+
+# The timing_loops list in settings.json, in track order starting at the
+# start/finish line, e.g. [{"port": "COM9", "baud_rate": 9600},
+# {"port": "COM10", "baud_rate": 9600, "latency_ms": 12}, {"node": "hairpin"}]
+def load_timing_loops(settings):
+    return [
+        TimingLoop(loop_id, entry.get("port"), entry.get("baud_rate", 9600), entry.get("latency_ms", 0), entry.get("node"))
+        for loop_id, entry in enumerate(settings.get("timing_loops") or [])
+    ]
+
+# Reorders frames from several loops by timestamp. A frame is held for
+# window_ns after its arrival so that a frame from a loop whose decoder or USB
+# adapter delivers later can still be placed ahead of it; frames with equal
+# timestamps keep their arrival order. released_ns is the timestamp of the
+# last frame handed on; a frame stamped before it can no longer be put in
+# order.
+class LoopMerger:
+    def __init__(self, window_ms=DEFAULT_MERGE_WINDOW_MS):
+        self.window_ns = int(window_ms * 1_000_000)
+        self.heap = []
+        self.seq = 0
+        self.released_ns = None
+
+    def push(self, loop_id, frame):
+        heapq.heappush(self.heap, (frame.arrival_ns, self.seq, loop_id, frame))
+        self.seq += 1
+
+    # (loop_id, frame) pairs that can no longer be preceded by a later push
+    def pop_ready(self, now_ns):
+        heap = self.heap
+        cutoff = now_ns - self.window_ns
+        ready = []
+        while heap and heap[0][0] <= cutoff:
+            self.released_ns, _, loop_id, frame = heapq.heappop(heap)
+            ready.append((loop_id, frame))
+        return ready
+
+    def is_late(self, arrival_ns):
+        return self.released_ns is not None and arrival_ns < self.released_ns
+
+    def drain(self):
+        return self.pop_ready(2**63 - 1)
+
+    def __len__(self):
+        return len(self.heap)
+
+# One decoder port read from the service's event loop. The loop watches the
+# port's file descriptor where it can (POSIX) and polls in_waiting otherwise
+# (Windows), so no port needs a thread of its own.
+class LoopReader:
+    def __init__(self, service, timing_loop, buffer_size=DEFAULT_CAPACITY):
+        self.service = service
+        self.timing_loop = timing_loop
+        self.loop_id = timing_loop.loop_id
+        self.com_port = timing_loop.source
+        self.baud_rate = timing_loop.baud_rate
+        self.latency_ns = int(timing_loop.latency_ms * 1_000_000)
+        self.serial_conn = None
+        self.watched = False
+        self.poller = None
+        self.running = False
+        self.buffer = bytearray()
+        self.received_data = RingBuffer(buffer_size)
+
+    def open(self, loop):
+        try:
+            self.serial_conn = serial.Serial(self.com_port, self.baud_rate, timeout=0)
+        except SerialException as e:
+            raise SerialException(f"Failed to open COM port {self.com_port}: {e}")
+        self.running = True
+        try:
+            loop.add_reader(self.serial_conn.fileno(), self.read_available)
+            self.watched = True
+        except (AttributeError, NotImplementedError):
+            self.poller = loop.create_task(self.poll())
+
+    def close(self, loop):
+        self.running = False
+        if self.watched:
+            loop.remove_reader(self.serial_conn.fileno())
+            self.watched = False
+        if self.poller is not None:
+            self.poller.cancel()
+        if self.serial_conn is not None:
+            self.serial_conn.close()
+
+    async def poll(self):
+        while self.running:
+            try:
+                waiting = self.serial_conn.in_waiting
+            except Exception as e:
+                self.fail(e)
+                return
+            if waiting:
+                self.read_available()
+            else:
+                await asyncio.sleep(POLL_INTERVAL)
+
+    def read_available(self):
+        try:
+            chunk = self.serial_conn.read(READ_CHUNK_SIZE)
+            arrival_ns = time.monotonic_ns()
+        except Exception as e:
+            self.fail(e)
+            return
+        if not chunk:
+            return
+        self.buffer += chunk
+        split_lines(self.buffer, lambda raw: self.queue_frame(raw, arrival_ns))
+        if metrics.enabled:
+            SERIAL_READS.inc()
+            SERIAL_BYTES.inc(len(chunk))
+            FRAME_PARSE_SECONDS.observe((time.monotonic_ns() - arrival_ns) / 1e9)
+
+    def queue_frame(self, raw, arrival_ns):
+        line = decode_frame(raw)
+        if line:
+            arrival_ns -= self.latency_ns
+            self.service.merger.push(self.loop_id, Frame(line, arrival_ns, self.service.wall_time_ns(arrival_ns)))
+
+    def fail(self, error):
+        if self.running:
+            print(f"Error reading from COM port {self.com_port}: {error}")
+            self.running = False
+            if self.watched:
+                asyncio.get_running_loop().remove_reader(self.serial_conn.fileno())
+                self.watched = False
+
+    def read_since(self, cursor):
+        return self.received_data.read_since(cursor)
+
+    def is_active(self):
+        return self.running
+
+# A loop whose decoder sits on another machine. Its node_agent connects to the
+# service's TCP server and sends batches of frames stamped with the node's
+# own monotonic clock. Ping exchanges on the same connection estimate the
+# node's clock offset, and every frame is moved onto our clock before it is
+# merged. Frames that arrive before the first estimate are held until it
+# exists; frames already received from the node's boot are dropped, since
+# the agent resends whatever was not acknowledged when a link drops. Frames
+# a node held or spooled through an outage can be older than what the merger
+# has already released, so they can no longer be merged. They are dispatched
+# straight away instead, in the node's own order: the pipeline records them
+# (and the capture keeps them for replay), laps follow since one loop's
+# crossings stay in order, and the sector timer skips any that land behind
+# a transponder's later crossings.
+class RemoteLoop:
+    def __init__(self, service, timing_loop, buffer_size=DEFAULT_CAPACITY):
+        self.service = service
+        self.timing_loop = timing_loop
+        self.loop_id = timing_loop.loop_id
+        self.node = timing_loop.node
+        self.com_port = timing_loop.source
+        self.baud_rate = None
+        self.latency_ns = int(timing_loop.latency_ms * 1_000_000)
+        self.clock = ClockOffset()
+        self.boot_id = None
+        self.last_seq = 0
+        self.held = []
+        self.late = False  # Whether the last frame was late, so an outage's backlog is reported once
+        self.writer = None
+        self.received_data = RingBuffer(buffer_size)
+        labels = {"node": self.node}
+        self.late_frames = metrics.counter("sippycup_node_late_frames_total", "Frames from a node dispatched unmerged, being older than frames already dispatched", labels)
+        metrics.gauge("sippycup_node_connected", "Whether a timing node is connected", labels, fn=lambda: int(self.writer is not None))
+        metrics.gauge("sippycup_node_clock_offset_seconds", "Estimated node clock minus central clock", labels, fn=lambda: (self.clock.offset_ns or 0) / 1e9)
+        metrics.gauge("sippycup_node_round_trip_seconds", "Round trip of the ping the offset estimate comes from", labels, fn=lambda: (self.clock.delay_ns or 0) / 1e9)
+
+    async def serve(self, reader, writer, boot_id):
+        if self.writer is not None:
+            # The node reconnected before we noticed its old link was gone
+            self.writer.close()
+        if boot_id != self.boot_id:
+            self.boot_id = boot_id
+            self.last_seq = 0
+            self.clock.reset()
+        self.writer = writer
+        print(f"Timing node {self.node!r} connected from {writer.get_extra_info('peername')}")
+        writer.write(pack_message(MSG_ACK, ACK.pack(self.last_seq)))
+        pinger = asyncio.get_running_loop().create_task(self.ping(writer))
+        try:
+            while True:
+                kind, payload = await read_message(reader)
+                if kind == MSG_FRAMES:
+                    self.receive_frames(payload)
+                    writer.write(pack_message(MSG_ACK, ACK.pack(self.last_seq)))
+                elif kind == MSG_PONG:
+                    t0, t1, t2 = PONG.unpack(payload)
+                    self.clock.add(t0, t1, t2, time.monotonic_ns())
+                    if self.held:
+                        held, self.held = self.held, []
+                        for arrival_ns, text in held:
+                            self.push(arrival_ns, text)
+        finally:
+            pinger.cancel()
+            if self.writer is writer:
+                self.writer = None
+                print(f"Timing node {self.node!r} disconnected")
+
+    async def ping(self, writer):
+        while True:
+            writer.write(pack_message(MSG_PING, PING.pack(time.monotonic_ns())))
+            await asyncio.sleep(FAST_PING_INTERVAL if len(self.clock.samples) < self.clock.samples.maxlen // 2 else PING_INTERVAL)
+
+    def receive_frames(self, payload):
+        for seq, arrival_ns, wall_ns, text in unpack_frames(payload):
+            if seq <= self.last_seq:
+                continue
+            self.last_seq = seq
+            if self.clock.offset_ns is None:
+                self.held.append((arrival_ns, text))
+            else:
+                self.push(arrival_ns, text)
+
+    def push(self, node_arrival_ns, text):
+        arrival_ns = self.clock.to_local(node_arrival_ns) - self.latency_ns
+        frame = Frame(text, arrival_ns, self.service.wall_time_ns(arrival_ns))
+        if self.service.merger.is_late(arrival_ns):
+            self.late_frames.inc()
+            if not self.late:
+                print(f"Timing node {self.node!r} is catching up; dispatching frames older than the merged stream unmerged")
+            self.late = True
+            self.service.frames.put((self.loop_id, frame))
+            return
+        self.late = False
+        self.service.merger.push(self.loop_id, frame)
+
+    def close(self, loop):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def read_since(self, cursor):
+        return self.received_data.read_since(cursor)
+
+    def is_active(self):
+        return self.writer is not None
+
+# Reads every timing loop's decoder on one asyncio event loop and hands their
+# frames to callback(loop_id, frame) in timestamp order. Reading and merging
+# run on the event loop thread; callbacks run on a single dispatch thread, as
+# in TTLInterface, so slow pipeline work never delays a timestamp. All loops
+# share one clock anchor, so their timestamps are directly comparable. Remote
+# loops are served on node_address on the same event loop; frames from the
+# network arrive later than local ones, so their presence widens the merge
+# window by node_window_ms.
+class DecoderService:
+    def __init__(self, callback, timing_loops, idle_callback=None, idle_interval=0.1, merge_window_ms=DEFAULT_MERGE_WINDOW_MS, buffer_size=DEFAULT_CAPACITY,
+                 node_address=("0.0.0.0", DEFAULT_NODE_PORT), node_window_ms=DEFAULT_NODE_WINDOW_MS):
+        self.callback = callback
+        self.idle_callback = idle_callback  # Called with monotonic_ns() when no frame was dispatched for idle_interval
+        self.idle_interval = idle_interval
+        self.timing_loops = list(timing_loops)
+        # A frame shifted back by its loop's latency must still land inside the
+        # window, so the largest correction is added to it
+        window_ms = merge_window_ms + max((loop.latency_ms for loop in self.timing_loops), default=0)
+        if any(loop.node for loop in self.timing_loops):
+            window_ms += node_window_ms
+        self.merger = LoopMerger(window_ms)
+        self.readers = [
+            RemoteLoop(self, timing_loop, buffer_size) if timing_loop.node else LoopReader(self, timing_loop, buffer_size)
+            for timing_loop in self.timing_loops
+        ]
+        self.remotes = {reader.node: reader for reader in self.readers if isinstance(reader, RemoteLoop)}
+        self.node_address = node_address
+        self.server = None
+        self.node_tasks = set()
+        self.frames = queue.Queue()
+        self.clock_anchor = None
+        self.loop = None
+        self.stopping = None
+        self.thread = None
+        self.dispatch_thread = None
+        self.started = threading.Event()
+        self.error = None
+
+    def start(self):
+        self.clock_anchor = (time.monotonic_ns(), time.time_ns())
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(),), daemon=True)
+        self.dispatch_thread = threading.Thread(target=self.dispatch_frames, daemon=True)
+        self.dispatch_thread.start()
+        self.thread.start()
+        self.started.wait()
+        if self.error is not None:
+            self.thread.join()
+            self.frames.put(None)
+            self.dispatch_thread.join()
+            raise self.error
+
+    def stop(self):
+        if self.loop is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        if self.thread:
+            self.thread.join()
+        self.frames.put(None)  # Wake the dispatcher so it can exit
+        if self.dispatch_thread:
+            self.dispatch_thread.join()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        opened = []
+        try:
+            for reader in self.readers:
+                if isinstance(reader, LoopReader):
+                    reader.open(self.loop)
+                    opened.append(reader)
+            if self.remotes:
+                host, port = self.node_address
+                try:
+                    self.server = await asyncio.start_server(self.serve_node, host, port)
+                except OSError as e:
+                    raise SerialException(f"Failed to listen for timing nodes on {host}:{port}: {e}")
+                print(f"Listening for timing nodes {', '.join(self.remotes)} on {host}:{port}")
+        except SerialException as e:
+            self.error = e
+        self.started.set()
+        try:
+            if self.error is None:
+                await self.release_frames()
+        finally:
+            if self.server is not None:
+                # Closing the links ends each node's handler with a short read
+                self.server.close()
+                for remote in self.remotes.values():
+                    remote.close(self.loop)
+                if self.node_tasks:
+                    await asyncio.wait(self.node_tasks, timeout=1.0)
+                await self.server.wait_closed()
+            for reader in opened:
+                reader.close(self.loop)
+            for item in self.merger.drain():
+                self.frames.put(item)
+
+    async def release_frames(self):
+        while not self.stopping.is_set():
+            for item in self.merger.pop_ready(time.monotonic_ns()):
+                self.frames.put(item)
+            try:
+                await asyncio.wait_for(self.stopping.wait(), MERGE_TICK)
+            except asyncio.TimeoutError:
+                pass
+
+    async def serve_node(self, reader, writer):
+        task = asyncio.current_task()
+        self.node_tasks.add(task)
+        try:
+            kind, payload = await read_message(reader)
+            if kind != MSG_HELLO:
+                raise ValueError(f"expected a hello, got message type {kind}")
+            boot_id, = HELLO.unpack_from(payload)
+            node = str(payload[HELLO.size:], "utf-8")
+            remote = self.remotes.get(node)
+            if remote is None:
+                raise ValueError(f"unknown node {node!r}, expected one of {sorted(self.remotes)}")
+            await remote.serve(reader, writer, boot_id)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            print(f"Timing node link from {writer.get_extra_info('peername')} lost: {e or type(e).__name__}")
+        except ValueError as e:
+            print(f"Rejected timing node connection from {writer.get_extra_info('peername')}: {e}")
+        finally:
+            writer.close()
+            self.node_tasks.discard(task)
+
+    def wall_time_ns(self, arrival_ns):
+        anchor_mono, anchor_wall = self.clock_anchor
+        return anchor_wall + (arrival_ns - anchor_mono)
+
+    def dispatch_frames(self):
+        timeout = self.idle_interval if self.idle_callback else None
+        readers = {reader.loop_id: reader for reader in self.readers}
+        while True:
+            try:
+                item = self.frames.get(timeout=timeout)
+            except queue.Empty:
+                try:
+                    self.idle_callback(time.monotonic_ns())
+                except Exception as e:
+                    print(f"Error in idle callback: {e}")
+                continue
+            if item is None:
+                break
+            loop_id, frame = item
+            readers[loop_id].received_data.append(frame.data)
+            started_ns = time.monotonic_ns() if metrics.enabled else None
+            try:
+                self.callback(loop_id, frame)
+            except Exception as e:
+                print(f"Error handling frame {frame.data} from loop {loop_id}: {e}")
+            if started_ns is not None:
+                FRAME_QUEUE_SECONDS.observe((started_ns - frame.arrival_ns) / 1e9)
+                FRAME_HANDLE_SECONDS.observe((time.monotonic_ns() - started_ns) / 1e9)
+
+    def get_reader(self, com_port):
+        for reader in self.readers:
+            if reader.com_port == com_port:
+                return reader
+        return None
+
+    # Running, even while remote nodes are still to connect
+    def is_active(self):
+        return self.thread is not None and self.thread.is_alive() and (bool(self.remotes) or any(reader.is_active() for reader in self.readers))
@@ -0,0 +1,127 @@
+import os
+import time
+import threading
+import pandas as pd
+from storage import get_storage, DRIVER_CSV, DRIVER_COLUMNS, NOT_ASSIGNED
+
+REFRESH_INTERVAL = 1.0  # Seconds between change checks on the lookup path
+
+def unassigned_driver(rfid):
+    return {
+        "RFID": rfid,
+        "Driver Name": NOT_ASSIGNED,
+        "Driver Number": NOT_ASSIGNED,
+        "Driver Kart": NOT_ASSIGNED,
+        "Driver Kart CC": NOT_ASSIGNED
+    }
+
+# One in-memory copy of the driver table for the whole process, keyed on RFID
+# and driver number. It reloads only when storage reports a driver write or
+# rfid_database.csv differs (mtime/size) from the copy last imported or
+# exported, as recorded in the database, and the CSV is then re-imported in
+# place of the table. The CSV is rewritten after every write made through the
+# registry so it stays a usable hand-editable copy.
+class DriverRegistry:
+    def __init__(self, storage=None, csv_path=DRIVER_CSV):
+        self.storage = storage or get_storage()
+        self.csv_path = csv_path
+        self.by_rfid = {}
+        self.by_number = {}
+        self.version = None
+        self.checked_at = 0.0
+        self.lock = threading.RLock()
+        self.refresh(force=True)
+
+    def stat_csv(self):
+        try:
+            stat = os.stat(self.csv_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.checked_at < REFRESH_INTERVAL:
+            return
+        with self.lock:
+            self.checked_at = now
+            csv_stat = self.stat_csv()
+            if csv_stat is not None and csv_stat != self.storage.driver_csv_stat():
+                self.storage.import_driver_csv(self.csv_path)
+            version = self.storage.drivers_version()
+            if version == self.version:
+                return
+            by_rfid = {}
+            by_number = {}
+            for row in self.storage.load_drivers().to_dict("records"):
+                by_rfid[row["RFID"]] = row
+                if row["Driver Number"] != NOT_ASSIGNED:
+                    by_number[row["Driver Number"]] = row
+            self.by_rfid = by_rfid
+            self.by_number = by_number
+            self.version = version
+
+    def get(self, rfid):
+        self.refresh()
+        return self.by_rfid.get(rfid)
+
+    def get_by_number(self, number):
+        self.refresh()
+        return self.by_number.get(str(number))
+
+    def __contains__(self, rfid):
+        self.refresh()
+        return rfid in self.by_rfid
+
+    # Unknown RFIDs come back as "Not Assigned" rows, in input order
+    def lookup_many(self, rfids):
+        self.refresh()
+        by_rfid = self.by_rfid
+        return [by_rfid.get(rfid) or unassigned_driver(rfid) for rfid in rfids]
+
+    def upsert_many(self, rows):
+        with self.lock:
+            self.storage.upsert_drivers(rows)
+            self.export_csv()
+            self.refresh(force=True)
+
+    def add(self, rfid):
+        with self.lock:
+            added = self.storage.add_driver(rfid)
+            if added:
+                self.export_csv()
+                self.refresh(force=True)
+            return added
+
+    def remove(self, rfid):
+        with self.lock:
+            self.storage.delete_driver(rfid)
+            self.export_csv()
+            self.refresh(force=True)
+
+    def all(self):
+        self.refresh()
+        return pd.DataFrame(list(self.by_rfid.values()), columns=DRIVER_COLUMNS)
+
+    def export_csv(self):
+        try:
+            self.storage.load_drivers().to_csv(self.csv_path, index=False)
+        except OSError as e:
+            print(f"Error exporting drivers to {self.csv_path}: {e}")
+            return
+        # Our own write must not look like an external edit
+        csv_stat = self.stat_csv()
+        if csv_stat is not None:
+            conn = self.storage.connection()
+            with conn:
+                self.storage.set_driver_csv_stat(conn, csv_stat)
+
+driver_registry = None
+driver_registry_lock = threading.Lock()
+
+def get_driver_registry():
+    global driver_registry
+    with driver_registry_lock:
+        if driver_registry is None:
+            driver_registry = DriverRegistry()
+        return driver_registry
@@ -1,21 +1,12 @@
 import streamlit as st
-import pandas as pd
-import csv
-
-DATABASE = "rfid_database.csv"
+from driver_registry import get_driver_registry
 
 def load_database():
-    try:
-        df = pd.read_csv(DATABASE)
-        if df.empty:
-            df = pd.DataFrame(columns=["RFID", "Driver Name", "Driver Number", "Driver Kart", "Driver Kart CC"])
-    except FileNotFoundError:
-        df = pd.DataFrame(columns=["RFID", "Driver Name", "Driver Number", "Driver Kart", "Driver Kart CC"])
-    return df
+    return get_driver_registry().all()
 
-def save_database(data):
+def save_database(rows):
     try:
-        data.to_csv(DATABASE, index=False)
+        get_driver_registry().upsert_many(rows)
         st.success("Database saved successfully.")
     except Exception as e:
         st.error(f"Error saving to database: {e}")
@@ -23,35 +14,10 @@ def save_database(data):
 def driver_setup_page(rfid_interface):
     st.title("Driver Setup")
 
-    data = load_database()
-
-    # Ensure the first row (header) is ignored
-    data = data.reset_index(drop=True)
-    if not data.empty and data.iloc[0].isnull().all():
-        data = data.drop(data.index[0])
-
     detected_rfids = rfid_interface.get_detected_rfids()
 
-    rfid_table = []
-    for rfid in detected_rfids:
-        details = data[data["RFID"] == rfid]
-        if details.empty:
-            details = {
-                "Driver Name": "Not Assigned",
-                "Driver Number": "Not Assigned",
-                "Driver Kart": "Not Assigned",
-                "Driver Kart CC": "Not Assigned"
-            }
-        else:
-            details = details.iloc[0].to_dict()
-        
-        rfid_table.append({
-            "RFID": rfid,
-            "Driver Name": details["Driver Name"],
-            "Driver Number": details["Driver Number"],
-            "Driver Kart": details["Driver Kart"],
-            "Driver Kart CC": details["Driver Kart CC"]
-        })
+    # One dict lookup per RFID instead of filtering the whole table each time
+    rfid_table = get_driver_registry().lookup_many(detected_rfids)
 
     if rfid_table:
         for row in rfid_table:
@@ -69,8 +35,13 @@ def driver_setup_page(rfid_interface):
                     new_kart_cc = st.selectbox("Driver Kart CC", ["100cc", "125cc", "150cc"], key=f"kart_cc_{row['RFID']}")
                 with col6:
                     if st.button("Save", key=f"save_{row['RFID']}"):
-                        data.loc[data["RFID"] == row["RFID"], ["Driver Name", "Driver Number", "Driver Kart", "Driver Kart CC"]] = [new_name, new_number, new_kart, new_kart_cc]
-                        save_database(data)
+                        save_database([{
+                            "RFID": row["RFID"],
+                            "Driver Name": new_name,
+                            "Driver Number": new_number,
+                            "Driver Kart": new_kart,
+                            "Driver Kart CC": new_kart_cc
+                        }])
                         st.success(f"Driver {new_name} with RFID {row['RFID']} updated.")
                         st.session_state[f'edit_{row["RFID"]}'] = False
                         st.experimental_rerun()
@@ -0,0 +1,133 @@
+import math
+
+EWMA_ALPHA = 0.3  # Weight of the newest lap in the pace average
+SKETCH_ACCURACY = 0.01  # Relative error of sketch quantiles
+SKETCH_MAX_BUCKETS = 512
+
+# Log-bucketed quantile sketch: every value falls in a bucket whose bounds are
+# within SKETCH_ACCURACY of each other, so any quantile is answered to that
+# relative error. Counts of matching buckets simply add, which makes sketches
+# from different sessions mergeable. When the bucket limit is hit the lowest
+# buckets are folded together, keeping memory fixed at the expense of the
+# fastest (least interesting) tail.
+class QuantileSketch:
+    __slots__ = ("gamma", "log_gamma", "max_buckets", "buckets", "count")
+
+    def __init__(self, accuracy=SKETCH_ACCURACY, max_buckets=SKETCH_MAX_BUCKETS):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.count = 0
+
+    def add(self, value, count=1):
+        if value <= 0:
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        if len(self.buckets) > self.max_buckets:
+            self.collapse()
+
+    def collapse(self):
+        indexes = sorted(self.buckets)
+        excess = len(indexes) - self.max_buckets
+        folded = sum(self.buckets.pop(index) for index in indexes[:excess])
+        target = indexes[excess]
+        self.buckets[target] += folded
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # Midpoint of the bucket, in the sense that minimises relative error
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return None
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge quantile sketches with different accuracy")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        while len(self.buckets) > self.max_buckets:
+            self.collapse()
+
+# Constant-size running statistics for one transponder's laps, in seconds:
+# Welford mean/variance, min/max, an exponentially weighted pace and a
+# quantile sketch for median/p90
+class LapStats:
+    __slots__ = ("count", "mean", "m2", "min", "max", "ewma", "sketch")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.ewma = None
+        self.sketch = QuantileSketch()
+
+    def update(self, lap):
+        self.count += 1
+        delta = lap - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (lap - self.mean)
+        self.min = lap if self.min is None else min(self.min, lap)
+        self.max = lap if self.max is None else max(self.max, lap)
+        self.ewma = lap if self.ewma is None else EWMA_ALPHA * lap + (1 - EWMA_ALPHA) * self.ewma
+        self.sketch.add(lap)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+    # Sketch estimates are clamped to the exact extremes, which also makes them
+    # exact while every lap so far has been identical
+    def quantile(self, q):
+        value = self.sketch.quantile(q)
+        if value is None:
+            return None
+        return min(max(value, self.min), self.max)
+
+    @property
+    def median(self):
+        return self.quantile(0.5)
+
+    @property
+    def p90(self):
+        return self.quantile(0.9)
+
+    # Coefficient of variation mapped to 0-100, higher is steadier
+    @property
+    def consistency(self):
+        if self.count < 2 or not self.mean:
+            return None
+        return max(0.0, 100.0 * (1.0 - self.stddev / self.mean))
+
+    # Folds other in (Chan et al. parallel variance). The EWMA is
+    # order-dependent, so other's pace is taken as the more recent one.
+    def merge(self, other):
+        if not other.count:
+            return self
+        if not self.count:
+            self.mean, self.m2, self.min, self.max = other.mean, other.m2, other.min, other.max
+        else:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.m2 += other.m2 + delta * delta * self.count * other.count / count
+            self.mean += delta * other.count / count
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        self.count += other.count
+        self.ewma = other.ewma
+        self.sketch.merge(other.sketch)
+        return self
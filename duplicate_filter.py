@@ -0,0 +1,100 @@
+from collections import OrderedDict
+
+DEDUP_MODES = ["first", "last", "midpoint"]
+DEFAULT_WINDOW_MS = 1000
+DEFAULT_MIN_LAP_TIME = 5.0
+
+class Burst:
+    __slots__ = ("rfid", "first_ns", "first_wall_ns", "last_ns", "last_wall_ns", "reads", "emitted")
+
+    def __init__(self, rfid, arrival_ns, wall_ns):
+        self.rfid = rfid
+        self.first_ns = arrival_ns
+        self.first_wall_ns = wall_ns
+        self.last_ns = arrival_ns
+        self.last_wall_ns = wall_ns
+        self.reads = 1
+        self.emitted = False
+
+    def crossing(self, mode):
+        if mode == "first":
+            return self.first_ns, self.first_wall_ns
+        if mode == "last":
+            return self.last_ns, self.last_wall_ns
+        return (self.first_ns + self.last_ns) // 2, (self.first_wall_ns + self.last_wall_ns) // 2
+
+# Collapses the stream of repeated reads a decoder emits while a transponder
+# sits in the antenna field into one crossing per pass. A burst ends once a
+# transponder has not been seen for window_ms. Both maps are kept in
+# last-touched order so expiry only ever looks at the front. Transponders can
+# be keyed by any hashable value; the hub passes the EPC, so only reads
+# that become recorded crossings are ever interned.
+class DuplicateFilter:
+    def __init__(self, window_ms=DEFAULT_WINDOW_MS, min_lap_time=DEFAULT_MIN_LAP_TIME, mode="first"):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"Unknown dedup mode {mode!r}, expected one of {DEDUP_MODES}")
+        self.window_ns = int(window_ms * 1_000_000)
+        self.min_lap_ns = int(min_lap_time * 1_000_000_000)
+        self.mode = mode
+        self.bursts = OrderedDict()
+        self.last_crossings = OrderedDict()
+        self.reads = 0
+        self.dropped_reads = 0
+        self.rejected_crossings = 0
+
+    # Returns the crossings, as (rfid, crossing_ns, wall_ns), that became final
+    # with this read. In "first" mode that includes the read itself; in the
+    # other modes a crossing is only known once its burst has expired.
+    def feed(self, rfid, arrival_ns, wall_ns):
+        self.reads += 1
+        crossings = self.expire(arrival_ns)
+        burst = self.bursts.get(rfid)
+        if burst is not None:
+            burst.last_ns = arrival_ns
+            burst.last_wall_ns = wall_ns
+            burst.reads += 1
+            self.bursts.move_to_end(rfid)
+            self.dropped_reads += 1
+            return crossings
+        burst = self.bursts[rfid] = Burst(rfid, arrival_ns, wall_ns)
+        if self.mode == "first":
+            self.emit(burst, crossings)
+        return crossings
+
+    def expire(self, now_ns):
+        crossings = []
+        bursts = self.bursts
+        while bursts:
+            burst = next(iter(bursts.values()))
+            if now_ns - burst.last_ns <= self.window_ns:
+                break
+            bursts.popitem(last=False)
+            if not burst.emitted:
+                self.emit(burst, crossings)
+        last_crossings = self.last_crossings
+        while last_crossings:
+            rfid, crossing_ns = next(iter(last_crossings.items()))
+            if now_ns - crossing_ns < self.min_lap_ns:
+                break
+            last_crossings.popitem(last=False)
+        return crossings
+
+    def emit(self, burst, crossings):
+        burst.emitted = True
+        crossing_ns, wall_ns = burst.crossing(self.mode)
+        previous_ns = self.last_crossings.get(burst.rfid)
+        if previous_ns is not None and crossing_ns - previous_ns < self.min_lap_ns:
+            self.rejected_crossings += 1
+            self.dropped_reads += 1
+            return
+        self.last_crossings[burst.rfid] = crossing_ns
+        self.last_crossings.move_to_end(burst.rfid)
+        crossings.append((burst.rfid, crossing_ns, wall_ns))
+
+    def get_stats(self):
+        return {
+            "reads": self.reads,
+            "dropped_reads": self.dropped_reads,
+            "rejected_crossings": self.rejected_crossings,
+            "open_bursts": len(self.bursts),
+        }
@@ -0,0 +1,144 @@
+import os
+import time
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from storage import get_storage, NOT_ASSIGNED
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # Optional; without it exports are gzipped CSV
+    pa = None
+
+EXPORT_DIR = "exports"
+PARQUET = "parquet"
+ARROW = "arrow"
+CSV = "csv"
+FORMAT_SUFFIXES = {PARQUET: ".parquet", ARROW: ".arrow", CSV: ".csv.gz"}
+DEFAULT_COMPRESSION = "zstd"
+EXPORT_THREADS = 4  # Sessions written at once; SQLite reads and Arrow compression release the GIL
+CROSSINGS_DATASET = "crossings"
+SESSIONS_FILE = "sessions"
+
+ExportResult = namedtuple("ExportResult", ["session_id", "path", "rows", "skipped"])
+
+def available_formats():
+    return [PARQUET, ARROW, CSV] if pa is not None else [CSV]
+
+def default_format():
+    return PARQUET if pa is not None else CSV
+
+# Crossings are written as a Hive-partitioned dataset, one file per session:
+#
+#   exports/crossings/session_id=12/part-0.parquet
+#   exports/sessions.parquet
+#
+# so pd.read_parquet("exports/crossings") or pyarrow.dataset reads a whole
+# event with session_id restored from the directory names, and a session can
+# be read, replaced or deleted on its own.
+def partition_path(directory, session_id, fmt):
+    return os.path.join(directory, CROSSINGS_DATASET, f"session_id={session_id}", "part-0" + FORMAT_SUFFIXES[fmt])
+
+def sessions_path(directory, fmt):
+    return os.path.join(directory, SESSIONS_FILE + FORMAT_SUFFIXES[fmt])
+
+# One session's crossings in recorded order. Driver details are those at
+# export time; transponder, driver and number are categoricals, which become
+# dictionary-encoded columns. lap_number counts each transponder's completed
+# laps and is null, like lap_ns, on the crossing that started its first lap.
+def load_session_crossings(storage, session_id):
+    df = pd.read_sql_query(
+        """SELECT c.transponder_id, t.rfid, d.name AS driver, d.number AS driver_number,
+                  c.crossing_ns, c.wall_ns, c.lap_ns
+           FROM crossings c JOIN transponders t ON t.id = c.transponder_id
+           LEFT JOIN drivers d ON d.transponder_id = c.transponder_id
+           WHERE c.session_id = ? ORDER BY c.id""",
+        storage.connection(),
+        params=(session_id,),
+    )
+    df["transponder_id"] = df["transponder_id"].astype("int32")
+    for column in ["rfid", "driver", "driver_number"]:
+        df[column] = df[column].fillna(NOT_ASSIGNED).astype("category")
+    df["wall_time"] = pd.to_datetime(df["wall_ns"], unit="ns", utc=True)
+    df["lap_ns"] = df["lap_ns"].astype("Int64")
+    completed = df["lap_ns"].notna()
+    df["lap_number"] = pd.Series(pd.NA, index=df.index, dtype="Int32")
+    df.loc[completed, "lap_number"] = df.loc[completed].groupby("transponder_id").cumcount().astype("int32") + 1
+    return df.drop(columns=["wall_ns"])
+
+def load_sessions(storage):
+    df = storage.load_sessions().sort_values("id")
+    df["started"] = pd.to_datetime(df["started_wall_ns"], unit="ns", utc=True)
+    df["ended"] = pd.to_datetime(df["ended_wall_ns"], unit="ns", utc=True)
+    return df.rename(columns={"id": "session_id"})[["session_id", "name", "started", "ended"]]
+
+# Written next to the target and renamed over it, so a reader never sees a
+# half-written file and an interrupted export leaves the previous one
+def write_frame(df, path, fmt, compression):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + ".tmp"
+    if fmt == CSV:
+        df.to_csv(temporary, index=False, compression="gzip")
+    else:
+        if pa is None:
+            raise RuntimeError(f"{fmt} export needs pyarrow; install it or export as {CSV}")
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if fmt == PARQUET:
+            pq.write_table(table, temporary, compression=compression)
+        else:
+            feather.write_feather(table, temporary, compression=compression)
+    os.replace(temporary, path)
+
+def export_session(storage, session_id, directory, fmt, compression):
+    path = partition_path(directory, session_id, fmt)
+    df = load_session_crossings(storage, session_id)
+    write_frame(df, path, fmt, compression)
+    return ExportResult(session_id, path, len(df), False)
+
+# Exports the given sessions (default: all) and the session table. Sessions
+# that have ended and already have a partition are skipped unless overwrite
+# is set, so re-exporting after each race only writes the new one. progress
+# is called with each ExportResult as it completes, from a worker thread.
+def export_sessions(session_ids=None, directory=EXPORT_DIR, fmt=None, compression=DEFAULT_COMPRESSION, overwrite=False, progress=None, storage=None):
+    storage = storage or get_storage()
+    fmt = fmt or default_format()
+    if fmt not in FORMAT_SUFFIXES:
+        raise ValueError(f"Unknown export format {fmt!r}; expected one of {', '.join(FORMAT_SUFFIXES)}")
+    storage.flush()
+    sessions = load_sessions(storage)
+    if session_ids is not None:
+        sessions = sessions[sessions["session_id"].isin(session_ids)]
+    results, pending = [], []
+    for session_id, ended in zip(sessions["session_id"].tolist(), sessions["ended"].notna().tolist()):
+        path = partition_path(directory, session_id, fmt)
+        if ended and not overwrite and os.path.exists(path):
+            results.append(ExportResult(session_id, path, None, True))
+            if progress is not None:
+                progress(results[-1])
+        else:
+            pending.append(session_id)
+    write_frame(load_sessions(storage), sessions_path(directory, fmt), fmt, compression)
+    with ThreadPoolExecutor(max_workers=EXPORT_THREADS) as pool:
+        futures = [pool.submit(export_session, storage, session_id, directory, fmt, compression) for session_id in pending]
+        for future in futures:
+            results.append(future.result())
+            if progress is not None:
+                progress(results[-1])
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export crossings and laps with one partition per race session.")
+    parser.add_argument("sessions", nargs="*", type=int, help="Session ids to export (default: all)")
+    parser.add_argument("--output", default=EXPORT_DIR, help="Dataset directory")
+    parser.add_argument("--format", choices=list(FORMAT_SUFFIXES), default=default_format())
+    parser.add_argument("--compression", default=DEFAULT_COMPRESSION, help="Parquet or Arrow codec, e.g. zstd, lz4, snappy")
+    parser.add_argument("--overwrite", action="store_true", help="Rewrite sessions that were already exported")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    results = export_sessions(args.sessions or None, args.output, args.format, args.compression, args.overwrite)
+    written = [result for result in results if not result.skipped]
+    print(f"Exported {sum(result.rows for result in written)} crossings from {len(written)} sessions "
+          f"({len(results) - len(written)} unchanged) to {args.output} in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,329 @@
+import json
+import time
+import threading
+import streamlit as st
+from serial import SerialException
+from ttl_interface import TTLInterface
+from decoder_service import DecoderService, DEFAULT_MERGE_WINDOW_MS, DEFAULT_NODE_WINDOW_MS
+from node_protocol import DEFAULT_NODE_PORT
+from sector_timing import SectorTimer, FINISH_LOOP
+from ring_buffer import RingBuffer, DEFAULT_CAPACITY
+from lap_engine import LapEngine
+from storage import get_storage
+from duplicate_filter import DuplicateFilter, DEFAULT_WINDOW_MS, DEFAULT_MIN_LAP_TIME
+from metrics import metrics, configure_metrics
+from capture import CaptureWriter, CAPTURE_DIR, KIND_RACE_START, KIND_RACE_STOP
+
+SETTINGS_FILE = "settings.json"
+
+DEDUP_SECONDS = metrics.histogram("sippycup_dedup_seconds", "Time to pass one read through the duplicate filter")
+LAP_SECONDS = metrics.histogram("sippycup_lap_compute_seconds", "Time to apply one crossing to the lap engine and leaderboard")
+CROSSINGS_RECORDED = metrics.counter("sippycup_crossings_recorded_total", "Crossings recorded during a race")
+CROSSINGS_IGNORED = metrics.counter("sippycup_crossings_ignored_total", "Crossings dropped because no race was running")
+
+def load_settings():
+    try:
+        with open(SETTINGS_FILE, 'r') as f:
+            settings = json.load(f)
+    except FileNotFoundError:
+        settings = {}
+    return settings
+
+# Process-wide owner of the serial readers and the lap pipeline. Streamlit runs
+# every browser session in the same process, so sessions share one reader per
+# physical port and subscribe to published crossings with their own cursor
+# instead of each opening the port.
+class IngestionHub:
+    external = False
+
+    def __init__(self, settings=None):
+        settings = settings if settings is not None else load_settings()
+        self.buffer_size = settings.get("receive_buffer_size", DEFAULT_CAPACITY)
+        self.interfaces = {}
+        self.storage = get_storage()
+        self.session_id = self.storage.latest_session()
+        # Lap state is kept in memory and rebuilt from the stored crossings of
+        # the most recent session, which is the persistent record; a session
+        # that was never ended is resumed, so a restart mid-race keeps timing it
+        # EPCs are interned to the storage transponder ids when a crossing is
+        # recorded; the duplicate filters key on the EPC itself, so line noise
+        # and partial frames never become transponders rows
+        self.transponders = self.storage.transponders
+        self.lap_engine = LapEngine(transponders=self.transponders)
+        if self.session_id is not None:
+            for transponder_id, crossing_ns, wall_ns in self.storage.iter_crossings(self.session_id):
+                self.lap_engine.apply_crossing(transponder_id, crossing_ns, wall_ns)
+        dedup_settings = (
+            settings.get("dedup_window_ms", DEFAULT_WINDOW_MS),
+            settings.get("min_lap_time", DEFAULT_MIN_LAP_TIME),
+            settings.get("dedup_mode", "first"),
+        )
+        self.duplicate_filter = DuplicateFilter(*dedup_settings)
+        self.crossings = RingBuffer(self.buffer_size)
+        # Sector loops only exist once open_loops() starts a decoder service.
+        # Their reads have a filter of their own, keyed by (loop, transponder),
+        # so the finish-line statistics stay comparable with a single loop.
+        self.decoder_service = None
+        self.merge_window_ms = settings.get("loop_merge_window_ms", DEFAULT_MERGE_WINDOW_MS)
+        self.node_address = (settings.get("node_listen_host", "0.0.0.0"), settings.get("node_listen_port", DEFAULT_NODE_PORT))
+        self.node_window_ms = settings.get("node_merge_window_ms", DEFAULT_NODE_WINDOW_MS)
+        self.sector_filter = DuplicateFilter(*dedup_settings)
+        self.sectors = None
+        self.splits = RingBuffer(self.buffer_size)
+        self.sector_listeners = []
+        self.race_started = self.session_id is not None and self.storage.is_session_open(self.session_id)
+        self.race_generation = 0  # Incremented by each start_race, so views cached per race notice a restart
+        self.frame_listeners = []
+        self.crossing_listeners = []
+        self.race_listeners = []  # Called on start_race, under the pipeline lock, before any crossing of the race
+        self.lock = threading.Lock()  # Serialises the pipeline when several ports feed it
+        self.ports_lock = threading.Lock()
+        # Every raw frame is kept, race or not, so a race can be re-scored
+        # later with replay.py; set capture_dir to null to turn this off
+        capture_dir = settings.get("capture_dir", CAPTURE_DIR)
+        self.capture = CaptureWriter(capture_dir) if capture_dir else None
+        if self.capture is not None:
+            self.frame_listeners.append(self.capture.write_frame)
+        self.register_metrics()
+
+    # Depths and totals the pipeline already tracks are read at scrape time
+    def register_metrics(self):
+        duplicate_filter = self.duplicate_filter
+        interfaces = lambda: list(self.interfaces.values())
+        metrics.counter("sippycup_reads_total", "Reads seen by the duplicate filter", fn=lambda: duplicate_filter.reads)
+        metrics.counter("sippycup_duplicate_reads_total", "Repeated reads folded into an open burst", fn=lambda: duplicate_filter.dropped_reads)
+        metrics.counter("sippycup_rejected_crossings_total", "Crossings under the minimum lap time", fn=lambda: duplicate_filter.rejected_crossings)
+        metrics.gauge("sippycup_open_bursts", "Transponders currently inside the dedup window", fn=lambda: len(duplicate_filter.bursts))
+        metrics.gauge("sippycup_frame_queue_depth", "Frames parsed but not yet dispatched, across ports", fn=lambda: sum(interface.frames.qsize() for interface in interfaces()) + (self.decoder_service.frames.qsize() if self.decoder_service else 0))
+        metrics.gauge("sippycup_loop_merge_depth", "Frames held back to merge timing loops in timestamp order", fn=lambda: len(self.decoder_service.merger) if self.decoder_service else 0)
+        metrics.counter("sippycup_frame_ring_overwritten_total", "Raw frames overwritten in receive buffers before every viewer read them", fn=lambda: sum(interface.received_data.dropped for interface in interfaces()))
+        metrics.counter("sippycup_crossing_ring_overwritten_total", "Crossings overwritten in the published crossing ring", fn=lambda: self.crossings.dropped)
+        metrics.gauge("sippycup_ports_open", "Serial ports with a running reader", fn=lambda: sum(interface.is_active() for interface in interfaces()))
+
+    def open_port(self, com_port, baud_rate):
+        with self.ports_lock:
+            if self.decoder_service is not None and self.decoder_service.get_reader(com_port) is not None:
+                raise SerialException(f"{com_port} is already read as a timing loop")
+            interface = self.interfaces.get(com_port)
+            if interface is not None and interface.is_active():
+                if interface.baud_rate == baud_rate:
+                    return interface
+                interface.stop()
+            interface = TTLInterface(self.handle_frame, com_port, baud_rate, idle_callback=self.handle_idle, buffer_size=self.buffer_size)
+            interface.start()
+            self.interfaces[com_port] = interface
+            print(f"Opened {com_port} at {baud_rate} baud.")
+            return interface
+
+    def close_port(self, com_port):
+        with self.ports_lock:
+            interface = self.interfaces.pop(com_port, None)
+        if interface is not None:
+            interface.stop()
+            print(f"Closed {com_port}.")
+
+    # Reads every loop in timing_loops (see decoder_service) on one event loop
+    # in place of per-port readers. Loop 0 is the start/finish line and drives
+    # the lap pipeline exactly as a single port would; the others time sectors.
+    def open_loops(self, timing_loops):
+        for timing_loop in timing_loops:
+            if timing_loop.com_port in self.interfaces:
+                self.close_port(timing_loop.com_port)
+        with self.ports_lock:
+            if self.decoder_service is not None:
+                if self.decoder_service.is_active() and self.decoder_service.timing_loops == list(timing_loops):
+                    return self.decoder_service
+                self.decoder_service.stop()
+            service = DecoderService(self.handle_loop_frame, timing_loops, idle_callback=self.handle_idle,
+                                     merge_window_ms=self.merge_window_ms, buffer_size=self.buffer_size,
+                                     node_address=self.node_address, node_window_ms=self.node_window_ms)
+            with self.lock:
+                self.sectors = SectorTimer(len(service.timing_loops))
+            self.decoder_service = None
+            service.start()
+            self.decoder_service = service
+            ports = ", ".join(f"{loop.loop_id}: {loop.source}" for loop in service.timing_loops)
+            print(f"Reading timing loops {ports}.")
+            return service
+
+    def close_loops(self):
+        with self.ports_lock:
+            service, self.decoder_service = self.decoder_service, None
+        if service is not None:
+            service.stop()
+            print("Closed timing loops.")
+
+    def get_interface(self, com_port):
+        return self.interfaces.get(com_port)
+
+    def is_active(self, com_port=None):
+        if com_port is not None:
+            if self.get_loop_reader(com_port) is not None:
+                return self.decoder_service.is_active()
+            interface = self.interfaces.get(com_port)
+            return interface is not None and interface.is_active()
+        if self.decoder_service is not None and self.decoder_service.is_active():
+            return True
+        return any(interface.is_active() for interface in list(self.interfaces.values()))
+
+    def get_loop_reader(self, com_port):
+        service = self.decoder_service
+        return service.get_reader(com_port) if service is not None else None
+
+    def handle_frame(self, frame):
+        print(f"RFID detected: {frame.data}")
+        with self.lock:
+            for listener in self.frame_listeners:
+                listener(frame)
+            self.record_crossings(self.filter_frame(frame))
+
+    def filter_frame(self, frame):
+        if metrics.enabled:
+            started = time.perf_counter()
+            crossings = self.duplicate_filter.feed(frame.data, frame.arrival_ns, frame.wall_ns)
+            DEDUP_SECONDS.observe(time.perf_counter() - started)
+            return crossings
+        return self.duplicate_filter.feed(frame.data, frame.arrival_ns, frame.wall_ns)
+
+    # Frames from DecoderService, in timestamp order across loops. Both
+    # filters are expired against every frame, whichever loop it came from,
+    # so in "last" and "midpoint" modes a burst on one loop closes on time
+    # while another loop is busy
+    def handle_loop_frame(self, loop_id, frame):
+        if loop_id == FINISH_LOOP:
+            print(f"RFID detected: {frame.data}")
+        with self.lock:
+            crossings = self.duplicate_filter.expire(frame.arrival_ns)
+            sector_crossings = self.sector_filter.expire(frame.arrival_ns)
+            if loop_id == FINISH_LOOP:
+                for listener in self.frame_listeners:
+                    listener(frame)
+                crossings += self.filter_frame(frame)
+            else:
+                sector_crossings += self.sector_filter.feed((loop_id, frame.data), frame.arrival_ns, frame.wall_ns)
+            self.record_loop_crossings(crossings, sector_crossings)
+
+    # Idle hook for TTLInterface and DecoderService: closes bursts that ended
+    # while the ports were quiet, which is when "last" and "midpoint"
+    # crossings become known
+    def handle_idle(self, now_ns):
+        with self.lock:
+            self.record_loop_crossings(self.duplicate_filter.expire(now_ns), self.sector_filter.expire(now_ns))
+            if self.capture is not None:
+                self.capture.flush()
+
+    # What both filters released at once is recorded in crossing order, so the
+    # sector timer sees each transponder's crossings in time order
+    def record_loop_crossings(self, crossings, sector_crossings):
+        if not sector_crossings or self.sectors is None or not self.race_started:
+            self.record_crossings(crossings)
+            return
+        # Crossings are (rfid, crossing_ns, wall_ns) and sector crossings
+        # ((loop_id, rfid), crossing_ns, wall_ns)
+        merged = [(crossing[1], FINISH_LOOP, crossing) for crossing in crossings]
+        merged += [(crossing[1], crossing[0][0], crossing) for crossing in sector_crossings]
+        merged.sort(key=lambda item: item[:2])
+        for _, loop_id, crossing in merged:
+            if loop_id == FINISH_LOOP:
+                self.record_crossings([crossing])
+            else:
+                self.record_sector_crossings([crossing])
+
+    def record_crossings(self, crossings):
+        if not crossings:
+            return
+        if not self.race_started:
+            print("Race not started. Data not recorded.")
+            if metrics.enabled:
+                CROSSINGS_IGNORED.inc(len(crossings))
+            return
+        for rfid, crossing_ns, wall_ns in crossings:
+            transponder_id = self.transponders.intern(rfid)
+            if metrics.enabled:
+                started = time.perf_counter()
+                _, lap_ns = self.lap_engine.record_crossing(transponder_id, crossing_ns, wall_ns)
+                LAP_SECONDS.observe(time.perf_counter() - started)
+                CROSSINGS_RECORDED.inc()
+            else:
+                _, lap_ns = self.lap_engine.record_crossing(transponder_id, crossing_ns, wall_ns)
+            self.storage.record_crossing(self.session_id, transponder_id, crossing_ns, wall_ns, lap_ns)
+            self.crossings.append((rfid, crossing_ns, wall_ns, lap_ns))
+            for listener in self.crossing_listeners:
+                listener(rfid, crossing_ns, wall_ns, lap_ns)
+            if self.sectors is not None:
+                self.record_split(FINISH_LOOP, transponder_id, crossing_ns, wall_ns)
+
+    # Sector loop crossings are timed against the previous loop but, unlike
+    # finish-line crossings, not stored
+    def record_sector_crossings(self, crossings):
+        if not crossings or not self.race_started:
+            return
+        for (loop_id, rfid), crossing_ns, wall_ns in crossings:
+            self.record_split(loop_id, self.transponders.intern(rfid), crossing_ns, wall_ns)
+
+    def record_split(self, loop_id, transponder_id, crossing_ns, wall_ns):
+        state, sector, split_ns = self.sectors.record(loop_id, transponder_id, crossing_ns)
+        rfid = self.transponders.rfid(transponder_id)
+        self.splits.append((loop_id, rfid, crossing_ns, wall_ns, split_ns))
+        for listener in self.sector_listeners:
+            listener(loop_id, rfid, crossing_ns, wall_ns, split_ns)
+
+    # Crossings are published as (rfid, crossing_ns, wall_ns, lap_ns); lap_ns is
+    # None for a transponder's first crossing
+    def read_crossings(self, cursor):
+        return self.crossings.read_since(cursor)
+
+    # Loop crossings are published as (loop_id, rfid, crossing_ns, wall_ns,
+    # split_ns), finish line included; split_ns is None when no sector closed
+    def read_splits(self, cursor):
+        return self.splits.read_since(cursor)
+
+    def read_frames(self, com_port, cursor):
+        interface = self.interfaces.get(com_port) or self.get_loop_reader(com_port)
+        if interface is None:
+            return [], cursor, 0
+        return interface.read_since(cursor)
+
+    def get_filter_stats(self):
+        return self.duplicate_filter.get_stats()
+
+    # Each start opens a new race session with an empty board
+    def start_race(self):
+        with self.lock:
+            self.session_id = self.storage.start_session()
+            self.lap_engine.reset()
+            if self.sectors is not None:
+                self.sectors.reset()
+            self.race_started = True
+            self.race_generation += 1
+            for listener in self.race_listeners:
+                listener()
+            if self.capture is not None:
+                self.capture.write_marker(KIND_RACE_START)
+
+    def stop_race(self):
+        with self.lock:
+            self.race_started = False
+            if self.session_id is not None:
+                self.storage.end_session(self.session_id)
+            if self.capture is not None:
+                self.capture.write_marker(KIND_RACE_STOP)
+                self.capture.flush()
+
+    def close(self):
+        for com_port in list(self.interfaces):
+            self.close_port(com_port)
+        self.close_loops()
+        self.storage.flush()
+        if self.capture is not None:
+            with self.lock:
+                self.capture.close()
+
+@st.cache_resource
+def get_ingestion_hub():
+    settings = load_settings()
+    configure_metrics(settings)
+    if settings.get("use_timing_daemon", False):
+        from timing_daemon import DaemonHub
+        return DaemonHub(settings.get("timing_ring_name", "sippycup_timing"), len(settings.get("timing_loops") or []))
+    return IngestionHub(settings)
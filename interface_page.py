@@ -1,17 +1,18 @@
-import streamlit as st
 import pandas as pd
+import streamlit as st
 import serial.tools.list_ports  # To list available COM ports
 from serial import SerialException  # To handle serial exceptions
-from ttl_interface import TTLInterface  # Import from the new module
-from lap_timer import lap_detected  # Import lap_detected function
+from ingestion_hub import get_ingestion_hub  # Shared reader per port across sessions
+from decoder_service import load_timing_loops
+from port_discovery import discover
+from driver_registry import get_driver_registry
+from live_refresh import live_fragment, DEFAULT_REFRESH_INTERVAL
 import json
-import time
-import psutil  # To handle process management on Windows
 import subprocess  # To run system commands
 
 # File to store settings
 SETTINGS_FILE = "settings.json"
-DATABASE_FILE = "rfid_database.csv"
+BAUD_RATES = [9600, 19200, 38400, 57600, 115200]
 
 def load_settings():
     try:
@@ -25,37 +26,73 @@ def save_settings(settings):
     with open(SETTINGS_FILE, 'w') as f:
         json.dump(settings, f, indent=4)
 
-def load_database():
-    try:
-        df = pd.read_csv(DATABASE_FILE)
-        if df.empty:
-            df = pd.DataFrame(columns=["RFID", "Driver Name", "Driver Number", "Driver Kart", "Driver Kart CC"])
-    except FileNotFoundError:
-        df = pd.DataFrame(columns=["RFID", "Driver Name", "Driver Number", "Driver Kart", "Driver Kart CC"])
-    return df
-
 def save_to_database(rfid):
-    df = load_database()
-    if rfid not in df["RFID"].values:
-        new_entry = pd.DataFrame([{
-            "RFID": rfid,
-            "Driver Name": "Not Assigned",
-            "Driver Number": "Not Assigned",
-            "Driver Kart": "Not Assigned",
-            "Driver Kart CC": "Not Assigned"
-        }])
-        df = pd.concat([df, new_entry], ignore_index=True)
-        df.to_csv(DATABASE_FILE, index=False)  # Ensure the header is written correctly
+    if get_driver_registry().add(rfid):
         st.success(f"RFID {rfid} added to the database with default details.")
     else:
         st.warning(f"RFID {rfid} is already in the database.")
 
 
-# Function to initialize the TTL interface
+def apply_port_settings(settings, com_ports, com_port, baud_rate):
+    st.session_state.selected_com_port = com_port
+    st.session_state.baud_rate = baud_rate
+    settings["selected_com_port"] = com_port
+    settings["baud_rate"] = baud_rate
+    settings["selected_com_port_index"] = com_ports.index(com_port)
+    settings["baud_rate_index"] = BAUD_RATES.index(baud_rate)
+    save_settings(settings)
+
+# Probes the listed ports in parallel, trying the baud rates one after
+# another on each, and keeps the ranked candidates for this session
+def scan_ports(com_ports):
+    hub = get_ingestion_hub()
+    in_use = [port for port in com_ports if hub.is_active(port)]
+    with st.spinner("Probing ports..."):
+        st.session_state.discovered = discover(com_ports, BAUD_RATES, exclude=in_use)
+    st.session_state.discovered_in_use = in_use
+
+def discovered_panel(settings, com_ports):
+    candidates = [c for c in st.session_state.discovered if c.confidence >= 0]
+    if st.session_state.get("discovered_in_use"):
+        st.caption(f"Skipped ports already open: {', '.join(st.session_state.discovered_in_use)}")
+    if not candidates:
+        st.write("No port could be opened.")
+        return
+    best = candidates[0]
+    if best.format is not None:
+        st.success(f"Decoder found on {best.com_port} at {best.baud_rate} baud ({best.format})")
+        if st.button(f"Use {best.com_port} at {best.baud_rate} baud", key="use_discovered"):
+            apply_port_settings(settings, com_ports, best.com_port, best.baud_rate)
+            st.rerun()
+    else:
+        st.warning("No decoder frames recognised. Pass a transponder over the antenna and scan again.")
+    st.dataframe(pd.DataFrame([{
+        "Port": c.com_port,
+        "Baud": c.baud_rate,
+        "Format": c.format or "",
+        "Confidence": round(c.confidence, 2),
+        "Frames": f"{c.matched}/{c.frames}",
+        "Bytes": c.bytes,
+        "Sample": c.sample,
+    } for c in candidates]), hide_index=True)
+
+# Function to initialize the TTL interface. With timing_loops in the settings
+# every loop's decoder is opened together and detected IDs come from the
+# start/finish loop.
 def init_ttl_interface(selected_com_port, baud_rate):
+    timing_loops = load_timing_loops(load_settings())
     try:
-        st.session_state.ttl_interface = TTLInterface(lap_detected, selected_com_port, baud_rate)
-        st.session_state.ttl_interface.start()
+        if timing_loops:
+            hub = get_ingestion_hub()
+            hub.open_loops(timing_loops)
+            st.session_state.selected_com_port = timing_loops[0].source
+            st.session_state.ttl_interface = hub.get_loop_reader(timing_loops[0].source)
+            st.session_state.ttl_cursor = 0
+            st.session_state.ttl_interface_active = True
+            st.success(f"Monitoring {len(timing_loops)} timing loops: {', '.join(loop.source for loop in timing_loops)}")
+            return
+        st.session_state.ttl_interface = get_ingestion_hub().open_port(selected_com_port, baud_rate)
+        st.session_state.ttl_cursor = 0
         st.session_state.ttl_interface_active = True
         st.success(f"Monitoring TTL on {selected_com_port} at {baud_rate} baud")
     except SerialException as e:
@@ -64,7 +101,11 @@ def init_ttl_interface(selected_com_port, baud_rate):
 # Function to stop the TTL interface
 def stop_ttl_interface():
     if 'ttl_interface_active' in st.session_state and st.session_state.ttl_interface_active:
-        st.session_state.ttl_interface.stop()
+        hub = get_ingestion_hub()
+        if hub.get_loop_reader(st.session_state.ttl_interface.com_port) is not None:
+            hub.close_loops()
+        else:
+            hub.close_port(st.session_state.ttl_interface.com_port)
         st.session_state.ttl_interface_active = False
         st.success("Stopped TTL monitoring")
 
@@ -102,6 +143,7 @@ def find_process_using_com_port(port):
 
 # Function to terminate the process using the COM port
 def terminate_process(pid):
+    import psutil  # Only needed here, so it is not loaded with the page
     try:
         process = psutil.Process(pid)
         process.terminate()
@@ -126,21 +168,19 @@ def interface_page():
     with col1:
         selected_com_port = st.selectbox("Select COM Port", com_ports, index=settings.get("selected_com_port_index", 0))
     with col2:
-        baud_rate = st.selectbox("Select Baud Rate", [9600, 19200, 38400, 57600, 115200], index=settings.get("baud_rate_index", 0))
+        baud_rate = st.selectbox("Select Baud Rate", BAUD_RATES, index=settings.get("baud_rate_index", 0))
 
     # Save settings when "Apply Settings" is clicked
     if st.button("Apply Settings", key="ttl_apply_settings"):
-        st.session_state.selected_com_port = selected_com_port
-        st.session_state.baud_rate = baud_rate
-        settings["selected_com_port"] = selected_com_port
-        settings["baud_rate"] = baud_rate
-        settings["selected_com_port_index"] = com_ports.index(selected_com_port)
-        settings["baud_rate_index"] = [9600, 19200, 38400, 57600, 115200].index(baud_rate)
-        save_settings(settings)
+        apply_port_settings(settings, com_ports, selected_com_port, baud_rate)
         st.success(f"Settings saved for COM port: {selected_com_port} at {baud_rate} baud")
 
     if not com_ports:
         st.write("No COM ports available. Please connect a device.")
+    elif st.button("Find Decoder", key="scan_ports", help="Pass a transponder over the antenna while the ports are probed"):
+        scan_ports(com_ports)
+    if st.session_state.get("discovered") is not None:
+        discovered_panel(settings, com_ports)
 
     col3, col4 = st.columns([1, 1])
     with col3:
@@ -164,7 +204,7 @@ def interface_page():
         if 'selected_com_port' not in st.session_state or 'baud_rate' not in st.session_state:
             st.session_state.selected_com_port = settings.get("selected_com_port")
             st.session_state.baud_rate = settings.get("baud_rate")
-        if not st.session_state.ttl_interface_active:
+        if not get_ingestion_hub().is_active(st.session_state.selected_com_port):
             init_ttl_interface(st.session_state.selected_com_port, st.session_state.baud_rate)
     else:
         if 'listening' in st.session_state and st.session_state.listening:
@@ -182,40 +222,43 @@ def interface_page():
     if 'ttl_interface_active' not in st.session_state:
         st.session_state.ttl_interface_active = False
 
+    if 'ttl_cursor' not in st.session_state:
+        st.session_state.ttl_cursor = 0
+
     if 'captured_log' not in st.session_state:
         st.session_state.captured_log = []
 
-    # Display the detected codes in rows with add button
-    if st.session_state.listening:
-        if 'selected_com_port' in st.session_state:
-            if not st.session_state.ttl_interface_active:
-                init_ttl_interface(st.session_state.selected_com_port, st.session_state.baud_rate)
-            while st.session_state.listening:
-                received_data = st.session_state.ttl_interface.get_received_data()
-                if received_data:
-                    for data in received_data:
-                        if data not in st.session_state.detected_ids:
-                            st.session_state.detected_ids.add(data)
-                            st.session_state.captured_log.append(data)
-                            cols = st.columns([2, 2, 1])
-                            with cols[0]:
-                                st.write("Detected ID:")
-                            with cols[1]:
-                                st.write(data)
-                            with cols[2]:
-                                if st.button(f"Add to Database", key=f"add_{data}"):
-                                    save_to_database(data)
-                time.sleep(0.5)
+    # Display the detected codes in rows with add button. While listening the
+    # panel reruns on its own every refresh interval and only reads frames that
+    # arrived since the last pass.
+    if st.session_state.listening and 'selected_com_port' in st.session_state:
+        if not get_ingestion_hub().is_active(st.session_state.selected_com_port):
+            init_ttl_interface(st.session_state.selected_com_port, st.session_state.baud_rate)
+        live_fragment(detected_ids_panel, run_every=settings.get("live_refresh_interval", DEFAULT_REFRESH_INTERVAL))()
     else:
-        for data in st.session_state.captured_log:
-            cols = st.columns([2, 2, 1])
-            with cols[0]:
-                st.write("Detected ID:")
-            with cols[1]:
-                st.write(data)
-            with cols[2]:
-                if st.button(f"Add to Database", key=f"add_{data}_off"):
-                    save_to_database(data)
+        live_fragment(detected_ids_panel)()
+
+def poll_detected_ids():
+    received_data, st.session_state.ttl_cursor, missed = get_ingestion_hub().read_frames(st.session_state.selected_com_port, st.session_state.ttl_cursor)
+    if missed:
+        print(f"Receive buffer overflowed, {missed} frames were not displayed")
+    for data in received_data:
+        if data not in st.session_state.detected_ids:
+            st.session_state.detected_ids.add(data)
+            st.session_state.captured_log.append(data)
+
+def detected_ids_panel():
+    if st.session_state.listening and 'selected_com_port' in st.session_state:
+        poll_detected_ids()
+    for data in st.session_state.captured_log:
+        cols = st.columns([2, 2, 1])
+        with cols[0]:
+            st.write("Detected ID:")
+        with cols[1]:
+            st.write(data)
+        with cols[2]:
+            if st.button(f"Add to Database", key=f"add_{data}"):
+                save_to_database(data)
 
 if __name__ == "__main__":
     interface_page()
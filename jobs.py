@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import streamlit as st
+from storage import get_storage
+from reports import write_classification, write_driver_sheets, REPORT_DIR
+
+SETTINGS_FILE = "settings.json"
+DEFAULT_REPORT_WORKERS = 2
+DRIVERS_PER_TASK = 8  # Driver sheets written per pool task; each task replays the session once
+
+def load_settings():
+    try:
+        with open(SETTINGS_FILE, 'r') as f:
+            settings = json.load(f)
+    except FileNotFoundError:
+        settings = {}
+    return settings
+
+# Progress of one export or report run, updated from worker threads and pool
+# callbacks and read by the dashboard on each refresh
+class Job:
+    def __init__(self, name, total=0):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.outputs = []
+        self.errors = []
+        self.started = time.monotonic()
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def advance(self, outputs=(), error=None):
+        with self.lock:
+            self.done += 1
+            self.outputs.extend(outputs)
+            if error is not None:
+                self.errors.append(error)
+            if self.done >= self.total:
+                self.finished = time.monotonic()
+
+    def fail(self, error):
+        with self.lock:
+            self.errors.append(error)
+            self.finished = time.monotonic()
+
+    @property
+    def running(self):
+        return self.finished is None
+
+    @property
+    def progress(self):
+        return self.done / self.total if self.total else (0.0 if self.running else 1.0)
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+# Runs exports on a background thread and reports in a process pool, so
+# neither holds up the script that started them or the ingest threads. The
+# pool uses spawn (the only start method on Windows, and safe beside the
+# server's threads on Linux); its workers import reports.py only. One job of
+# each kind runs at a time; starting another while one is running returns the
+# running one.
+class JobRunner:
+    def __init__(self, settings):
+        self.settings = settings
+        self.report_dir = settings.get("report_dir", REPORT_DIR)
+        self.report_workers = settings.get("report_workers", DEFAULT_REPORT_WORKERS)
+        self.pool = None
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def get_pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.report_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self.pool
+
+    def job(self, kind):
+        return self.jobs.get(kind)
+
+    def start_export(self, session_ids=None):
+        with self.lock:
+            job = self.jobs.get("export")
+            if job is not None and job.running:
+                return job
+            job = self.jobs["export"] = Job("Export")
+        threading.Thread(target=self.run_export, args=(job, session_ids), daemon=True).start()
+        return job
+
+    # export.py loads pyarrow, so it is imported here rather than with the
+    # dashboard
+    def run_export(self, job, session_ids):
+        from export import export_sessions, EXPORT_DIR, DEFAULT_COMPRESSION
+        settings = self.settings
+        storage = get_storage()
+        sessions = storage.load_sessions()["id"].tolist()
+        job.total = len(sessions if session_ids is None else [sid for sid in sessions if sid in session_ids])
+        try:
+            export_sessions(session_ids, settings.get("export_dir", EXPORT_DIR), settings.get("export_format"), settings.get("export_compression", DEFAULT_COMPRESSION),
+                            progress=lambda result: job.advance([] if result.skipped else [result.path]), storage=storage)
+            if not job.total:
+                job.finished = time.monotonic()
+        except Exception as e:
+            print(f"Export failed: {e}")
+            job.fail(str(e))
+
+    # The classification is one task and the driver sheets are split into
+    # tasks of DRIVERS_PER_TASK, so progress moves as each finishes
+    def start_reports(self, session_id):
+        with self.lock:
+            job = self.jobs.get("reports")
+            if job is not None and job.running:
+                return job
+            storage = get_storage()
+            storage.flush()
+            transponder_ids = [row[0] for row in storage.connection().execute(
+                "SELECT DISTINCT transponder_id FROM crossings WHERE session_id = ? ORDER BY transponder_id", (session_id,))]
+            chunks = [transponder_ids[i:i + DRIVERS_PER_TASK] for i in range(0, len(transponder_ids), DRIVERS_PER_TASK)]
+            job = self.jobs["reports"] = Job(f"Reports for session {session_id}", total=1 + len(chunks))
+            database_path = os.path.abspath(storage.path)
+            directory = os.path.abspath(os.path.join(self.report_dir, f"session_{session_id}"))
+            pool = self.get_pool()
+            futures = [pool.submit(write_classification, database_path, session_id, directory)]
+            futures += [pool.submit(write_driver_sheets, database_path, session_id, chunk, directory) for chunk in chunks]
+        for future in futures:
+            future.add_done_callback(lambda future: self.report_done(job, future))
+        return job
+
+    def report_done(self, job, future):
+        try:
+            result = future.result()
+        except BrokenProcessPool as e:
+            # A worker died; the next run starts a fresh pool
+            print(f"Report worker died: {e}")
+            with self.lock:
+                self.pool = None
+            job.advance(error=str(e))
+            return
+        except Exception as e:
+            print(f"Report task failed: {e}")
+            job.advance(error=str(e))
+            return
+        job.advance(result if isinstance(result, list) else [result])
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+
+@st.cache_resource
+def get_job_runner():
+    return JobRunner(load_settings())
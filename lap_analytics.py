@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+from storage import get_storage
+from lap_archive import get_lap_archive
+
+LEGACY_LAP_FILE = "lap_times.csv"
+LEGACY_LABEL = "Unassigned (lap_times.csv)"
+DUPLICATE_READ_LAP = 0.01  # Seconds; shorter laps are repeated reads of one pass
+LONG_LAP = 300.0  # Seconds; longer laps are pit stops or missed passes
+MAD_THRESHOLD = 5.0  # Robust z-score beyond which a lap is flagged
+PERCENTILES = [10, 25, 50, 75, 90]
+
+# Flat, contiguous lap history: laps[i] is a lap in seconds and groups[i]
+# indexes labels. Laps of one group are kept in recorded order.
+class LapHistory:
+    def __init__(self, laps, groups, labels):
+        order = np.argsort(groups, kind="stable")
+        self.laps = np.ascontiguousarray(laps[order], dtype=np.float64)
+        self.groups = np.ascontiguousarray(groups[order], dtype=np.int64)
+        self.labels = list(labels)
+        self.counts = np.bincount(self.groups, minlength=len(self.labels))
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1]))
+
+def load_legacy_laps(path=LEGACY_LAP_FILE):
+    try:
+        return pd.read_csv(path, header=None, dtype=np.float64, engine="c").iloc[:, 0].to_numpy()
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        return np.empty(0, dtype=np.float64)
+
+# Laps in seconds and rfid group codes from the memory-mapped lap archive
+def load_archive_laps(archive, session_id=None):
+    records = archive.records if session_id is None else archive.session(session_id)
+    lap_ns = records["lap_ns"]
+    completed = lap_ns >= 0
+    transponder_ids, codes = np.unique(records["transponder_id"][completed], return_inverse=True)
+    rfids = get_storage().load_transponders()
+    return lap_ns[completed] / 1e9, codes.astype(np.int64), [rfids[int(tid)] for tid in transponder_ids]
+
+def load_sql_laps(session_id=None):
+    query = """SELECT t.rfid, c.lap_ns FROM crossings c JOIN transponders t ON t.id = c.transponder_id
+               WHERE c.lap_ns IS NOT NULL"""
+    params = []
+    if session_id is not None:
+        query += " AND c.session_id = ?"
+        params.append(session_id)
+    df = pd.read_sql_query(query + " ORDER BY c.id", get_storage().connection(), params=params)
+    codes, rfids = pd.factorize(df["rfid"])
+    return df["lap_ns"].to_numpy(dtype=np.float64) / 1e9, codes.astype(np.int64), list(rfids)
+
+# Reads the lap archive when the timing process maintains one, and the
+# crossings table otherwise. The legacy lap_times.csv laps belong to no
+# session, so by default they are only included in the all-sessions history.
+def load_history(session_id=None, include_legacy=None, driver_names=None):
+    if include_legacy is None:
+        include_legacy = session_id is None
+    archive = get_lap_archive()
+    if archive is not None:
+        laps, groups, rfids = load_archive_laps(archive, session_id)
+    else:
+        laps, groups, rfids = load_sql_laps(session_id)
+    labels = [driver_names.get(rfid, rfid) if driver_names else rfid for rfid in rfids]
+    if include_legacy:
+        legacy = load_legacy_laps()
+        if legacy.size:
+            laps = np.concatenate((laps, legacy))
+            groups = np.concatenate((groups, np.full(legacy.size, len(labels), dtype=np.int64)))
+            labels.append(LEGACY_LABEL)
+    return LapHistory(laps, groups, labels)
+
+# Per-lap flags: duplicate reads, long laps, and laps far from their group's
+# median in units of median absolute deviation
+def flag_outliers(history):
+    laps = history.laps
+    duplicate = laps < DUPLICATE_READ_LAP
+    long_lap = laps > LONG_LAP
+    plausible = ~(duplicate | long_lap)
+    median = group_percentiles(history, [50], mask=plausible)[:, 0]
+    deviation = np.abs(laps - median[history.groups])
+    mad = group_percentiles(history, [50], mask=plausible, values=deviation)[:, 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        robust_z = 0.6745 * deviation / mad[history.groups]
+    statistical = plausible & (robust_z > MAD_THRESHOLD)
+    return duplicate, long_lap, statistical
+
+# Orders values by (group, value). Sorting values first and then stably by
+# group lets NumPy use radix sort on the small-integer group keys, which is
+# several times faster than lexsort on large histories.
+def sort_within_groups(values, groups, group_count):
+    order = np.argsort(values)
+    key_type = np.uint16 if group_count <= np.iinfo(np.uint16).max else np.int64
+    return order[np.argsort(groups[order].astype(key_type), kind="stable")]
+
+# Linear-interpolated percentiles of values (default: laps) for every group
+# at once, over the laps selected by mask. Rows are NaN for empty groups.
+def group_percentiles(history, percentiles, mask=None, values=None):
+    values = history.laps if values is None else values
+    groups = history.groups
+    if mask is not None:
+        values = values[mask]
+        groups = groups[mask]
+    values = values[sort_within_groups(values, groups, len(history.labels))]
+    counts = np.bincount(groups, minlength=len(history.labels))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    q = np.asarray(percentiles, dtype=np.float64) / 100.0
+    position = (counts[:, None] - 1) * q[None, :]
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, np.maximum(counts[:, None] - 1, 0))
+    weight = position - lower
+    empty = counts == 0
+    lower_idx = np.where(empty[:, None], 0, starts[:, None] + lower)
+    upper_idx = np.where(empty[:, None], 0, starts[:, None] + upper)
+    if values.size == 0:
+        return np.full((len(counts), len(q)), np.nan)
+    result = values[lower_idx] * (1 - weight) + values[upper_idx] * weight
+    result[empty] = np.nan
+    return result
+
+# Mean of each lap and the window - 1 laps before it in the same group; NaN
+# until a group has a full window
+def rolling_mean(history, window=5, mask=None):
+    laps = history.laps if mask is None else np.where(mask, history.laps, np.nan)
+    filled = np.nan_to_num(laps)
+    valid = (~np.isnan(laps)).astype(np.float64)
+    cumsum = np.concatenate(([0.0], np.cumsum(filled)))
+    cumcount = np.concatenate(([0.0], np.cumsum(valid)))
+    index = np.arange(laps.size)
+    begin = np.maximum(index - window + 1, 0)
+    sums = cumsum[index + 1] - cumsum[begin]
+    counts = cumcount[index + 1] - cumcount[begin]
+    in_group = index - history.starts[history.groups] >= window - 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(in_group & (counts == window), sums / counts, np.nan)
+
+def summarize(history, flags=None):
+    duplicate, long_lap, statistical = flags if flags is not None else flag_outliers(history)
+    clean = ~(duplicate | long_lap | statistical)
+    groups = history.groups
+    size = len(history.labels)
+    clean_laps = np.where(clean, history.laps, 0.0)
+    n = np.bincount(groups, weights=clean, minlength=size)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.bincount(groups, weights=clean_laps, minlength=size) / n
+        squared = np.where(clean, (history.laps - mean[groups]) ** 2, 0.0)
+        std = np.sqrt(np.bincount(groups, weights=squared, minlength=size) / n)
+        consistency = np.clip(100.0 * (1.0 - std / mean), 0.0, 100.0)
+    percentiles = group_percentiles(history, [0] + PERCENTILES, mask=clean)
+    summary = pd.DataFrame({
+        "Driver": history.labels,
+        "Laps": history.counts,
+        "Clean Laps": n.astype(np.int64),
+        "Best": percentiles[:, 0],
+        "Mean": mean,
+        "Std Dev": std,
+        "Consistency %": consistency,
+    })
+    for i, p in enumerate(PERCENTILES, start=1):
+        summary["Median" if p == 50 else f"P{p}"] = percentiles[:, i]
+    summary["Duplicate Reads"] = np.bincount(groups, weights=duplicate, minlength=size).astype(np.int64)
+    summary["Long Laps"] = np.bincount(groups, weights=long_lap, minlength=size).astype(np.int64)
+    summary["Outliers"] = np.bincount(groups, weights=statistical, minlength=size).astype(np.int64)
+    return summary
@@ -0,0 +1,199 @@
+import os
+import mmap
+import struct
+import threading
+import numpy as np
+
+LAP_ARCHIVE_FILE = "lap_archive.bin"
+INDEX_SUFFIX = ".idx"
+ARCHIVE_MAGIC = b"SIPLAPS1"
+INDEX_MAGIC = b"SIPLIDX1"
+ARCHIVE_VERSION = 1
+NO_LAP = -1  # lap_ns of a crossing that started a transponder's first lap
+BACKFILL_CHUNK = 100_000
+
+# 32-byte file header: magic, version, record size, then padding
+HEADER = struct.Struct("<8sII16x")
+HEADER_SIZE = HEADER.size
+
+RECORD_DTYPE = np.dtype([
+    ("session_id", "<i4"),
+    ("transponder_id", "<i4"),  # transponders.id in storage
+    ("crossing_ns", "<i8"),
+    ("lap_ns", "<i8"),
+])
+RECORD_SIZE = RECORD_DTYPE.itemsize
+
+# The index is a sidecar of (session_id, first record) entries, one per run
+# of consecutive records from the same session
+INDEX_DTYPE = np.dtype([("session_id", "<i8"), ("start", "<i8")])
+
+def index_path(path):
+    return path + INDEX_SUFFIX
+
+# Whole index entries after the magic; a torn trailing entry is ignored
+def read_index(path):
+    with open(index_path(path), "rb") as f:
+        data = f.read()
+    entry_size = INDEX_DTYPE.itemsize
+    usable = len(data) - len(data) % entry_size
+    return np.frombuffer(data[entry_size:usable], dtype=INDEX_DTYPE)
+
+# Appends crossings to the archive. There is one writer at a time (the
+# process that commits crossings to storage). Records are only ever appended
+# whole, and the record count is derived from the file size rather than
+# stored, so readers never need a lock and a crash can at worst leave a torn
+# tail record, which is cut off on the next open.
+class LapArchiveWriter:
+    def __init__(self, path=LAP_ARCHIVE_FILE):
+        self.path = path
+        self.data = open(path, "ab")
+        self.index = open(index_path(path), "ab")
+        if self.data.tell() == 0:
+            self.data.write(HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, RECORD_SIZE))
+            self.data.flush()
+        size = self.data.tell()
+        torn = (size - HEADER_SIZE) % RECORD_SIZE
+        if torn:
+            self.data.truncate(size - torn)
+            self.data.seek(0, os.SEEK_END)
+        if self.index.tell() == 0:
+            self.index.write(INDEX_MAGIC.ljust(INDEX_DTYPE.itemsize, b"\0"))
+            self.index.flush()
+        torn = self.index.tell() % INDEX_DTYPE.itemsize
+        if torn:
+            self.index.truncate(self.index.tell() - torn)
+            self.index.seek(0, os.SEEK_END)
+        self.count = (self.data.tell() - HEADER_SIZE) // RECORD_SIZE
+        self.last_session = self.read_last_session()
+
+    # Session of the run still open at the end of the file, so reopening the
+    # writer mid-session does not split it
+    def read_last_session(self):
+        entries = read_index(self.path)
+        if not entries.size or entries["start"][-1] >= self.count:
+            return None
+        return int(entries["session_id"][-1])
+
+    # records is a RECORD_DTYPE array; an index entry is written, before the
+    # data, whenever the session changes
+    def append(self, records):
+        if not len(records):
+            return
+        sessions = records["session_id"]
+        changes = np.flatnonzero(sessions[1:] != sessions[:-1]) + 1
+        starts = np.concatenate(([0], changes))
+        if sessions[0] == self.last_session:
+            starts = starts[1:]
+        if starts.size:
+            entries = np.empty(starts.size, dtype=INDEX_DTYPE)
+            entries["session_id"] = sessions[starts]
+            entries["start"] = starts + self.count
+            self.index.write(entries.tobytes())
+            self.index.flush()
+        self.data.write(records.tobytes())
+        self.data.flush()
+        self.count += len(records)
+        self.last_session = int(sessions[-1])
+
+    def append_crossings(self, crossings):
+        self.append(np.array(crossings, dtype=RECORD_DTYPE))
+
+    # Copies stored crossings the archive does not have yet. Records follow
+    # crossings in id order, so the missing ones are everything past count.
+    def backfill(self, conn):
+        cursor = conn.execute(
+            "SELECT session_id, transponder_id, crossing_ns, COALESCE(lap_ns, ?) FROM crossings ORDER BY id LIMIT -1 OFFSET ?",
+            (NO_LAP, self.count),
+        )
+        while True:
+            rows = cursor.fetchmany(BACKFILL_CHUNK)
+            if not rows:
+                break
+            self.append_crossings(rows)
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+# Read-only, zero-copy view of the archive: records is a NumPy structured
+# array over an mmap of the file, so fields like records["lap_ns"] are views
+# into the page cache. refresh() picks up records appended since.
+class LapArchive:
+    def __init__(self, path=LAP_ARCHIVE_FILE):
+        self.path = path
+        self.size = None
+        self.records = np.empty(0, dtype=RECORD_DTYPE)
+        self.segments = {}
+        self.lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        with self.lock:
+            if size == self.size:
+                return False
+            count = max(0, (size - HEADER_SIZE) // RECORD_SIZE)
+            if count:
+                with open(self.path, "rb") as f:
+                    view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, record_size = HEADER.unpack_from(view)
+                if magic != ARCHIVE_MAGIC or record_size != RECORD_SIZE:
+                    raise ValueError(f"{self.path} is not a version {ARCHIVE_VERSION} lap archive")
+                # The previous mapping is released once no array views it
+                records = np.frombuffer(view, dtype=RECORD_DTYPE, count=count, offset=HEADER_SIZE)
+            else:
+                records = np.empty(0, dtype=RECORD_DTYPE)
+            self.records = records
+            self.segments = self.load_segments(count)
+            self.size = size
+            return True
+
+    def load_segments(self, count):
+        try:
+            entries = read_index(self.path)
+        except FileNotFoundError:
+            return {}
+        segments = {}
+        ends = np.append(entries["start"][1:], count)
+        for session_id, start, end in zip(entries["session_id"].tolist(), entries["start"].tolist(), ends.tolist()):
+            end = min(end, count)
+            if start < end:
+                segments.setdefault(session_id, []).append((start, end))
+        return segments
+
+    def __len__(self):
+        return len(self.records)
+
+    def session_ids(self):
+        return sorted(self.segments)
+
+    # A session's records; a view when they were written in one run, which is
+    # always the case for live races
+    def session(self, session_id):
+        ranges = self.segments.get(session_id, [])
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            return self.records[start:end]
+        if not ranges:
+            return self.records[:0]
+        return np.concatenate([self.records[start:end] for start, end in ranges])
+
+lap_archive = None
+lap_archive_lock = threading.Lock()
+
+# Shared reader, refreshed on every call (one stat when nothing changed);
+# None until the timing process has written an archive
+def get_lap_archive(path=LAP_ARCHIVE_FILE):
+    global lap_archive
+    with lap_archive_lock:
+        if lap_archive is None or lap_archive.path != path:
+            if not os.path.exists(path):
+                return None
+            lap_archive = LapArchive(path)
+        else:
+            lap_archive.refresh()
+        return lap_archive
@@ -0,0 +1,84 @@
+import threading
+from array import array
+import numpy as np
+from leaderboard import Leaderboard, RACE
+from driver_stats import LapStats
+from transponder_ids import TransponderIds
+
+# Laps are kept as int64 nanoseconds in an array('q'), 8 bytes a lap;
+# formatting happens only when a page renders them
+class TransponderState:
+    __slots__ = ("transponder_id", "rfid", "first_crossing_ns", "last_crossing_ns", "last_wall_ns", "last_lap_ns", "best_lap_ns", "lap_count", "laps", "stats")
+
+    def __init__(self, transponder_id, rfid, crossing_ns, wall_ns):
+        self.transponder_id = transponder_id
+        self.rfid = rfid
+        self.first_crossing_ns = crossing_ns
+        self.last_crossing_ns = crossing_ns
+        self.last_wall_ns = wall_ns
+        self.last_lap_ns = None
+        self.best_lap_ns = None
+        self.lap_count = 0
+        self.laps = array("q")
+        self.stats = LapStats()
+
+# Crossings are keyed by interned transponder id; transponders resolves ids
+# back to EPCs for display. The engine is purely in memory: crossings are
+# persisted by Storage, and a restarted process rebuilds race state from
+# there or from a capture.
+class LapEngine:
+    def __init__(self, transponders=None):
+        self.transponders = transponders if transponders is not None else TransponderIds()
+        self.states = {}
+        self.leaderboard = Leaderboard()
+        self.lock = threading.Lock()
+
+    # Returns (state, lap_ns); lap_ns is None when the crossing starts a lap
+    # rather than completing one
+    def apply_crossing(self, transponder_id, crossing_ns, wall_ns):
+        state = self.states.get(transponder_id)
+        if state is None:
+            rfid = self.transponders.rfid(transponder_id)
+            state = self.states[transponder_id] = TransponderState(transponder_id, rfid, crossing_ns, wall_ns)
+            self.leaderboard.update(state)
+            return state, None
+        lap_ns = crossing_ns - state.last_crossing_ns
+        if lap_ns > 0:
+            state.last_lap_ns = lap_ns
+            if state.best_lap_ns is None or lap_ns < state.best_lap_ns:
+                state.best_lap_ns = lap_ns
+            state.lap_count += 1
+            state.laps.append(lap_ns)
+            state.stats.update(lap_ns / 1e9)
+        else:
+            # A non-positive lap means the monotonic clock was reset (e.g. a
+            # reboot mid-session), so the crossing only restarts the lap
+            lap_ns = None
+        state.last_crossing_ns = crossing_ns
+        state.last_wall_ns = wall_ns
+        self.leaderboard.update(state)
+        return state, lap_ns
+
+    def record_crossing(self, transponder_id, crossing_ns, wall_ns):
+        with self.lock:
+            return self.apply_crossing(transponder_id, crossing_ns, wall_ns)
+
+    def reset(self):
+        with self.lock:
+            self.states.clear()
+            self.leaderboard.clear()
+
+    def standings(self, mode=RACE):
+        with self.lock:
+            return self.leaderboard.standings(mode)
+
+    # Copy of one transponder's laps in ns; a NumPy view of the live array
+    # would stop the ingest thread from appending to it
+    def laps(self, transponder_id):
+        with self.lock:
+            state = self.states.get(transponder_id)
+            return np.array(state.laps, dtype=np.int64) if state is not None else np.empty(0, dtype=np.int64)
+
+    def snapshot(self):
+        with self.lock:
+            return [(s.rfid, s.lap_count, s.last_lap_ns, s.best_lap_ns, s.last_wall_ns) for s in self.states.values()]
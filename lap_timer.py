@@ -1,63 +1,74 @@
 import pandas as pd
 import streamlit as st
-import time
 import json
-from ttl_interface import TTLInterface, SerialException
+from serial import SerialException
+from ingestion_hub import get_ingestion_hub
+from driver_registry import get_driver_registry
+from leaderboard import RACE, QUALIFYING
+from live_refresh import live_fragment, DEFAULT_REFRESH_INTERVAL
 
-LAP_DATABASE = "lap_timer.csv"
 SETTINGS_FILE = "settings.json"
 
-def load_lap_database():
-    try:
-        df = pd.read_csv(LAP_DATABASE)
-        if df.empty:
-            df = pd.DataFrame(columns=["ID", "Lap Time", "Best Lap", "Last Lap"])
-    except FileNotFoundError:
-        df = pd.DataFrame(columns=["ID", "Lap Time", "Best Lap", "Last Lap"])
-    return df
-
-def save_lap_database(data):
-    try:
-        data.to_csv(LAP_DATABASE, index=False)
-    except Exception as e:
-        print(f"Error saving to lap database: {e}")
+LAP_COLUMNS = ["Pos", "ID", "Driver", "Number", "Laps", "Lap Time", "Best Lap", "Gap", "Interval", "Pace", "Median", "Consistency"]
+
+def format_lap(lap_ns):
+    return format_time(lap_ns / 1e9) if lap_ns is not None else "Not Set"
+
+def format_seconds(seconds):
+    return format_time(seconds) if seconds is not None else ""
+
+def format_gap(gap_ns, gap_laps):
+    if gap_laps:
+        return f"+{gap_laps} lap" + ("s" if gap_laps > 1 else "")
+    if gap_ns is None:
+        return ""
+    return f"+{gap_ns / 1e9:.3f}"
+
+def format_split(split_ns):
+    return format_time(split_ns / 1e9) if split_ns is not None else ""
+
+# Splits of each driver's last fully timed lap and the sum of their best
+# sectors, when the track has sector loops
+def sector_columns(sectors, sector_count, transponder_id):
+    last_splits, best_splits, theoretical_best_ns = sectors.get(transponder_id, (None, None, None))
+    columns = {f"S{sector + 1}": format_split(last_splits[sector] if last_splits else None) for sector in range(sector_count)}
+    columns["Theoretical Best"] = format_split(theoretical_best_ns)
+    return columns
+
+def load_lap_table(mode=RACE):
+    rows = []
+    hub = get_ingestion_hub()
+    standings = hub.lap_engine.standings(mode)
+    sector_timer = hub.sectors
+    sectors = sector_timer.snapshot() if sector_timer is not None and sector_timer.loop_count > 1 else None
+    columns = LAP_COLUMNS + ([f"S{sector + 1}" for sector in range(sector_timer.loop_count)] + ["Theoretical Best"] if sectors is not None else [])
+    drivers = get_driver_registry().lookup_many([row["rfid"] for row in standings])
+    for row, driver in zip(standings, drivers):
+        stats = row["stats"]
+        rows.append({
+            "Pos": row["position"],
+            "ID": row["rfid"],
+            "Driver": driver["Driver Name"],
+            "Number": driver["Driver Number"],
+            "Laps": row["laps"],
+            "Lap Time": format_lap(row["last_lap_ns"]),
+            "Best Lap": format_lap(row["best_lap_ns"]),
+            "Gap": format_gap(row["gap_ns"], row["gap_laps"]),
+            "Interval": format_gap(row["interval_ns"], row["interval_laps"]),
+            "Pace": format_seconds(stats.ewma),
+            "Median": format_seconds(stats.median),
+            "Consistency": f"{stats.consistency:.1f}%" if stats.consistency is not None else "",
+        })
+        if sectors is not None:
+            rows[-1].update(sector_columns(sectors, sector_timer.loop_count, row["transponder_id"]))
+    return pd.DataFrame(rows, columns=columns)
 
 def format_time(seconds):
     minutes = int(seconds // 60)
-    seconds = int(seconds % 60)
     milliseconds = int((seconds % 1) * 1000)
+    seconds = int(seconds % 60)
     return f"{minutes:02}:{seconds:02}:{milliseconds:03}"
 
-def update_lap_times(rfid):
-    print(f"Updating lap times for RFID: {rfid}")
-    df = load_lap_database()
-    current_time = time.time()
-    
-    if rfid in df["ID"].values:
-        driver_data = df[df["ID"] == rfid]
-        last_lap_time = driver_data["Last Lap"].values[0]
-        if last_lap_time != "Not Set":
-            last_lap_time = float(last_lap_time)
-            lap_time = current_time - last_lap_time
-        else:
-            lap_time = 0
-
-        best_lap_time = driver_data["Best Lap"].values[0]
-        if best_lap_time == "Not Set" or lap_time < float(best_lap_time):
-            best_lap_time = lap_time
-
-        df.loc[df["ID"] == rfid, ["Lap Time", "Best Lap", "Last Lap"]] = [format_time(lap_time), format_time(best_lap_time), current_time]
-    else:
-        new_entry = pd.DataFrame([{
-            "ID": rfid,
-            "Lap Time": "Not Set",
-            "Best Lap": "Not Set",
-            "Last Lap": current_time
-        }])
-        df = pd.concat([df, new_entry], ignore_index=True)
-    
-    save_lap_database(df)
-
 def load_settings():
     try:
         with open(SETTINGS_FILE, 'r') as f:
@@ -66,13 +77,6 @@ def load_settings():
         settings = {}
     return settings
 
-def lap_detected(rfid):
-    print(f"RFID detected: {rfid}")
-    if st.session_state.get('race_started', False):
-        update_lap_times(rfid)
-    else:
-        print("Race not started. Data not recorded.")
-
 def init_ttl_interface():
     settings = load_settings()
     com_port = settings.get("selected_com_port")
@@ -80,9 +84,7 @@ def init_ttl_interface():
     
     if com_port and baud_rate:
         try:
-            ttl_interface = TTLInterface(lap_detected, com_port, baud_rate)
-            ttl_interface.start()
-            st.session_state.ttl_interface = ttl_interface
+            st.session_state.ttl_interface = get_ingestion_hub().open_port(com_port, baud_rate)
             st.session_state.ttl_interface_active = True
             print(f"Initialized TTL Interface on {com_port} at {baud_rate} baud.")
         except SerialException as e:
@@ -90,21 +92,22 @@ def init_ttl_interface():
     else:
         print("COM port or baud rate not set in settings.")
 
+# Race state lives on the shared hub: crossings are recorded on the reader
+# thread, which has no session, and every viewer should see the same race
 def start_race():
-    st.session_state.race_started = True
+    get_ingestion_hub().start_race()
     print("Race started")
 
 def stop_race():
-    st.session_state.race_started = False
+    get_ingestion_hub().stop_race()
     print("Race stopped")
 
 def lap_timer_page():
     st.title("Lap Timer")
 
-    if 'race_started' not in st.session_state:
-        st.session_state.race_started = False
+    hub = get_ingestion_hub()
 
-    if st.session_state.race_started:
+    if hub.race_started:
         if st.button("Stop Race"):
             stop_race()
             st.success("Race stopped.")
@@ -113,14 +116,33 @@ def lap_timer_page():
             start_race()
             st.success("Race started.")
 
-    if 'ttl_interface_active' in st.session_state and st.session_state.ttl_interface_active:
+    if hub.is_active():
         st.markdown('<span style="color: green; font-size: 24px;">●</span> Connection Active', unsafe_allow_html=True)
     else:
         st.markdown('<span style="color: red; font-size: 24px;">●</span> Connection Inactive', unsafe_allow_html=True)
 
-    df = load_lap_database()
+    st.radio("Order by", [RACE, QUALIFYING], format_func=lambda m: "Race (laps, total time)" if m == RACE else "Qualifying (best lap)", horizontal=True, key="lap_table_mode")
+    run_every = load_settings().get("live_refresh_interval", DEFAULT_REFRESH_INTERVAL) if hub.race_started else None
+    live_fragment(lap_table_panel, run_every=run_every)()
+
+# The table is rebuilt only when crossings arrived since this session's
+# cursor or the order, race state or race changed; otherwise the cached
+# frame is redrawn
+def lap_table_panel():
+    hub = get_ingestion_hub()
+    crossings, st.session_state.lap_table_cursor, missed = hub.read_crossings(st.session_state.get("lap_table_cursor", 0))
+    splits, st.session_state.split_cursor, missed_splits = hub.read_splits(st.session_state.get("split_cursor", 0))
+    key = (st.session_state.lap_table_mode, hub.race_started, hub.race_generation)
+    cached = st.session_state.get("lap_table")
+    if crossings or missed or splits or missed_splits or cached is None or cached[0] != key:
+        cached = st.session_state.lap_table = (key, load_lap_table(key[0]))
+
+    stats = hub.get_filter_stats()
+    st.caption(f"Reads: {stats['reads']} · duplicate reads suppressed: {stats['dropped_reads']} · crossings under minimum lap time: {stats['rejected_crossings']}")
+
+    df = cached[1]
     if not df.empty:
-        st.dataframe(df[["ID", "Lap Time", "Best Lap", "Last Lap"]])
+        st.dataframe(df, hide_index=True)
     else:
         st.write("No lap times recorded yet.")
 
@@ -0,0 +1,96 @@
+from bisect import bisect_left, insort
+
+RACE = "race"
+QUALIFYING = "qualifying"
+NO_BEST = float("inf")
+
+# Standings kept sorted as crossings arrive. Each mode has its own sorted key
+# list: race orders by (laps desc, total time asc), qualifying by best lap.
+# Updating a driver is a bisect to remove the old key and one to insert the
+# new one, so a crossing never re-sorts the field. Keys end in the interned
+# transponder id, so every comparison is between integers. The searches are
+# O(log n), but the list delete and insert shift the keys after them, O(n)
+# in all. That is deliberate: a field is tens of karts, where one memmove of
+# a few hundred bytes beats any balanced tree or chunked sorted container in
+# Python and needs no extra dependency.
+class Leaderboard:
+    def __init__(self):
+        self.keys = {RACE: [], QUALIFYING: []}
+        self.entries = {}  # transponder id -> (race key, qualifying key, state)
+
+    @staticmethod
+    def race_key(state):
+        return (-state.lap_count, state.last_crossing_ns - state.first_crossing_ns, state.transponder_id)
+
+    @staticmethod
+    def qualifying_key(state):
+        best = state.best_lap_ns if state.best_lap_ns is not None else NO_BEST
+        return (best, state.transponder_id)
+
+    def update(self, state):
+        entry = self.entries.get(state.transponder_id)
+        if entry is not None:
+            self.remove_key(RACE, entry[0])
+            self.remove_key(QUALIFYING, entry[1])
+        race_key = self.race_key(state)
+        qualifying_key = self.qualifying_key(state)
+        insort(self.keys[RACE], race_key)
+        insort(self.keys[QUALIFYING], qualifying_key)
+        self.entries[state.transponder_id] = (race_key, qualifying_key, state)
+
+    def remove_key(self, mode, key):
+        keys = self.keys[mode]
+        index = bisect_left(keys, key)
+        del keys[index]
+
+    def position(self, transponder_id, mode=RACE):
+        entry = self.entries.get(transponder_id)
+        if entry is None:
+            return None
+        key = entry[0] if mode == RACE else entry[1]
+        return bisect_left(self.keys[mode], key) + 1
+
+    def clear(self):
+        self.keys = {RACE: [], QUALIFYING: []}
+        self.entries.clear()
+
+    # Rows in position order. In race mode a gap or interval to a car on a
+    # different lap is given in laps (gap_laps/interval_laps) instead of time.
+    def standings(self, mode=RACE):
+        rows = []
+        leader = previous = None
+        for position, key in enumerate(self.keys[mode], start=1):
+            state = self.entries[key[-1]][2]
+            row = {
+                "position": position,
+                "transponder_id": state.transponder_id,
+                "rfid": state.rfid,
+                "laps": state.lap_count,
+                "total_ns": state.last_crossing_ns - state.first_crossing_ns,
+                "last_lap_ns": state.last_lap_ns,
+                "best_lap_ns": state.best_lap_ns,
+                "stats": state.stats,
+                "gap_ns": None,
+                "gap_laps": 0,
+                "interval_ns": None,
+                "interval_laps": 0,
+            }
+            if leader is not None:
+                row["gap_ns"], row["gap_laps"] = self.difference(mode, leader, row)
+                row["interval_ns"], row["interval_laps"] = self.difference(mode, previous, row)
+            else:
+                leader = row
+            previous = row
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def difference(mode, ahead, behind):
+        if mode == QUALIFYING:
+            if ahead["best_lap_ns"] is None or behind["best_lap_ns"] is None:
+                return None, 0
+            return behind["best_lap_ns"] - ahead["best_lap_ns"], 0
+        laps = ahead["laps"] - behind["laps"]
+        if laps:
+            return None, laps
+        return behind["total_ns"] - ahead["total_ns"], 0
@@ -0,0 +1,10 @@
+import streamlit as st
+
+DEFAULT_REFRESH_INTERVAL = 0.5  # Seconds between partial reruns of live panels
+
+# Runs func as a Streamlit fragment: only the fragment reruns, on its own
+# timer when run_every is set, so live panels update without rerunning the
+# whole page or holding a server thread in a sleep loop
+def live_fragment(func, run_every=None):
+    fragment = getattr(st, "fragment", None) or st.experimental_fragment
+    return fragment(func, run_every=run_every)
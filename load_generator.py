@@ -0,0 +1,163 @@
+import os
+import sys
+import time
+import heapq
+import random
+import argparse
+
+EPC_PREFIX = "E20000172211011918"  # Matches the tags in rfid_database.csv
+LINE_ENDING = b"\r\n"
+STATS_INTERVAL = 5.0
+
+def make_epc(index):
+    return f"{EPC_PREFIX}{index:06X}"
+
+# Opens a pseudo-terminal pair and returns (master fd, slave path). Whatever is
+# written to the master is read from the slave path exactly like a USB-serial
+# decoder, so TTLInterface can open it as its COM port.
+def open_virtual_port(link=None):
+    import pty
+    import tty
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+    if link:
+        if os.path.islink(link):
+            os.unlink(link)
+        os.symlink(path, link)
+        path = link
+    return master, slave, path
+
+class TrafficGenerator:
+    def __init__(self, fd, rng, partial_rate=0.0, garbage_rate=0.0):
+        self.fd = fd
+        self.rng = rng
+        self.partial_rate = partial_rate
+        self.garbage_rate = garbage_rate
+        self.frames = 0
+        self.bytes = 0
+
+    def send(self, payload):
+        data = payload.encode("ascii") + LINE_ENDING
+        if self.rng.random() < self.garbage_rate:
+            # Line noise: random bytes, sometimes with their own terminator
+            noise = bytes(self.rng.randrange(256) for _ in range(self.rng.randint(1, 12)))
+            data = noise + (LINE_ENDING if self.rng.random() < 0.5 else b"") + data
+        if self.rng.random() < self.partial_rate and len(data) > 2:
+            split = self.rng.randint(1, len(data) - 1)
+            self.write(data[:split])
+            time.sleep(0.002)  # Long enough for the reader to see half a frame
+            self.write(data[split:])
+        else:
+            self.write(data)
+        self.frames += 1
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+            self.bytes += written
+
+# Karts lap with normally distributed lap times; every pass is a burst of
+# duplicate reads, as a decoder reports a tag for as long as it is in the field
+def simulated_events(karts, lap_time, lap_jitter, burst, burst_spacing, rng):
+    events = []
+    for index in range(karts):
+        epc = make_epc(index)
+        heapq.heappush(events, (rng.uniform(0, lap_time), epc))
+    while True:
+        when, epc = heapq.heappop(events)
+        for read in range(rng.randint(1, burst)):
+            yield when + read * burst_spacing, epc
+        heapq.heappush(events, (when + max(1.0, rng.gauss(lap_time, lap_jitter)), epc))
+
+# Steady random reads at a fixed rate, for throughput testing
+def rate_events(karts, rate, rng):
+    epcs = [make_epc(index) for index in range(karts)]
+    when = 0.0
+    while True:
+        when += rng.expovariate(rate)
+        yield when, rng.choice(epcs)
+
+# Script lines are "offset_seconds,payload"; the payload is sent verbatim
+def scripted_events(path, loop):
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            offset, payload = line.split(",", 1)
+            entries.append((float(offset), payload))
+    if not entries:
+        return
+    period = entries[-1][0] + 1.0
+    base = 0.0
+    while True:
+        for offset, payload in entries:
+            yield base + offset, payload
+        if not loop:
+            return
+        base += period
+
+def run(events, generator, speed=1.0, duration=None):
+    start = time.monotonic()
+    next_stats = start + STATS_INTERVAL
+    last_frames = 0
+    for offset, payload in events:
+        target = start + offset / speed
+        now = time.monotonic()
+        if duration is not None and target - start > duration:
+            break
+        if target > now:
+            time.sleep(target - now)
+        generator.send(payload)
+        if now >= next_stats:
+            rate = (generator.frames - last_frames) / STATS_INTERVAL
+            lag = max(0.0, time.monotonic() - target)
+            print(f"{generator.frames} frames sent, {rate:.0f}/s, {lag * 1000:.1f} ms behind schedule", file=sys.stderr)
+            last_frames = generator.frames
+            next_stats += STATS_INTERVAL
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play transponder traffic into a virtual serial port for testing without a decoder.")
+    parser.add_argument("--karts", type=int, default=20)
+    parser.add_argument("--lap-time", type=float, default=40.0, help="Mean simulated lap in seconds")
+    parser.add_argument("--lap-jitter", type=float, default=2.0, help="Standard deviation of simulated laps")
+    parser.add_argument("--burst", type=int, default=5, help="Maximum duplicate reads per pass")
+    parser.add_argument("--burst-spacing", type=float, default=0.01, help="Seconds between reads in a burst")
+    parser.add_argument("--rate", type=float, help="Send random reads at this many per second instead of simulating laps")
+    parser.add_argument("--script", help="Replay 'offset_seconds,payload' lines from this file")
+    parser.add_argument("--loop", action="store_true", help="Repeat the script")
+    parser.add_argument("--speed", type=float, default=1.0, help="Time compression factor")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds of traffic")
+    parser.add_argument("--partial-rate", type=float, default=0.05, help="Fraction of frames split across two writes")
+    parser.add_argument("--garbage-rate", type=float, default=0.01, help="Fraction of frames preceded by line noise")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--link", help="Also expose the port under this path, e.g. /tmp/sippycup-decoder")
+    args = parser.parse_args()
+
+    if os.name != "posix":
+        parser.error("The virtual port needs a POSIX pty; run the generator on Linux or macOS.")
+
+    rng = random.Random(args.seed)
+    master, slave, path = open_virtual_port(args.link)
+    print(f"Virtual decoder on {path}", file=sys.stderr)
+    if args.script:
+        events = scripted_events(args.script, args.loop)
+    elif args.rate:
+        events = rate_events(args.karts, args.rate, rng)
+    else:
+        events = simulated_events(args.karts, args.lap_time, args.lap_jitter, args.burst, args.burst_spacing, rng)
+    generator = TrafficGenerator(master, rng, args.partial_rate, args.garbage_rate)
+    try:
+        run(events, generator, args.speed, args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Sent {generator.frames} frames ({generator.bytes} bytes)", file=sys.stderr)
+        os.close(master)
+        os.close(slave)
+        if args.link and os.path.islink(args.link):
+            os.unlink(args.link)
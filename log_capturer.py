@@ -1,41 +1,100 @@
+import sys
+import time
 import logging
 import threading
-import queue
+from collections import namedtuple
+from ring_buffer import RingBuffer
 
+LOG_CAPACITY = 5000
+LogEntry = namedtuple("LogEntry", ["timestamp", "level", "source", "message"])
+
+# File-like stand-in for sys.stdout/sys.stderr. Complete lines become
+# LogEntry records; everything is also written straight to the real stream,
+# never back through print(), so nothing loops.
+class CapturedStream:
+    def __init__(self, capturer, source, level, passthrough):
+        self.capturer = capturer
+        self.source = source
+        self.level = level
+        self.passthrough = passthrough
+        self.partial = threading.local()  # print() writes text and "\n" separately
+
+    def write(self, message):
+        if self.passthrough is not None:
+            try:
+                self.passthrough.write(message)
+            except (OSError, ValueError):
+                pass
+        if self.level < self.capturer.level:
+            return len(message)
+        pending = getattr(self.partial, "text", "") + message
+        lines = pending.split("\n")
+        self.partial.text = lines.pop()
+        for line in lines:
+            if line.strip():
+                self.capturer.append(self.level, self.source, line)
+        return len(message)
+
+    def flush(self):
+        if self.passthrough is not None:
+            try:
+                self.passthrough.flush()
+            except (OSError, ValueError):
+                pass
+
+    def isatty(self):
+        return False
+
+class RingHandler(logging.Handler):
+    def __init__(self, capturer, passthrough):
+        super().__init__()
+        self.capturer = capturer
+        self.passthrough = passthrough
+
+    # logging drops records below the handler level before emit is called, so
+    # filtered messages are never formatted
+    def emit(self, record):
+        try:
+            message = self.format(record)
+            self.capturer.append(record.levelno, record.name, message, record.created)
+            if self.passthrough is not None:
+                self.passthrough.write(message + "\n")
+        except Exception:
+            self.handleError(record)
+
+# Bounded in-memory log shared by the whole process. Records live in a ring
+# buffer, so any number of viewers can tail it with their own cursor and old
+# records fall off instead of accumulating.
 class LogCapturer:
-    def __init__(self):
-        self.log_queue = queue.Queue()
-        self.log_handler = logging.StreamHandler(self)
-        self.log_handler.setLevel(logging.INFO)
-        self.log_formatter = logging.Formatter('%(message)s')
-        self.log_handler.setFormatter(self.log_formatter)
+    def __init__(self, capacity=LOG_CAPACITY, level=logging.INFO):
+        self.records = RingBuffer(capacity)
+        self.level = level
+        self.stdout = CapturedStream(self, "stdout", logging.INFO, sys.__stdout__)
+        self.stderr = CapturedStream(self, "stderr", logging.ERROR, sys.__stderr__)
+        self.log_handler = RingHandler(self, sys.__stderr__)
+        self.log_handler.setLevel(level)
+        self.log_handler.setFormatter(logging.Formatter('%(message)s'))
         self.logger = logging.getLogger()
-        self.logger.setLevel(logging.INFO)
+        self.logger.setLevel(level)
         self.logger.addHandler(self.log_handler)
-    
+
+    def append(self, level, source, message, timestamp=None):
+        self.records.append(LogEntry(timestamp if timestamp is not None else time.time(), level, source, message))
+
+    # Lets the capturer itself stand in for sys.stdout
     def write(self, message):
-        if message.strip() != "":  # Ignore empty messages
-            self.log_queue.put(message)
-    
+        return self.stdout.write(message)
+
     def flush(self):
-        pass
-    
-    def start_logging(self):
-        self.log_thread = threading.Thread(target=self._log_thread)
-        self.log_thread.start()
-    
-    def _log_thread(self):
-        while True:
-            message = self.log_queue.get()
-            print(message)
-            self.log_queue.task_done()
-    
+        self.stdout.flush()
+
+    def read_since(self, cursor, min_level=logging.NOTSET):
+        records, cursor, missed = self.records.read_since(cursor)
+        if min_level > logging.NOTSET:
+            records = [record for record in records if record.level >= min_level]
+        return records, cursor, missed
+
     def get_log_contents(self):
-        log_contents = []
-        while not self.log_queue.empty():
-            log_contents.append(self.log_queue.get())
-            self.log_queue.task_done()
-        return log_contents
+        return [record.message for record in self.records.snapshot()]
 
 log_capturer = LogCapturer()
-log_capturer.start_logging()
@@ -0,0 +1,185 @@
+import math
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets in seconds, 10 µs to 2.5 s
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+DEFAULT_METRICS_PORT = 9108
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Instruments are plain attribute updates with no locking. Each one is fed
+# from a single thread in practice (reader, dispatcher or storage writer), and
+# a lost increment under contention is acceptable for monitoring.
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, labels=(), fn=None):
+        self.name = name
+        self.labels = labels
+        self.fn = fn  # Read at scrape time instead of being incremented
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get(self):
+        return self.fn() if self.fn is not None else self.value
+
+    def samples(self):
+        yield self.name, self.labels, self.get()
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Linear interpolation inside the bucket holding the rank, as Prometheus'
+    # histogram_quantile does; values past the last bound report that bound
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if index == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[index - 1] if index else 0.0
+                return lower + (self.bounds[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), self.counts):
+            cumulative += count
+            yield self.name + "_bucket", self.labels + (("le", format_value(bound)),), cumulative
+        yield self.name + "_sum", self.labels, self.sum
+        yield self.name + "_count", self.labels, self.count
+
+# Process-wide set of instruments. Instruments are created once, usually at
+# import, and kept by the module that updates them; call sites guard updates
+# with `if metrics.enabled:` so a disabled registry costs one attribute check.
+class MetricsRegistry:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.instruments = {}  # (name, labels) -> instrument
+        self.help = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def get_or_create(self, cls, name, help_text, labels, **kwargs):
+        labels = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            instrument = self.instruments.get((name, labels))
+            if instrument is None:
+                instrument = self.instruments[(name, labels)] = cls(name, labels, **kwargs)
+                self.help[name] = (help_text, cls.kind)
+            return instrument
+
+    def counter(self, name, help_text, labels=None, fn=None):
+        counter = self.get_or_create(Counter, name, help_text, labels)
+        if fn is not None:
+            counter.fn = fn
+        return counter
+
+    # fn is re-bound on every call, so the newest owner of a depth gauge wins
+    def gauge(self, name, help_text, labels=None, fn=None):
+        gauge = self.get_or_create(Gauge, name, help_text, labels)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name, help_text, labels=None, buckets=DEFAULT_BUCKETS):
+        return self.get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+    def collect(self):
+        with self.lock:
+            instruments = sorted(self.instruments.items())
+        return [instrument for _, instrument in instruments]
+
+    def render(self):
+        lines = []
+        described = set()
+        for instrument in self.collect():
+            if instrument.name not in described:
+                described.add(instrument.name)
+                help_text, kind = self.help[instrument.name]
+                lines.append(f"# HELP {instrument.name} {help_text}")
+                lines.append(f"# TYPE {instrument.name} {kind}")
+            try:
+                for name, labels, value in instrument.samples():
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+            except Exception as e:
+                lines.append(f"# {instrument.name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+    # Serves /metrics in Prometheus text format on a daemon thread. Binds to
+    # localhost only; put a proxy in front to scrape from another machine.
+    def start_server(self, port=DEFAULT_METRICS_PORT, host="127.0.0.1"):
+        if self.server is not None:
+            return self.server
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes would otherwise flood the terminal page
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://{host}:{port}/metrics")
+        return self.server
+
+metrics = MetricsRegistry()
+
+# Applies metrics_enabled/metrics_port from settings.json. The endpoint is
+# optional: with metrics_port unset (or null) the instruments still feed the
+# Terminal page panel.
+def configure_metrics(settings, port=None):
+    metrics.enabled = bool(settings.get("metrics_enabled", False))
+    port = port if port is not None else settings.get("metrics_port")
+    if metrics.enabled and port:
+        try:
+            metrics.start_server(int(port))
+        except OSError as e:
+            print(f"Could not serve metrics on port {port}: {e}")
@@ -0,0 +1,223 @@
+import os
+import time
+import asyncio
+import argparse
+from collections import deque
+from serial import SerialException
+from ttl_interface import TTLInterface
+from node_protocol import (
+    DEFAULT_NODE_PORT, MSG_HELLO, MSG_FRAMES, MSG_ACK, MSG_PING, MSG_PONG,
+    HELLO, ACK, PING, PONG, pack_message, pack_frame, unpack_frames, read_message,
+)
+
+SPOOL_FILE = "node_spool.bin"
+SPOOL_MAGIC = b"SIPSPOL1"
+SPOOL_HEADER_SIZE = len(SPOOL_MAGIC) + HELLO.size  # magic, then the boot id the records belong to
+DEFAULT_BATCH_INTERVAL = 0.02  # Seconds frames may wait to share a message
+MAX_BATCH_FRAMES = 512
+RECONNECT_MIN = 0.5
+RECONNECT_MAX = 10.0
+
+# Runs beside a remote decoder and forwards its frames to the central
+# DecoderService over TCP, batched into MSG_FRAMES messages every
+# batch_interval. Frames keep the node's own monotonic timestamps; the
+# central side measures this node's clock with ping exchanges and corrects
+# them there.
+#
+# Sent frames are kept until the central side acknowledges them. While the
+# link is down, unacknowledged and new frames go to a spool file, which is
+# resent on reconnect before any live frame. Frame sequence numbers let the
+# central side drop anything it already has, so a link that drops mid-batch
+# neither loses nor duplicates reads. The spool keeps the boot id its
+# sequence numbers belong to, so a restarted agent carries on where it left
+# off.
+class NodeAgent:
+    def __init__(self, name, host, port=DEFAULT_NODE_PORT, spool_path=SPOOL_FILE, batch_interval=DEFAULT_BATCH_INTERVAL, clock_offset_ns=0):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.spool_path = spool_path
+        self.batch_interval = batch_interval
+        self.clock_offset_ns = clock_offset_ns  # Added to every timestamp, to exercise correction on loopback
+        self.loop = None
+        self.writer = None
+        self.ready = False  # Connected and the spool has been resent
+        self.pending = []  # Encoded frame records not yet sent
+        self.pending_seq = 0
+        self.unacked = deque()  # (last seq, encoded records) sent but not acknowledged
+        self.boot_id, self.seq, self.spooled_through = self.open_spool()
+        self.sent = 0
+
+    # Returns (boot id, last seq, last spooled seq), continuing an existing
+    # spool so its records can still be told apart from ones already received
+    def open_spool(self):
+        try:
+            with open(self.spool_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        if data.startswith(SPOOL_MAGIC) and len(data) > SPOOL_HEADER_SIZE:
+            boot_id, = HELLO.unpack_from(data, len(SPOOL_MAGIC))
+            seqs = [record[0] for record in unpack_frames(data[SPOOL_HEADER_SIZE:])]
+            if seqs:
+                print(f"Resuming with {len(seqs)} spooled frames")
+                return boot_id, seqs[-1], seqs[-1]
+        boot_id = int.from_bytes(os.urandom(8), "little")
+        self.reset_spool(boot_id)
+        return boot_id, 0, 0
+
+    def reset_spool(self, boot_id=None):
+        with open(self.spool_path, "wb") as f:
+            f.write(SPOOL_MAGIC + HELLO.pack(self.boot_id if boot_id is None else boot_id))
+
+    def spool(self, records, last_seq):
+        with open(self.spool_path, "ab") as f:
+            f.write(records)
+            f.flush()
+            os.fsync(f.fileno())
+        self.spooled_through = last_seq
+
+    def clock_ns(self):
+        return time.monotonic_ns() + self.clock_offset_ns
+
+    # TTLInterface callback, on its dispatch thread
+    def handle_frame(self, frame):
+        self.loop.call_soon_threadsafe(self.add_frame, frame)
+
+    def add_frame(self, frame):
+        self.seq += 1
+        self.pending.append(pack_frame(self.seq, frame.arrival_ns + self.clock_offset_ns, frame.wall_ns, frame.data))
+        self.pending_seq = self.seq
+        if len(self.pending) >= MAX_BATCH_FRAMES:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        records = b"".join(self.pending)
+        self.pending.clear()
+        if self.ready:
+            self.send_batch(records, self.pending_seq)
+        elif self.writer is None:
+            self.spool(records, self.pending_seq)
+        else:
+            # Still resending the spool; live frames wait their turn
+            self.pending.append(records)
+
+    def send_batch(self, records, last_seq):
+        self.writer.write(pack_message(MSG_FRAMES, records))
+        self.unacked.append((last_seq, records))
+        self.sent += 1
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.batch_interval)
+            self.flush()
+
+    def acknowledge(self, seq):
+        while self.unacked and self.unacked[0][0] <= seq:
+            self.unacked.popleft()
+        if self.spooled_through and seq >= self.spooled_through:
+            self.reset_spool()
+            self.spooled_through = 0
+
+    async def connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        self.writer = writer
+        writer.write(pack_message(MSG_HELLO, HELLO.pack(self.boot_id) + self.name.encode("utf-8")))
+        kind, payload = await read_message(reader)
+        if kind != MSG_ACK:
+            raise ValueError(f"Expected an acknowledgement, got message type {kind}")
+        acked, = ACK.unpack(payload)
+        self.acknowledge(acked)
+        if self.spooled_through:
+            with open(self.spool_path, "rb") as f:
+                data = f.read()[SPOOL_HEADER_SIZE:]
+            batch = []
+            for seq, arrival_ns, wall_ns, text in unpack_frames(data):
+                if seq > acked:
+                    batch.append(pack_frame(seq, arrival_ns, wall_ns, text))
+                if len(batch) >= MAX_BATCH_FRAMES:
+                    self.send_batch(b"".join(batch), seq)
+                    batch = []
+                    await writer.drain()
+            if batch:
+                self.send_batch(b"".join(batch), self.spooled_through)
+            print(f"Resent spool through frame {self.spooled_through}")
+        self.ready = True
+        print(f"Connected to {self.host}:{self.port} as {self.name!r}")
+        self.flush()
+        return reader
+
+    async def receive(self, reader):
+        while True:
+            kind, payload = await read_message(reader)
+            if kind == MSG_PING:
+                t1 = self.clock_ns()
+                t0, = PING.unpack(payload)
+                self.writer.write(pack_message(MSG_PONG, PONG.pack(t0, t1, self.clock_ns())))
+            elif kind == MSG_ACK:
+                self.acknowledge(ACK.unpack(payload)[0])
+
+    # Everything not acknowledged goes back to the spool, after what is
+    # already there, so the spool stays in sequence order
+    def disconnected(self):
+        writer, self.writer = self.writer, None
+        self.ready = False
+        if writer is not None:
+            writer.close()
+        unacked = [(seq, records) for seq, records in self.unacked if seq > self.spooled_through]
+        self.unacked.clear()
+        if unacked:
+            self.spool(b"".join(records for _, records in unacked), unacked[-1][0])
+        self.flush()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        flusher = self.loop.create_task(self.flush_periodically())
+        backoff = RECONNECT_MIN
+        try:
+            while True:
+                try:
+                    reader = await self.connect()
+                    backoff = RECONNECT_MIN
+                    await self.receive(reader)
+                except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                    print(f"Link to {self.host}:{self.port} down ({e or type(e).__name__}); spooling to {self.spool_path}")
+                self.disconnected()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, RECONNECT_MAX)
+        finally:
+            flusher.cancel()
+            self.disconnected()
+
+def run_agent(agent, com_port, baud_rate):
+    async def main():
+        agent.loop = asyncio.get_running_loop()
+        interface = TTLInterface(agent.handle_frame, com_port, baud_rate)
+        interface.start()
+        try:
+            await agent.run()
+        finally:
+            interface.stop()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Node agent stopped")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Forward a remote decoder's frames to the central timing process.")
+    parser.add_argument("--name", required=True, help="Node name, matching a timing_loops entry's \"node\" on the central side")
+    parser.add_argument("--port", required=True, help="Decoder serial port on this machine")
+    parser.add_argument("--baud", type=int, default=9600)
+    parser.add_argument("--server", required=True, help="Central host[:port], port defaulting to %d" % DEFAULT_NODE_PORT)
+    parser.add_argument("--spool", default=SPOOL_FILE)
+    parser.add_argument("--batch-ms", type=float, default=DEFAULT_BATCH_INTERVAL * 1000)
+    parser.add_argument("--clock-offset-ms", type=float, default=0.0, help="Skew this node's clock, to test offset correction with agents on one machine")
+    args = parser.parse_args()
+    host, _, port = args.server.rpartition(":") if ":" in args.server else (args.server, "", "")
+    agent = NodeAgent(args.name, host, int(port) if port else DEFAULT_NODE_PORT, args.spool, args.batch_ms / 1000, int(args.clock_offset_ms * 1_000_000))
+    try:
+        run_agent(agent, args.port, args.baud)
+    except SerialException as e:
+        parser.error(str(e))
@@ -0,0 +1,80 @@
+import struct
+from collections import deque
+
+DEFAULT_NODE_PORT = 9110
+
+# Every message is a 5-byte header, type then payload length, followed by the
+# payload. Integers are little-endian; timestamps are the sender's
+# time.monotonic_ns().
+MESSAGE_HEADER = struct.Struct("<BI")
+MAX_PAYLOAD = 16 * 1024 * 1024
+
+MSG_HELLO = 1  # node -> central: boot id, then the node name in UTF-8
+MSG_FRAMES = 2  # node -> central: one or more frame records
+MSG_ACK = 3  # central -> node: highest frame seq received from this boot
+MSG_PING = 4  # central -> node: t0
+MSG_PONG = 5  # node -> central: t0 echoed, t1 received, t2 sent
+
+HELLO = struct.Struct("<Q")
+# seq, arrival_ns, wall_ns, length, then length bytes of frame text. seq counts
+# up from 1 per node boot id, so the central side can drop frames it already
+# has when a node resends after a reconnect.
+FRAME_RECORD = struct.Struct("<QqqH")
+ACK = struct.Struct("<Q")
+PING = struct.Struct("<q")
+PONG = struct.Struct("<qqq")
+
+def pack_message(kind, payload=b""):
+    return MESSAGE_HEADER.pack(kind, len(payload)) + payload
+
+def pack_frame(seq, arrival_ns, wall_ns, data):
+    encoded = data.encode("utf-8")
+    return FRAME_RECORD.pack(seq, arrival_ns, wall_ns, len(encoded)) + encoded
+
+# Yields (seq, arrival_ns, wall_ns, data) from a MSG_FRAMES payload or a spool
+# file; a record cut short ends the batch
+def unpack_frames(payload):
+    view = memoryview(payload)
+    offset = 0
+    header_size = FRAME_RECORD.size
+    end = len(payload)
+    while offset + header_size <= end:
+        seq, arrival_ns, wall_ns, length = FRAME_RECORD.unpack_from(view, offset)
+        offset += header_size
+        if offset + length > end:
+            break
+        yield seq, arrival_ns, wall_ns, str(view[offset:offset + length], "utf-8")
+        offset += length
+
+# Reads one message from an asyncio StreamReader as (kind, payload)
+async def read_message(reader):
+    kind, length = MESSAGE_HEADER.unpack(await reader.readexactly(MESSAGE_HEADER.size))
+    if length > MAX_PAYLOAD:
+        raise ValueError(f"Message of {length} bytes exceeds the {MAX_PAYLOAD} byte limit")
+    return kind, await reader.readexactly(length)
+
+# NTP-style estimate of a node clock against ours from ping exchanges: t0 and
+# t3 are our send and receive times, t1 and t2 the node's. The offset is
+# node minus central and the round trip excludes the node's turnaround. The
+# sample with the shortest round trip among the last few is the least
+# disturbed by queueing, so that is the one used; keeping only recent samples
+# lets the estimate follow drift.
+class ClockOffset:
+    def __init__(self, window=8):
+        self.samples = deque(maxlen=window)
+        self.offset_ns = None
+        self.delay_ns = None
+
+    def add(self, t0, t1, t2, t3):
+        delay_ns = (t3 - t0) - (t2 - t1)
+        offset_ns = ((t1 - t0) + (t2 - t3)) // 2
+        self.samples.append((delay_ns, offset_ns))
+        self.delay_ns, self.offset_ns = min(self.samples)
+
+    def reset(self):
+        self.samples.clear()
+        self.offset_ns = None
+        self.delay_ns = None
+
+    def to_local(self, node_ns):
+        return node_ns - self.offset_ns
@@ -0,0 +1,26 @@
+import importlib
+from collections import namedtuple
+
+# Sidebar pages in menu order. A page's module is imported the first time the
+# page is shown rather than when app.py starts, so a kiosk that only ever
+# shows the Dashboard never loads the interface page's port tools or psutil.
+# Streamlit reruns app.py on every interaction but modules stay in
+# sys.modules, so each page is imported at most once per process.
+Page = namedtuple("Page", ["name", "icon", "module", "function"])
+PAGES = [
+    Page("Dashboard", "house", "dashboard", "dashboard_page"),
+    Page("Driver Setup", "gear", "driver_setup", "driver_setup_page"),
+    Page("Interface", "antenna", "interface_page", "interface_page"),
+    Page("Lap Timer", "clock", "lap_timer", "lap_timer_page"),
+    Page("Terminal", "terminal", "terminal_page", "terminal_page"),
+]
+DEFAULT_PAGE = PAGES[0]
+
+def get_page(name):
+    for page in PAGES:
+        if page.name == name:
+            return page
+    return DEFAULT_PAGE
+
+def load_page(page):
+    return getattr(importlib.import_module(page.module), page.function)
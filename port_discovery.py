@@ -0,0 +1,130 @@
+import re
+import time
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import serial
+import serial.tools.list_ports
+from serial import SerialException
+from ttl_interface import FRAME_DELIMITER
+
+BAUD_RATES = [9600, 115200, 57600, 38400, 19200]  # Most common decoder rates first
+SAMPLE_TIME = 0.4  # Seconds to listen at each baud rate
+SAMPLE_BYTES = 512  # Stop listening once this much has arrived
+READ_TIMEOUT = 0.05
+CONFIDENT_FRAMES = 3  # Matching frames after which other baud rates are not tried
+
+# Frame formats a decoder may emit, most specific first. The pipeline takes
+# the whole line as the transponder id, so any of them can be timed.
+DecoderFormat = namedtuple("DecoderFormat", ["name", "pattern"])
+DECODER_FORMATS = [
+    DecoderFormat("EPC-96", re.compile(r"[0-9A-Fa-f]{24}")),
+    DecoderFormat("EPC hex", re.compile(r"(?:[0-9A-Fa-f]{4}){2,16}")),
+    DecoderFormat("Prefixed EPC", re.compile(r"(?:EPC|TAG|ID)\s*[:=,]?\s*[0-9A-Fa-f]{8,64}", re.IGNORECASE)),
+    DecoderFormat("Decimal ID", re.compile(r"\d{5,12}")),
+]
+
+# frames counts complete lines in the sample and matched those in the
+# detected format; printable is the share of bytes that are printable ASCII
+# or line ends, which is low at the wrong baud rate
+class Candidate(namedtuple("Candidate", ["com_port", "baud_rate", "format", "frames", "matched", "printable", "bytes", "sample", "error"])):
+    __slots__ = ()
+
+    # 0.5 to 1 for a recognised decoder, below that for text or noise, 0 for a
+    # silent port and -1 for one that could not be opened
+    @property
+    def confidence(self):
+        if self.error is not None:
+            return -1.0
+        if not self.bytes:
+            return 0.0
+        if self.format is not None:
+            return 0.5 + 0.5 * (self.matched / self.frames) * min(1.0, self.matched / CONFIDENT_FRAMES)
+        if self.frames:
+            return 0.3 * self.printable
+        return 0.1 * self.printable
+
+def printable_share(data):
+    printable = sum(1 for byte in data if 32 <= byte < 127 or byte in (10, 13))
+    return printable / len(data) if data else 0.0
+
+# Complete lines of a sample; the text before the first line end may be the
+# tail of a frame sent before we started listening, so it is skipped
+def sample_lines(data):
+    parts = FRAME_DELIMITER.split(data)
+    lines = []
+    for raw in parts[1:-1]:
+        try:
+            line = raw.decode("ascii").strip()
+        except UnicodeDecodeError:
+            line = None
+        if line != "":
+            lines.append(line)
+    return lines
+
+# Returns (format, frames, matched) for the format matching most lines
+def classify(data):
+    lines = sample_lines(data)
+    best, matched = None, 0
+    for decoder_format in DECODER_FORMATS:
+        count = sum(1 for line in lines if line is not None and decoder_format.pattern.fullmatch(line))
+        if count > matched:
+            best, matched = decoder_format.name, count
+    return best, len(lines), matched
+
+def probe(com_port, baud_rate, sample_time=SAMPLE_TIME):
+    try:
+        with serial.Serial(com_port, baud_rate, timeout=READ_TIMEOUT) as conn:
+            conn.reset_input_buffer()
+            data = bytearray()
+            deadline = time.monotonic() + sample_time
+            while time.monotonic() < deadline and len(data) < SAMPLE_BYTES:
+                data += conn.read(SAMPLE_BYTES - len(data))
+                decoder_format, frames, matched = classify(data)
+                if matched >= CONFIDENT_FRAMES:
+                    break
+    except (SerialException, OSError) as e:
+        return Candidate(com_port, baud_rate, None, 0, 0, 0.0, 0, "", str(e))
+    decoder_format, frames, matched = classify(data)
+    sample = bytes(data[:80]).decode("ascii", "backslashreplace")
+    return Candidate(com_port, baud_rate, decoder_format, frames, matched, printable_share(data), len(data), sample, None)
+
+# A port is only ever open at one baud rate at a time, so each port is one
+# job that walks the baud rates, stopping early once a decoder is clearly
+# recognised or the port cannot be opened at all
+def probe_port(com_port, baud_rates, sample_time=SAMPLE_TIME):
+    candidates = []
+    for baud_rate in baud_rates:
+        candidate = probe(com_port, baud_rate, sample_time)
+        candidates.append(candidate)
+        if candidate.error is not None or candidate.matched >= CONFIDENT_FRAMES:
+            break
+    return candidates
+
+# Probes every port in parallel and returns all candidates, best first. With
+# 6 ports and 5 baud rates this takes about 5 x sample_time instead of 30
+# sequential opens with a one second timeout each. Ports in exclude (already
+# open in this process) are left alone.
+def discover(ports=None, baud_rates=BAUD_RATES, sample_time=SAMPLE_TIME, exclude=()):
+    if ports is None:
+        ports = [port.device for port in serial.tools.list_ports.comports()]
+    ports = [port for port in ports if port not in exclude]
+    if not ports:
+        return []
+    with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+        results = pool.map(lambda port: probe_port(port, baud_rates, sample_time), ports)
+        candidates = [candidate for port_candidates in results for candidate in port_candidates]
+    return sorted(candidates, key=lambda c: (-c.confidence, -c.matched, -c.bytes, c.com_port, c.baud_rate))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find decoder ports, baud rates and frame formats. Pass a transponder over the antenna while it runs.")
+    parser.add_argument("ports", nargs="*", help="Ports to probe (default: every port the system lists)")
+    parser.add_argument("--baud", type=int, action="append", help="Baud rate to try; repeat for several (default: %s)" % ", ".join(map(str, BAUD_RATES)))
+    parser.add_argument("--sample-time", type=float, default=SAMPLE_TIME, help="Seconds to listen at each baud rate")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    candidates = discover(args.ports or None, args.baud or BAUD_RATES, args.sample_time)
+    print(f"Probed {len(candidates)} port/baud combinations in {time.perf_counter() - started:.2f}s")
+    for candidate in candidates:
+        detail = candidate.error or f"{candidate.format or 'unrecognised'}, {candidate.matched}/{candidate.frames} frames, {candidate.bytes} bytes  {candidate.sample!r}"
+        print(f"  {candidate.confidence:5.2f}  {candidate.com_port:<16} {candidate.baud_rate:>6}  {detail}")
@@ -0,0 +1,161 @@
+import sys
+import json
+import time
+import argparse
+import datetime
+from ingestion_hub import load_settings
+from lap_engine import LapEngine
+from transponder_ids import TransponderIds
+from leaderboard import RACE, QUALIFYING
+from duplicate_filter import DuplicateFilter, DEDUP_MODES, DEFAULT_WINDOW_MS, DEFAULT_MIN_LAP_TIME
+from capture import read_capture, list_captures, KIND_FRAME, KIND_RACE_START, KIND_RACE_STOP, CAPTURE_DIR
+
+MIN_SLEEP = 0.001  # Paced replays only sleep once they are this far ahead
+
+class ReplayRace:
+    def __init__(self, transponders, start_wall_ns=None):
+        self.start_wall_ns = start_wall_ns
+        self.stop_wall_ns = None
+        self.lap_engine = LapEngine(transponders=transponders)
+        self.crossings = []  # (rfid, crossing_ns, wall_ns, lap_ns), as the hub publishes them
+
+    def record(self, transponder_id, crossing_ns, wall_ns):
+        state, lap_ns = self.lap_engine.apply_crossing(transponder_id, crossing_ns, wall_ns)
+        self.crossings.append((state.rfid, crossing_ns, wall_ns, lap_ns))
+
+# Re-scores captured frames with its own duplicate filter and lap engine,
+# following the same rules as IngestionHub: reads always go through the
+# filter, keyed on the EPC, and transponders are only interned once a
+# crossing is recorded inside a race. Races come from the start/stop
+# markers in the capture, or from an explicit wall-clock window when the
+# recorded start was wrong. No storage or clock is touched unless asked, so a
+# replay of the same capture is deterministic.
+class Replayer:
+    def __init__(self, window_ms=DEFAULT_WINDOW_MS, min_lap_time=DEFAULT_MIN_LAP_TIME, mode="first", race_window=None):
+        self.duplicate_filter = DuplicateFilter(window_ms, min_lap_time, mode)
+        self.transponders = TransponderIds()
+        self.race_window = race_window  # (start_wall_ns, end_wall_ns), either may be None
+        self.races = []
+        self.current = None
+        self.frames = 0
+        if race_window is not None:
+            self.current = ReplayRace(self.transponders, race_window[0])
+            self.races.append(self.current)
+
+    def feed(self, record):
+        if record.kind == KIND_FRAME:
+            self.frames += 1
+            self.record(self.duplicate_filter.feed(record.data, record.arrival_ns, record.wall_ns))
+            return
+        self.record(self.duplicate_filter.expire(record.arrival_ns))
+        if self.race_window is not None:
+            return
+        if record.kind == KIND_RACE_START:
+            self.current = ReplayRace(self.transponders, record.wall_ns)
+            self.races.append(self.current)
+        elif record.kind == KIND_RACE_STOP and self.current is not None:
+            self.current.stop_wall_ns = record.wall_ns
+            self.current = None
+
+    def record(self, crossings):
+        race = self.current
+        if race is None:
+            return
+        for rfid, crossing_ns, wall_ns in crossings:
+            if self.race_window is not None:
+                start, end = self.race_window
+                if (start is not None and wall_ns < start) or (end is not None and wall_ns >= end):
+                    continue
+            race.record(self.transponders.intern(rfid), crossing_ns, wall_ns)
+
+    def finish(self):
+        self.record(self.duplicate_filter.expire(2**63 - 1))
+        if self.race_window is not None and self.current is not None:
+            self.current.stop_wall_ns = self.race_window[1]
+        return self.races
+
+    # speed=None replays as fast as possible; otherwise the gaps between
+    # arrivals are divided by speed. A backwards step in the monotonic clock
+    # (reader restarted after a reboot) is replayed without a pause.
+    def run(self, records, speed=None):
+        started = time.monotonic()
+        origin = previous = None
+        offset = 0.0
+        for record in records:
+            if speed:
+                if origin is None:
+                    origin = previous = record.arrival_ns
+                if record.arrival_ns < previous:
+                    offset += (previous - origin) / 1e9
+                    origin = record.arrival_ns
+                previous = record.arrival_ns
+                ahead = started + (offset + (record.arrival_ns - origin) / 1e9) / speed - time.monotonic()
+                if ahead > MIN_SLEEP:
+                    time.sleep(ahead)
+            self.feed(record)
+        return self.finish()
+
+def iter_captures(paths):
+    for path in paths:
+        yield from read_capture(path)
+
+# Stores a replayed race as a new session, leaving the original untouched
+def save_race(race, name):
+    from storage import get_storage
+    storage = get_storage()
+    session_id = storage.start_session(name)
+    for rfid, crossing_ns, wall_ns, lap_ns in race.crossings:
+        storage.record_crossing(session_id, storage.transponder_id(rfid), crossing_ns, wall_ns, lap_ns)
+    storage.end_session(session_id)
+    return session_id
+
+def parse_time(text):
+    return int(datetime.datetime.fromisoformat(text).timestamp() * 1e9) if text else None
+
+def format_wall(wall_ns):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(wall_ns / 1e9)) if wall_ns is not None else "-"
+
+def print_race(index, race, mode):
+    print(f"Race {index}: {format_wall(race.start_wall_ns)} to {format_wall(race.stop_wall_ns)}, {len(race.crossings)} crossings")
+    for row in race.lap_engine.standings(mode):
+        best = f"{row['best_lap_ns'] / 1e9:.3f}" if row["best_lap_ns"] is not None else "-"
+        print(f"  {row['position']:>3}  {row['rfid']:<26} laps {row['laps']:>4}  best {best:>9}  total {row['total_ns'] / 1e9:10.3f}")
+
+if __name__ == "__main__":
+    settings = load_settings()
+    parser = argparse.ArgumentParser(description="Re-time races from capture files with different pipeline settings.")
+    parser.add_argument("captures", nargs="*", help=f"Capture files (default: everything in {CAPTURE_DIR}/)")
+    parser.add_argument("--dedup-window-ms", type=float, default=settings.get("dedup_window_ms", DEFAULT_WINDOW_MS))
+    parser.add_argument("--dedup-mode", choices=DEDUP_MODES, default=settings.get("dedup_mode", "first"))
+    parser.add_argument("--min-lap-time", type=float, default=settings.get("min_lap_time", DEFAULT_MIN_LAP_TIME))
+    parser.add_argument("--speed", type=float, help="Replay at this multiple of real time instead of as fast as possible, e.g. 1000")
+    parser.add_argument("--start", help="Ignore recorded markers and score one race from this local time (ISO format)")
+    parser.add_argument("--end", help="End of that race (ISO format)")
+    parser.add_argument("--all", action="store_true", help="Ignore recorded markers and score the whole capture as one race")
+    parser.add_argument("--order", choices=[RACE, QUALIFYING], default=RACE)
+    parser.add_argument("--json", action="store_true", help="Print crossings as JSON, e.g. to keep as a regression fixture")
+    parser.add_argument("--save", action="store_true", help="Store each replayed race as a new session")
+    args = parser.parse_args()
+
+    paths = args.captures or list_captures(settings.get("capture_dir") or CAPTURE_DIR)
+    if not paths:
+        parser.error("No capture files found")
+    race_window = None
+    if args.start or args.end or args.all:
+        race_window = (parse_time(args.start), parse_time(args.end))
+
+    replayer = Replayer(args.dedup_window_ms, args.min_lap_time, args.dedup_mode, race_window)
+    started = time.perf_counter()
+    races = replayer.run(iter_captures(paths), args.speed)
+    elapsed = time.perf_counter() - started
+    print(f"Replayed {replayer.frames} frames from {len(paths)} capture(s) in {elapsed:.2f}s", file=sys.stderr)
+
+    if args.json:
+        print(json.dumps([{"start_wall_ns": race.start_wall_ns, "crossings": race.crossings} for race in races]))
+    else:
+        for index, race in enumerate(races, start=1):
+            print_race(index, race, args.order)
+    if args.save:
+        for index, race in enumerate(races, start=1):
+            session_id = save_race(race, f"Replay of race {index} ({format_wall(race.start_wall_ns)})")
+            print(f"Saved race {index} as session {session_id}", file=sys.stderr)
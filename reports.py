@@ -0,0 +1,221 @@
+import os
+import html
+import sqlite3
+from collections import namedtuple
+from lap_engine import LapEngine
+from leaderboard import RACE
+from transponder_ids import TransponderIds
+
+# Report rendering, run in worker processes by jobs.JobRunner. Nothing here
+# imports streamlit or opens the shared Storage: a worker reads the database
+# through its own read-only connection, replays the session through a
+# LapEngine so positions follow the same rules as the live leaderboard, and
+# writes static HTML. Sheets are laid out to print, so a PDF is the
+# browser's "Save as PDF" away.
+REPORT_DIR = "reports"
+NOT_ASSIGNED = "Not Assigned"
+CHART_WIDTH = 760
+CHART_HEIGHT = 320
+CHART_MARGIN = 40
+PALETTE = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"]
+
+Driver = namedtuple("Driver", ["name", "number", "kart", "kart_cc"])
+UNKNOWN_DRIVER = Driver(NOT_ASSIGNED, NOT_ASSIGNED, NOT_ASSIGNED, NOT_ASSIGNED)
+
+# A session replayed from its stored crossings. positions[tid][k] is the
+# transponder's place among those that had completed lap k + 1, by the time
+# they completed it, which is what a lap chart plots.
+class SessionResult:
+    def __init__(self, name, engine, completions, drivers):
+        self.name = name
+        self.engine = engine
+        self.drivers = drivers
+        self.standings = engine.standings(RACE)
+        self.positions = lap_positions(completions)
+
+    def driver(self, transponder_id):
+        return self.drivers.get(transponder_id, UNKNOWN_DRIVER)
+
+def connect(database_path):
+    return sqlite3.connect(f"file:{database_path}?mode=ro", uri=True, timeout=30)
+
+def load_session(database_path, session_id):
+    conn = connect(database_path)
+    try:
+        row = conn.execute("SELECT name FROM race_sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"No race session {session_id} in {database_path}")
+        transponders = TransponderIds()
+        transponders.load(dict(conn.execute("SELECT id, rfid FROM transponders")))
+        engine = LapEngine(transponders=transponders)
+        completions = {}  # transponder id -> crossing_ns of every completed lap
+        cursor = conn.execute("SELECT transponder_id, crossing_ns, wall_ns FROM crossings WHERE session_id = ? ORDER BY id", (session_id,))
+        for transponder_id, crossing_ns, wall_ns in cursor:
+            _, lap_ns = engine.apply_crossing(transponder_id, crossing_ns, wall_ns)
+            if lap_ns is not None:
+                completions.setdefault(transponder_id, []).append(crossing_ns)
+        drivers = {transponder_id: Driver(*details) for transponder_id, *details in conn.execute(
+            "SELECT transponder_id, name, number, kart, kart_cc FROM drivers")}
+    finally:
+        conn.close()
+    return SessionResult(row[0], engine, completions, drivers)
+
+def lap_positions(completions):
+    by_lap = {}  # lap index -> [(crossing_ns, transponder_id)]
+    for transponder_id, crossings in completions.items():
+        for lap, crossing_ns in enumerate(crossings):
+            by_lap.setdefault(lap, []).append((crossing_ns, transponder_id))
+    positions = {transponder_id: [] for transponder_id in completions}
+    for lap in sorted(by_lap):
+        for position, (_, transponder_id) in enumerate(sorted(by_lap[lap]), start=1):
+            positions[transponder_id].append(position)
+    return positions
+
+def format_ns(value_ns):
+    if value_ns is None:
+        return ""
+    seconds = value_ns / 1e9
+    return f"{int(seconds // 60):02}:{seconds % 60:06.3f}"
+
+def format_gap(gap_ns, gap_laps):
+    if gap_laps:
+        return f"+{gap_laps} lap" + ("s" if gap_laps > 1 else "")
+    return f"+{gap_ns / 1e9:.3f}" if gap_ns is not None else ""
+
+def driver_file(transponder_id):
+    return f"driver_{transponder_id}.html"
+
+def driver_label(result, row):
+    driver = result.driver(row["transponder_id"])
+    return driver.name if driver.name != NOT_ASSIGNED else row["rfid"]
+
+# series is [(label, [(x, y), ...])]. With invert, smaller values plot higher,
+# as positions do on a lap chart.
+def svg_chart(series, invert=False, y_format=str):
+    points = [point for _, values in series for point in values]
+    if not points:
+        return ""
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    x_min, x_max = min(xs), max(xs)
+    y_min, y_max = min(ys), max(ys)
+    x_span = (x_max - x_min) or 1
+    y_span = (y_max - y_min) or 1
+    plot_width = CHART_WIDTH - 2 * CHART_MARGIN
+    plot_height = CHART_HEIGHT - 2 * CHART_MARGIN
+
+    def position(x, y):
+        fraction = (y - y_min) / y_span
+        if not invert:
+            fraction = 1 - fraction
+        return CHART_MARGIN + (x - x_min) / x_span * plot_width, CHART_MARGIN + fraction * plot_height
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{CHART_WIDTH}" height="{CHART_HEIGHT}" class="chart">']
+    bottom, right = CHART_HEIGHT - CHART_MARGIN, CHART_WIDTH - CHART_MARGIN
+    parts.append(f'<polyline points="{CHART_MARGIN},{CHART_MARGIN} {CHART_MARGIN},{bottom} {right},{bottom}" fill="none" stroke="#999"/>')
+    for value in (y_min, y_max):
+        _, y = position(x_min, value)
+        parts.append(f'<text x="{CHART_MARGIN - 4}" y="{y + 4:.1f}" text-anchor="end">{html.escape(y_format(value))}</text>')
+    for value in (x_min, x_max):
+        x, _ = position(value, y_min)
+        parts.append(f'<text x="{x:.1f}" y="{bottom + 16}" text-anchor="middle">{value}</text>')
+    for index, (label, values) in enumerate(series):
+        if not values:
+            continue
+        color = PALETTE[index % len(PALETTE)]
+        coordinates = [position(x, y) for x, y in values]
+        parts.append(f'<polyline points="{" ".join(f"{x:.1f},{y:.1f}" for x, y in coordinates)}" fill="none" stroke="{color}" stroke-width="1.5"/>')
+        x, y = coordinates[-1]
+        parts.append(f'<text x="{x + 4:.1f}" y="{y + 4:.1f}" fill="{color}">{html.escape(label)}</text>')
+    parts.append("</svg>")
+    return "".join(parts)
+
+def html_table(columns, rows):
+    head = "".join(f"<th>{html.escape(column)}</th>" for column in columns)
+    body = "".join("<tr>" + "".join(f"<td>{cell}</td>" for cell in row) + "</tr>" for row in rows)
+    return f"<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>"
+
+def html_page(title, body):
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; margin: 1em 0; }}
+th, td {{ border: 1px solid #ccc; padding: 0.25em 0.6em; text-align: right; }}
+th {{ background: #eee; }}
+.chart text {{ font-size: 11px; }}
+@media print {{ body {{ margin: 0; }} a {{ color: inherit; text-decoration: none; }} }}
+</style></head>
+<body>{body}</body></html>
+"""
+
+def write_html(path, title, body):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(html_page(title, body))
+    os.replace(temporary, path)
+
+# Classification and lap chart for the session; returns the path written
+def write_classification(database_path, session_id, directory):
+    result = load_session(database_path, session_id)
+    rows = []
+    for row in result.standings:
+        driver = result.driver(row["transponder_id"])
+        label = html.escape(driver_label(result, row))
+        rows.append([
+            row["position"],
+            html.escape(driver.number),
+            f'<a href="drivers/{driver_file(row["transponder_id"])}">{label}</a>',
+            row["laps"],
+            format_ns(row["total_ns"]),
+            format_ns(row["best_lap_ns"]),
+            format_gap(row["gap_ns"], row["gap_laps"]),
+            format_gap(row["interval_ns"], row["interval_laps"]),
+        ])
+    series = [
+        (driver_label(result, row), [(lap, position) for lap, position in enumerate(result.positions.get(row["transponder_id"], []), start=1)])
+        for row in result.standings
+    ]
+    title = f"{result.name} - Classification"
+    body = (f"<h1>{html.escape(result.name)}</h1><h2>Classification</h2>"
+            + html_table(["Pos", "No.", "Driver", "Laps", "Total", "Best Lap", "Gap", "Interval"], rows)
+            + "<h2>Lap Chart</h2>" + svg_chart(series, invert=True))
+    path = os.path.join(directory, "classification.html")
+    write_html(path, title, body)
+    return path
+
+# One sheet per driver: summary, every lap with its delta to their best and
+# their position at the end of it, and a lap time chart. Returns the paths.
+def write_driver_sheets(database_path, session_id, transponder_ids, directory):
+    result = load_session(database_path, session_id)
+    by_id = {row["transponder_id"]: row for row in result.standings}
+    paths = []
+    for transponder_id in transponder_ids:
+        row = by_id.get(transponder_id)
+        if row is None:
+            continue
+        state = result.engine.states[transponder_id]
+        driver = result.driver(transponder_id)
+        stats = state.stats
+        name = driver_label(result, row)
+        summary = html_table(
+            ["Position", "Laps", "Best Lap", "Mean", "Median", "Consistency"],
+            [[row["position"], row["laps"], format_ns(row["best_lap_ns"]),
+              format_ns(int(stats.mean * 1e9)) if stats.count else "",
+              format_ns(int(stats.median * 1e9)) if stats.median is not None else "",
+              f"{stats.consistency:.1f}%" if stats.consistency is not None else ""]],
+        )
+        positions = result.positions.get(transponder_id, [])
+        laps = [[lap, format_ns(lap_ns), f"+{(lap_ns - state.best_lap_ns) / 1e9:.3f}", position]
+                for lap, (lap_ns, position) in enumerate(zip(state.laps, positions), start=1)]
+        chart = svg_chart([(name, [(lap, lap_ns / 1e9) for lap, lap_ns in enumerate(state.laps, start=1)])], y_format=lambda seconds: f"{seconds:.3f}")
+        details = " &middot; ".join(html.escape(part) for part in [f"No. {driver.number}", f"{driver.kart} {driver.kart_cc}", row["rfid"]])
+        body = (f'<p><a href="../classification.html">{html.escape(result.name)}</a></p>'
+                f"<h1>{html.escape(name)}</h1><p>{details}</p>"
+                + summary + "<h2>Lap Times</h2>" + chart
+                + html_table(["Lap", "Time", "To Best", "Pos"], laps))
+        path = os.path.join(directory, "drivers", driver_file(transponder_id))
+        write_html(path, f"{result.name} - {name}", body)
+        paths.append(path)
+    return paths
@@ -1,36 +1,26 @@
 import time
 import threading
 import random
-import csv
 import streamlit as st
-
-DATABASE = "rfid_database.csv"
+from driver_registry import get_driver_registry
 
 def load_database():
     data = {}
     try:
-        with open(DATABASE, mode='r') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                rfid = row[0]
-                data[rfid] = {
-                    "Driver Name": row[1],
-                    "Driver Number": row[2],
-                    "Driver Kart": row[3],
-                    "Driver Kart CC": row[4]
-                }
-    except FileNotFoundError:
-        st.error("Database file not found.")
+        for row in get_driver_registry().all().to_dict("records"):
+            data[row["RFID"]] = {
+                "Driver Name": row["Driver Name"],
+                "Driver Number": row["Driver Number"],
+                "Driver Kart": row["Driver Kart"],
+                "Driver Kart CC": row["Driver Kart CC"]
+            }
     except Exception as e:
         st.error(f"Error reading database: {e}")
     return data
 
 def save_database(data):
     try:
-        with open(DATABASE, mode='w', newline='') as file:
-            writer = csv.writer(file)
-            for rfid, details in data.items():
-                writer.writerow([rfid, details["Driver Name"], details["Driver Number"], details["Driver Kart"], details["Driver Kart CC"]])
+        get_driver_registry().upsert_many([dict(details, RFID=rfid) for rfid, details in data.items()])
     except Exception as e:
         st.error(f"Error saving to database: {e}")
 
@@ -67,12 +57,12 @@ class RFIDInterface:
                 "Driver Kart": "Not Assigned",
                 "Driver Kart CC": "Not Assigned"
             }
-            save_database(self.data)
+            save_database({rfid: self.data[rfid]})
 
     def remove_rfid(self, rfid):
         if rfid in self.data:
             del self.data[rfid]
-            save_database(self.data)
+            get_driver_registry().remove(rfid)
 
     def get_detected_rfids(self):
         return self.data.keys()
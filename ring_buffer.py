@@ -0,0 +1,51 @@
+import threading
+
+DEFAULT_CAPACITY = 4096
+
+# Fixed-capacity buffer that overwrites its oldest entries. Every appended item
+# gets a sequence number; readers keep the next sequence number they want as a
+# cursor, so any number of them can consume independently without copying or
+# walking entries they have already seen.
+class RingBuffer:
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if capacity < 1:
+            raise ValueError("Ring buffer capacity must be at least 1")
+        self.capacity = capacity
+        self.items = [None] * capacity
+        self.next_seq = 0
+        self.lock = threading.Lock()
+
+    def append(self, item):
+        with self.lock:
+            self.items[self.next_seq % self.capacity] = item
+            self.next_seq += 1
+
+    @property
+    def dropped(self):
+        return max(0, self.next_seq - self.capacity)
+
+    def oldest_seq(self):
+        return max(0, self.next_seq - self.capacity)
+
+    # Returns (items, next_cursor, missed) where missed counts entries that were
+    # overwritten before this reader got to them
+    def read_since(self, cursor):
+        with self.lock:
+            end = self.next_seq
+            start = max(cursor, end - self.capacity, 0)
+            missed = max(0, start - cursor)
+            if start >= end:
+                return [], end, missed
+            first = start % self.capacity
+            last = end % self.capacity
+            if first < last:
+                items = self.items[first:last]
+            else:
+                items = self.items[first:] + self.items[:last]
+            return items, end, missed
+
+    def snapshot(self):
+        return self.read_since(0)[0]
+
+    def __len__(self):
+        return min(self.next_seq, self.capacity)
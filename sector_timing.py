@@ -0,0 +1,78 @@
+import threading
+
+FINISH_LOOP = 0  # Loop ids follow track order, starting at the start/finish line
+
+class SectorState:
+    __slots__ = ("transponder_id", "last_loop", "last_crossing_ns", "current", "last_splits", "best_splits")
+
+    def __init__(self, transponder_id, sector_count):
+        self.transponder_id = transponder_id
+        self.last_loop = None
+        self.last_crossing_ns = None
+        self.current = [None] * sector_count  # Splits of the lap in progress
+        self.last_splits = None  # Splits of the last lap with every sector timed
+        self.best_splits = [None] * sector_count
+
+    # Sum of the best time through each sector, once every sector has one
+    def theoretical_best_ns(self):
+        if None in self.best_splits:
+            return None
+        return sum(self.best_splits)
+
+# Splits each lap into sectors from the crossings of every timing loop. Sector
+# k runs from loop k to loop k + 1, and the last one back to the finish line.
+# A split is only taken between consecutive loops, so a missed read voids the
+# sector rather than crediting one sector with the time of two. Crossings of
+# one transponder must arrive in time order. The decoder service merges the
+# loops' frames, but the finish and sector duplicate filters release
+# crossings when bursts close, so the hub expires both against every frame
+# and records what they release sorted by crossing time. A crossing older
+# than the transponder's last one (a timing node catching up after an
+# outage) cannot be placed and is skipped.
+class SectorTimer:
+    def __init__(self, loop_count):
+        self.loop_count = loop_count
+        self.states = {}
+        self.lock = threading.Lock()
+
+    # Returns (state, sector, split_ns); sector and split_ns are None when the
+    # crossing does not close a sector
+    def record(self, loop_id, transponder_id, crossing_ns):
+        with self.lock:
+            state = self.states.get(transponder_id)
+            if state is None:
+                state = self.states[transponder_id] = SectorState(transponder_id, self.loop_count)
+            sector = split_ns = None
+            if state.last_crossing_ns is not None and crossing_ns < state.last_crossing_ns:
+                return state, sector, split_ns
+            if state.last_loop is not None and (state.last_loop + 1) % self.loop_count == loop_id:
+                split_ns = crossing_ns - state.last_crossing_ns
+                if split_ns > 0:
+                    sector = state.last_loop
+                    state.current[sector] = split_ns
+                    best = state.best_splits[sector]
+                    if best is None or split_ns < best:
+                        state.best_splits[sector] = split_ns
+                else:
+                    # Clock reset between the loops, as in LapEngine
+                    split_ns = None
+            if loop_id == FINISH_LOOP:
+                if None not in state.current:
+                    state.last_splits = state.current
+                state.current = [None] * self.loop_count
+            state.last_loop = loop_id
+            state.last_crossing_ns = crossing_ns
+            return state, sector, split_ns
+
+    def reset(self):
+        with self.lock:
+            self.states.clear()
+
+    # transponder id -> (last complete splits, best splits, theoretical best),
+    # splits as lists of ns with None for sectors not timed yet
+    def snapshot(self):
+        with self.lock:
+            return {
+                transponder_id: (state.last_splits, list(state.best_splits), state.theoretical_best_ns())
+                for transponder_id, state in self.states.items()
+            }
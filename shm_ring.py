@@ -0,0 +1,154 @@
+import os
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+DEFAULT_RING_NAME = "sippycup_timing"
+DEFAULT_RING_CAPACITY = 65536
+RING_MAGIC = 0x53495050  # "SIPP"
+HEARTBEAT_TIMEOUT_NS = 2_000_000_000
+
+KIND_READ = 0
+KIND_CROSSING = 1
+KIND_RACE_START = 2  # Everything after it belongs to the new race; no other fields
+KIND_LOOP_CROSSING = 16  # Plus the loop id; lap_ns holds the sector split
+NO_LAP = -1
+
+# Header slots, one uint64 each. next_seq is only advanced after the record it
+# covers is fully written, so readers never see a half-written record as new.
+HEADER_MAGIC = 0
+HEADER_CAPACITY = 1
+HEADER_NEXT_SEQ = 2
+HEADER_HEARTBEAT_NS = 3
+HEADER_RACE_STARTED = 4
+HEADER_READS = 5
+HEADER_DROPPED_READS = 6
+HEADER_REJECTED_CROSSINGS = 7
+HEADER_RING_ID = 8  # Random per create(), so readers can tell a recreated segment from the one they mapped
+HEADER_SLOTS = 9
+HEADER_SIZE = HEADER_SLOTS * 8
+
+RECORD_DTYPE = np.dtype([
+    ("seq", "<u8"),
+    ("kind", "<u8"),
+    ("rfid", "S24"),
+    ("crossing_ns", "<i8"),
+    ("wall_ns", "<i8"),
+    ("lap_ns", "<i8"),
+])
+
+# Single-writer ring of fixed-size records in POSIX/Windows shared memory.
+# The timing daemon owns and writes it; any number of UI processes attach and
+# read it through NumPy views over the shared buffer, without copying.
+class SharedRing:
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((HEADER_SLOTS,), dtype="<u8", buffer=shm.buf)
+        capacity = int(self.header[HEADER_CAPACITY])
+        self.capacity = capacity
+        self.records = np.ndarray((capacity,), dtype=RECORD_DTYPE, buffer=shm.buf, offset=HEADER_SIZE)
+
+    @classmethod
+    def create(cls, name=DEFAULT_RING_NAME, capacity=DEFAULT_RING_CAPACITY):
+        size = HEADER_SIZE + capacity * RECORD_DTYPE.itemsize
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a daemon that did not shut down cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((HEADER_SLOTS,), dtype="<u8", buffer=shm.buf)
+        header[:] = 0
+        header[HEADER_CAPACITY] = capacity
+        header[HEADER_RING_ID] = int.from_bytes(os.urandom(8), "little")
+        header[HEADER_MAGIC] = RING_MAGIC
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name=DEFAULT_RING_NAME):
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix":
+            # Attaching registers the segment with this process's resource
+            # tracker, which would unlink it when the UI exits
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        magic = int(np.ndarray((1,), dtype="<u8", buffer=shm.buf)[0])
+        if magic != RING_MAGIC:
+            shm.close()
+            raise ValueError(f"Shared memory {name!r} is not a timing ring")
+        return cls(shm, owner=False)
+
+    def append(self, kind, rfid, crossing_ns, wall_ns, lap_ns=NO_LAP):
+        seq = int(self.header[HEADER_NEXT_SEQ])
+        record = self.records[seq % self.capacity]
+        record["seq"] = seq
+        record["kind"] = kind
+        record["rfid"] = rfid.encode("ascii", "replace")[:24]
+        record["crossing_ns"] = crossing_ns
+        record["wall_ns"] = wall_ns
+        record["lap_ns"] = NO_LAP if lap_ns is None else lap_ns
+        self.header[HEADER_NEXT_SEQ] = seq + 1
+
+    # Returns (records, next_cursor, missed). records is a copy, so it stays
+    # valid however far the writer goes on; missed counts records overwritten
+    # before they could be read.
+    def read_since(self, cursor):
+        end = int(self.header[HEADER_NEXT_SEQ])
+        start = max(cursor, end - self.capacity, 0)
+        missed = start - cursor if start > cursor else 0
+        if start >= end:
+            return self.records[:0].copy(), end, missed
+        seqs = np.arange(start, end, dtype=np.uint64)
+        slots = seqs % self.capacity
+        records = self.records[slots]
+        # A slot the writer reused while we copied holds a later seq, either
+        # in the copy or in shared memory now; drop it as missed rather than
+        # return a record that may be torn
+        valid = (records["seq"] == seqs) & (self.records["seq"][slots] == seqs)
+        if not valid.all():
+            missed += int((~valid).sum())
+            records = records[valid]
+        return records, end, missed
+
+    @property
+    def ring_id(self):
+        return int(self.header[HEADER_RING_ID])
+
+    def next_seq(self):
+        return int(self.header[HEADER_NEXT_SEQ])
+
+    def heartbeat(self):
+        self.header[HEADER_HEARTBEAT_NS] = time.time_ns()
+
+    def is_alive(self):
+        return time.time_ns() - int(self.header[HEADER_HEARTBEAT_NS]) < HEARTBEAT_TIMEOUT_NS
+
+    def get_race_started(self):
+        return bool(self.header[HEADER_RACE_STARTED])
+
+    def set_race_started(self, started):
+        self.header[HEADER_RACE_STARTED] = 1 if started else 0
+
+    def set_stats(self, stats):
+        self.header[HEADER_READS] = stats["reads"]
+        self.header[HEADER_DROPPED_READS] = stats["dropped_reads"]
+        self.header[HEADER_REJECTED_CROSSINGS] = stats["rejected_crossings"]
+
+    def get_stats(self):
+        return {
+            "reads": int(self.header[HEADER_READS]),
+            "dropped_reads": int(self.header[HEADER_DROPPED_READS]),
+            "rejected_crossings": int(self.header[HEADER_REJECTED_CROSSINGS]),
+        }
+
+    def close(self):
+        # NumPy views must go before the buffer can be released
+        self.header = None
+        self.records = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
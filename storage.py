@@ -0,0 +1,346 @@
+import os
+import time
+import queue
+import sqlite3
+import contextlib
+import threading
+import pandas as pd
+from metrics import metrics
+from lap_archive import LapArchiveWriter, LAP_ARCHIVE_FILE, INDEX_SUFFIX, NO_LAP
+from transponder_ids import TransponderIds
+
+DATABASE_PATH = "sippycup.db"
+DRIVER_CSV = "rfid_database.csv"
+DRIVER_COLUMNS = ["RFID", "Driver Name", "Driver Number", "Driver Kart", "Driver Kart CC"]
+NOT_ASSIGNED = "Not Assigned"
+WRITE_BATCH_SIZE = 500  # Crossings committed per transaction at most
+
+CROSSINGS_PERSISTED = metrics.counter("sippycup_crossings_persisted_total", "Crossings committed to the database")
+STORAGE_ERRORS = metrics.counter("sippycup_storage_errors_total", "Crossing batches that failed to commit")
+COMMIT_SECONDS = metrics.histogram("sippycup_storage_commit_seconds", "Time to commit one batch of crossings")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transponders (
+    id INTEGER PRIMARY KEY,
+    rfid TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS drivers (
+    transponder_id INTEGER PRIMARY KEY REFERENCES transponders(id),
+    name TEXT NOT NULL,
+    number TEXT NOT NULL,
+    kart TEXT NOT NULL,
+    kart_cc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS drivers_number ON drivers(number);
+CREATE TABLE IF NOT EXISTS race_sessions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    started_wall_ns INTEGER NOT NULL,
+    ended_wall_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS crossings (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES race_sessions(id),
+    transponder_id INTEGER NOT NULL REFERENCES transponders(id),
+    crossing_ns INTEGER NOT NULL,
+    wall_ns INTEGER NOT NULL,
+    lap_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS crossings_session_transponder ON crossings(session_id, transponder_id);
+CREATE INDEX IF NOT EXISTS crossings_transponder_session ON crossings(transponder_id, session_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('drivers_version', 0);
+"""
+
+# SQLite in WAL mode, so the timing process can write while any number of
+# pages read. Each thread gets its own connection; crossings are queued and a
+# single writer thread commits them in batches.
+class Storage:
+    def __init__(self, path=DATABASE_PATH, archive_path=LAP_ARCHIVE_FILE):
+        self.path = path
+        self.archive_path = archive_path
+        self.archive = None
+        self.local = threading.local()
+        self.transponders = TransponderIds(allocate=self.insert_transponder)
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        self.transponders.load(self.load_transponders())
+        if conn.execute("SELECT COUNT(*) FROM transponders").fetchone()[0] == 0:
+            self.import_driver_csv(DRIVER_CSV)
+        self.pending = queue.Queue()
+        self.commit_listeners = []  # Called with each batch of crossings once it is committed
+        metrics.gauge("sippycup_storage_pending", "Crossings queued for the storage writer", fn=self.pending.qsize)
+        self.writer_thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer_thread.start()
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self.local.conn = conn
+        return conn
+
+    # Interned id of rfid; new transponders are inserted once and cached
+    def transponder_id(self, rfid):
+        return self.transponders.intern(rfid)
+
+    # Runs inside the caller's transaction when there is one (see
+    # driver_transaction), and commits on its own otherwise, e.g. when the
+    # ingest thread meets a new transponder
+    def insert_transponder(self, rfid):
+        conn = self.connection()
+        if conn.in_transaction:
+            conn.execute("INSERT OR IGNORE INTO transponders (rfid) VALUES (?)", (rfid,))
+        else:
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO transponders (rfid) VALUES (?)", (rfid,))
+        return conn.execute("SELECT id FROM transponders WHERE rfid = ?", (rfid,)).fetchone()[0]
+
+    # Drivers
+
+    # Bumped in the same transaction as every driver write, so caches can tell
+    # whether the table changed with a single-row read
+    def drivers_version(self):
+        return self.connection().execute("SELECT value FROM meta WHERE key = 'drivers_version'").fetchone()[0]
+
+    def bump_drivers_version(self, conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'drivers_version'")
+
+    # (mtime_ns, size) of the driver CSV as last imported or exported, or None.
+    # It is kept in the database rather than in memory, so an edit made while
+    # nothing was running still reads as a change.
+    def driver_csv_stat(self):
+        values = dict(self.connection().execute("SELECT key, value FROM meta WHERE key IN ('driver_csv_mtime_ns', 'driver_csv_size')"))
+        if len(values) < 2:
+            return None
+        return (values["driver_csv_mtime_ns"], values["driver_csv_size"])
+
+    def set_driver_csv_stat(self, conn, csv_stat):
+        conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                         [("driver_csv_mtime_ns", csv_stat[0]), ("driver_csv_size", csv_stat[1])])
+
+    # The CSV replaces the driver table: its rows are upserted and drivers
+    # missing from it deleted in one transaction. Rows without an RFID are
+    # skipped before blank details are filled in, so none of them becomes a
+    # transponder named "Not Assigned".
+    def import_driver_csv(self, path):
+        try:
+            stat = os.stat(path)
+            df = pd.read_csv(path, dtype=str)
+        except (FileNotFoundError, pd.errors.EmptyDataError):
+            return 0
+        if "RFID" not in df.columns:
+            return 0
+        rfids = df["RFID"].str.strip()
+        df = df[rfids.notna() & (rfids != "") & (rfids != "RFID")].fillna(NOT_ASSIGNED)
+        rows = df.to_dict("records")
+        with self.driver_transaction() as conn:
+            self.write_drivers(conn, rows)
+            kept = {self.transponder_id(row["RFID"]) for row in rows}
+            removed = [(transponder_id,) for transponder_id, in conn.execute("SELECT transponder_id FROM drivers") if transponder_id not in kept]
+            conn.executemany("DELETE FROM drivers WHERE transponder_id = ?", removed)
+            self.set_driver_csv_stat(conn, (stat.st_mtime_ns, stat.st_size))
+        print(f"Imported {len(rows)} drivers from {path}" + (f", removed {len(removed)}" if removed else ""))
+        return len(rows)
+
+    def load_drivers(self):
+        return pd.read_sql_query(
+            """SELECT t.rfid AS "RFID", d.name AS "Driver Name", d.number AS "Driver Number",
+                      d.kart AS "Driver Kart", d.kart_cc AS "Driver Kart CC"
+               FROM drivers d JOIN transponders t ON t.id = d.transponder_id
+               ORDER BY d.transponder_id""",
+            self.connection(),
+        )
+
+    # Driver writes intern their transponders inside the write's own
+    # transaction, which is opened up front because sqlite3 only begins one
+    # implicitly at the first write. If it rolls back, ids cached for new
+    # transponders in it were never stored, so the cache is reloaded.
+    @contextlib.contextmanager
+    def driver_transaction(self):
+        conn = self.connection()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                yield conn
+        except Exception:
+            self.transponders.reload(self.load_transponders())
+            raise
+
+    # rows are dicts with DRIVER_COLUMNS keys; missing details become "Not Assigned"
+    def upsert_drivers(self, rows):
+        with self.driver_transaction() as conn:
+            self.write_drivers(conn, rows)
+
+    def write_drivers(self, conn, rows):
+        conn.executemany(
+            """INSERT INTO drivers (transponder_id, name, number, kart, kart_cc) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(transponder_id) DO UPDATE SET
+               name = excluded.name, number = excluded.number, kart = excluded.kart, kart_cc = excluded.kart_cc""",
+            [(
+                self.transponder_id(row["RFID"]),
+                str(row.get("Driver Name", NOT_ASSIGNED)),
+                str(row.get("Driver Number", NOT_ASSIGNED)),
+                str(row.get("Driver Kart", NOT_ASSIGNED)),
+                str(row.get("Driver Kart CC", NOT_ASSIGNED)),
+            ) for row in rows],
+        )
+        self.bump_drivers_version(conn)
+
+    def add_driver(self, rfid):
+        with self.driver_transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO drivers (transponder_id, name, number, kart, kart_cc) VALUES (?, ?, ?, ?, ?)",
+                (self.transponder_id(rfid), NOT_ASSIGNED, NOT_ASSIGNED, NOT_ASSIGNED, NOT_ASSIGNED),
+            )
+            if cursor.rowcount:
+                self.bump_drivers_version(conn)
+        return cursor.rowcount > 0
+
+    def delete_driver(self, rfid):
+        conn = self.connection()
+        with conn:
+            conn.execute("DELETE FROM drivers WHERE transponder_id = (SELECT id FROM transponders WHERE rfid = ?)", (rfid,))
+            self.bump_drivers_version(conn)
+
+    # Race sessions
+
+    def start_session(self, name=None):
+        started_wall_ns = time.time_ns()
+        name = name or time.strftime("Race %Y-%m-%d %H:%M:%S", time.localtime(started_wall_ns / 1e9))
+        conn = self.connection()
+        with conn:
+            cursor = conn.execute("INSERT INTO race_sessions (name, started_wall_ns) VALUES (?, ?)", (name, started_wall_ns))
+        return cursor.lastrowid
+
+    def end_session(self, session_id):
+        self.flush()
+        conn = self.connection()
+        with conn:
+            conn.execute("UPDATE race_sessions SET ended_wall_ns = ? WHERE id = ?", (time.time_ns(), session_id))
+
+    def latest_session(self):
+        row = self.connection().execute("SELECT id FROM race_sessions ORDER BY id DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    # A session left without an end, i.e. a race the process was restarted in
+    def is_session_open(self, session_id):
+        row = self.connection().execute("SELECT ended_wall_ns IS NULL FROM race_sessions WHERE id = ?", (session_id,)).fetchone()
+        return bool(row and row[0])
+
+    def load_sessions(self):
+        return pd.read_sql_query("SELECT id, name, started_wall_ns, ended_wall_ns FROM race_sessions ORDER BY id DESC", self.connection())
+
+    # Crossings
+
+    # transponder_id comes from transponder_id(rfid); the writer never has to
+    # look anything up
+    def record_crossing(self, session_id, transponder_id, crossing_ns, wall_ns, lap_ns=None):
+        self.pending.put((session_id, transponder_id, crossing_ns, wall_ns, lap_ns))
+
+    def write_loop(self):
+        while True:
+            batch = [self.pending.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            started = time.perf_counter() if metrics.enabled else None
+            try:
+                conn = self.connection()
+                if self.archive is None and self.archive_path:
+                    self.open_archive(conn)
+                with conn:
+                    conn.executemany("INSERT INTO crossings (session_id, transponder_id, crossing_ns, wall_ns, lap_ns) VALUES (?, ?, ?, ?, ?)", batch)
+                self.append_archive(batch)
+                if started is not None:
+                    COMMIT_SECONDS.observe(time.perf_counter() - started)
+                    CROSSINGS_PERSISTED.inc(len(batch))
+                for listener in self.commit_listeners:
+                    listener(batch)
+            except sqlite3.Error as e:
+                print(f"Error writing {len(batch)} crossings to {self.path}: {e}")
+                if metrics.enabled:
+                    STORAGE_ERRORS.inc()
+            finally:
+                for _ in batch:
+                    self.pending.task_done()
+
+    # The lap archive (lap_archive.py) mirrors the crossings table for fast
+    # analytics reads. It is opened by the writer thread on the first commit,
+    # so only the process that records crossings ever writes it, and catches
+    # up on anything committed while it was not being maintained.
+    def open_archive(self, conn):
+        try:
+            archive = LapArchiveWriter(self.archive_path)
+            stored = conn.execute("SELECT COUNT(*) FROM crossings").fetchone()[0]
+            if archive.count > stored:
+                print(f"{self.archive_path} has more records than the database, rebuilding it")
+                archive.close()
+                for path in (self.archive_path, self.archive_path + INDEX_SUFFIX):
+                    os.remove(path)
+                archive = LapArchiveWriter(self.archive_path)
+            archive.backfill(conn)
+            self.archive = archive
+        except (OSError, ValueError) as e:
+            print(f"Lap archive disabled, could not open {self.archive_path}: {e}")
+            self.archive_path = None
+
+    def append_archive(self, rows):
+        if self.archive is None:
+            return
+        try:
+            self.archive.append_crossings([
+                (session_id, transponder_id, crossing_ns, NO_LAP if lap_ns is None else lap_ns)
+                for session_id, transponder_id, crossing_ns, wall_ns, lap_ns in rows
+            ])
+        except OSError as e:
+            # Left behind; the next open_archive catches up from the database
+            print(f"Error appending to {self.archive_path}: {e}")
+            self.archive.close()
+            self.archive = None
+
+    # Blocks until every queued crossing has been committed
+    def flush(self):
+        self.pending.join()
+
+    # Yields (transponder_id, crossing_ns, wall_ns) in recorded order
+    def iter_crossings(self, session_id):
+        return self.connection().execute(
+            "SELECT transponder_id, crossing_ns, wall_ns FROM crossings WHERE session_id = ? ORDER BY id",
+            (session_id,),
+        )
+
+    def load_transponders(self):
+        return dict(self.connection().execute("SELECT id, rfid FROM transponders"))
+
+    def load_crossings(self, session_id=None, rfid=None):
+        query = """SELECT c.session_id, t.rfid, c.crossing_ns, c.wall_ns, c.lap_ns FROM crossings c
+                   JOIN transponders t ON t.id = c.transponder_id"""
+        clauses, params = [], []
+        if session_id is not None:
+            clauses.append("c.session_id = ?")
+            params.append(session_id)
+        if rfid is not None:
+            clauses.append("t.rfid = ?")
+            params.append(rfid)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        return pd.read_sql_query(query + " ORDER BY c.id", self.connection(), params=params)
+
+storage = None
+storage_lock = threading.Lock()
+
+def get_storage():
+    global storage
+    with storage_lock:
+        if storage is None:
+            storage = Storage()
+        return storage
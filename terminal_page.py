@@ -1,14 +1,87 @@
+import time
+import logging
+import pandas as pd
 import streamlit as st
+from collections import deque
 from log_capturer import log_capturer
+from metrics import metrics, Histogram
+from ingestion_hub import get_ingestion_hub
+from live_refresh import live_fragment, DEFAULT_REFRESH_INTERVAL
+
+TERMINAL_LINES = 500  # Records kept per viewer
+LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
 
 def terminal_page():
     st.title("Terminal Output in Streamlit")
 
-    if st.button("Refresh"):
-        log_contents = log_capturer.get_log_contents()
-    
-        if log_contents:
-            st.subheader("Output")
-            st.code("\n".join(log_contents))
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col1:
+        st.selectbox("Minimum level", LEVELS, index=1, key="terminal_level")
+    with col2:
+        follow = st.toggle("Follow", value=False, key="terminal_follow")
+    with col3:
+        st.button("Refresh")
+
+    run_every = DEFAULT_REFRESH_INTERVAL if follow else None
+    col1, col2 = st.columns([3, 2])
+    with col1:
+        live_fragment(terminal_panel, run_every=run_every)()
+    with col2:
+        live_fragment(metrics_panel, run_every=run_every)()
+
+# Each viewer tails the shared log with its own cursor, so only records added
+# since the last refresh are fetched and no other viewer loses them
+def terminal_panel():
+    if 'terminal_cursor' not in st.session_state:
+        st.session_state.terminal_cursor = 0
+        st.session_state.terminal_records = deque(maxlen=TERMINAL_LINES)
+    records, st.session_state.terminal_cursor, missed = log_capturer.read_since(st.session_state.terminal_cursor)
+    st.session_state.terminal_records.extend(records)
+
+    min_level = logging.getLevelName(st.session_state.terminal_level)
+    shown = [record for record in st.session_state.terminal_records if record.level >= min_level]
+    if missed:
+        st.caption(f"{missed} older records were dropped from the log buffer.")
+    if shown:
+        st.subheader("Output")
+        st.code("\n".join(
+            f"{time.strftime('%H:%M:%S', time.localtime(record.timestamp))} {logging.getLevelName(record.level):<7} {record.message}"
+            for record in shown
+        ))
+    else:
+        st.write("No output yet.")
+
+def format_ms(seconds):
+    return f"{seconds * 1000:.3f}" if seconds is not None else ""
+
+def metrics_panel():
+    st.subheader("Metrics")
+    if not metrics.enabled:
+        st.write('Metrics are off. Set "metrics_enabled": true in settings.json and restart to collect them.')
+        return
+    if get_ingestion_hub().external:
+        st.caption("Pipeline metrics are collected by the timing daemon and served on its own endpoint.")
+    if metrics.server is not None:
+        host, port = metrics.server.server_address[:2]
+        st.caption(f"Prometheus endpoint: http://{host}:{port}/metrics")
+
+    values, timings = [], []
+    for instrument in metrics.collect():
+        labels = ",".join(f"{key}={value}" for key, value in instrument.labels)
+        name = f"{instrument.name}{{{labels}}}" if labels else instrument.name
+        if isinstance(instrument, Histogram):
+            timings.append({
+                "Histogram": name,
+                "Count": instrument.count,
+                "p50 ms": format_ms(instrument.quantile(0.5)),
+                "p99 ms": format_ms(instrument.quantile(0.99)),
+                "Mean ms": format_ms(instrument.sum / instrument.count if instrument.count else None),
+            })
         else:
-            st.write("No output yet.")
+            try:
+                value = instrument.get()
+            except Exception as e:
+                value = f"unavailable: {e}"
+            values.append({"Metric": name, "Type": instrument.kind, "Value": value})
+    st.dataframe(pd.DataFrame(values), hide_index=True)
+    st.dataframe(pd.DataFrame(timings), hide_index=True)
@@ -0,0 +1,10 @@
+import pytest
+import storage
+
+# Each test gets its own database in a scratch working directory, so the
+# relative settings, CSV and capture paths never touch the checkout
+@pytest.fixture
+def fresh_storage(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(storage, "storage", storage.Storage(str(tmp_path / "test.db"), archive_path=None))
+    return storage.storage
@@ -0,0 +1,45 @@
+from decoder_service import DecoderService, TimingLoop
+from node_protocol import pack_frame
+from ttl_interface import Frame
+
+S = 1_000_000_000
+
+def make_service():
+    service = DecoderService(lambda loop_id, frame: None, [TimingLoop(0, "COM1", 9600, 0), TimingLoop(1, None, None, 0, "hairpin")])
+    service.clock_anchor = (0, 0)
+    return service
+
+def dispatched(service):
+    items = []
+    while not service.frames.empty():
+        items.append(service.frames.get_nowait())
+    return [(loop_id, frame.data, frame.arrival_ns) for loop_id, frame in items]
+
+def release(service, now_ns):
+    for item in service.merger.pop_ready(now_ns):
+        service.frames.put(item)
+
+# The hairpin node goes down after its first read and spools the next two
+# while the finish line keeps being merged and released; on reconnect the
+# spooled read older than the released stream is still dispatched, the newer
+# one is merged, and the resend of an acknowledged frame is ignored
+def test_reconnect_after_outage_with_two_loops():
+    service = make_service()
+    remote = service.remotes["hairpin"]
+    remote.clock.add(0, 0, 0, 0)
+    late_before = remote.late_frames.get()
+
+    service.merger.push(0, Frame("A", 1 * S, 1 * S))
+    remote.receive_frames(pack_frame(1, 30 * S, 30 * S, "A"))
+    service.merger.push(0, Frame("A", 61 * S, 61 * S))
+    service.merger.push(0, Frame("A", 121 * S, 121 * S))
+    release(service, 200 * S)
+    assert dispatched(service) == [(0, "A", 1 * S), (1, "A", 30 * S), (0, "A", 61 * S), (0, "A", 121 * S)]
+    assert service.merger.released_ns == 121 * S
+
+    remote.receive_frames(pack_frame(1, 30 * S, 30 * S, "A") + pack_frame(2, 90 * S, 90 * S, "A") + pack_frame(3, 150 * S, 150 * S, "A"))
+    assert dispatched(service) == [(1, "A", 90 * S)]
+    assert remote.late_frames.get() - late_before == 1
+    service.merger.push(0, Frame("A", 181 * S, 181 * S))
+    release(service, 400 * S)
+    assert dispatched(service) == [(1, "A", 150 * S), (0, "A", 181 * S)]
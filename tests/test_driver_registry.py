@@ -0,0 +1,31 @@
+import os
+from driver_registry import DriverRegistry
+
+HEADER = "RFID,Driver Name,Driver Number,Driver Kart,Driver Kart CC\n"
+
+def write_csv(path, lines, mtime_ns):
+    with open(path, "w") as f:
+        f.write(HEADER + "".join(line + "\n" for line in lines))
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def names(registry):
+    return sorted(registry.all()["Driver Name"])
+
+# Rows deleted from the CSV leave the table, including when the edit was made
+# while no registry was running
+def test_reimport_replaces_drivers_and_survives_restart(fresh_storage, tmp_path):
+    path = str(tmp_path / "drivers.csv")
+    write_csv(path, ["E1,Ann,1,K,125", "E2,Bob,2,K,125"], 1_000_000_000)
+    registry = DriverRegistry(fresh_storage, path)
+    assert names(registry) == ["Ann", "Bob"]
+
+    write_csv(path, ["E1,Ann,1,K,125"], 2_000_000_000)
+    registry.refresh(force=True)
+    assert names(registry) == ["Ann"]
+
+    registry.add("E3")
+    assert names(registry) == ["Ann", "Not Assigned"]
+
+    write_csv(path, ["E3,Cy,3,K,125"], 3_000_000_000)
+    restarted = DriverRegistry(fresh_storage, path)
+    assert names(restarted) == ["Cy"]
@@ -0,0 +1,41 @@
+from ingestion_hub import IngestionHub
+from ttl_interface import Frame
+
+S = 1_000_000_000
+
+def make_hub():
+    return IngestionHub({"capture_dir": None, "dedup_mode": "first", "min_lap_time": 5.0})
+
+def cross(hub, rfid, seconds):
+    hub.handle_frame(Frame(rfid, seconds * S, seconds * S))
+
+def laps(hub):
+    return {rfid: lap_count for rfid, lap_count, *_ in hub.lap_engine.snapshot()}
+
+# A process restarted mid-race picks up the open session where it stopped
+def test_restart_mid_race_resumes_the_session(fresh_storage):
+    hub = make_hub()
+    hub.start_race()
+    for seconds in (0, 60, 120):
+        cross(hub, "A", seconds)
+    hub.storage.flush()
+    session_id = hub.session_id
+
+    restarted = make_hub()
+    assert restarted.race_started
+    assert restarted.session_id == session_id
+    assert laps(restarted) == {"A": 2}
+    cross(restarted, "A", 180)
+    restarted.storage.flush()
+    assert laps(restarted) == {"A": 3}
+    assert len(restarted.storage.load_crossings(session_id)) == 4
+
+def test_restart_after_stopped_race_stays_stopped(fresh_storage):
+    hub = make_hub()
+    hub.start_race()
+    cross(hub, "A", 0)
+    hub.stop_race()
+
+    restarted = make_hub()
+    assert not restarted.race_started
+    assert laps(restarted) == {"A": 0}
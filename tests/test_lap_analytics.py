@@ -0,0 +1,28 @@
+from lap_analytics import load_history, LEGACY_LABEL, LEGACY_LAP_FILE
+
+S = 1_000_000_000
+
+def record_laps(storage, rfid, lap_seconds):
+    session_id = storage.start_session()
+    transponder_id = storage.transponder_id(rfid)
+    crossing_ns = 0
+    storage.record_crossing(session_id, transponder_id, crossing_ns, crossing_ns)
+    for seconds in lap_seconds:
+        crossing_ns += seconds * S
+        storage.record_crossing(session_id, transponder_id, crossing_ns, crossing_ns, seconds * S)
+    storage.flush()
+    return session_id
+
+def test_selected_session_excludes_legacy_laps(fresh_storage):
+    with open(LEGACY_LAP_FILE, "w") as f:
+        f.write("61.5\n62.0\n")
+    first = record_laps(fresh_storage, "A", [60, 61])
+    record_laps(fresh_storage, "B", [70])
+
+    history = load_history(first)
+    assert history.labels == ["A"]
+    assert sorted(history.laps) == [60.0, 61.0]
+
+    everything = load_history()
+    assert everything.labels == ["A", "B", LEGACY_LABEL]
+    assert everything.laps.size == 5
@@ -0,0 +1,226 @@
+import signal
+import argparse
+import threading
+from serial import SerialException
+from ingestion_hub import IngestionHub, load_settings
+from decoder_service import load_timing_loops
+from sector_timing import SectorTimer
+from metrics import configure_metrics
+from lap_engine import LapEngine
+from storage import get_storage
+from ring_buffer import RingBuffer, DEFAULT_CAPACITY
+from shm_ring import SharedRing, DEFAULT_RING_NAME, DEFAULT_RING_CAPACITY, KIND_READ, KIND_CROSSING, KIND_RACE_START, KIND_LOOP_CROSSING, NO_LAP
+
+POLL_INTERVAL = 0.1
+
+# Runs serial ingestion and lap computation in a process of its own, so
+# Streamlit reruns and DataFrame rendering cannot delay timestamps or laps.
+# Every raw read and recorded crossing is published into a SharedRing, with a
+# race-start record ahead of each race's first crossing. With
+# timing_loops every decoder is read by one DecoderService instead, and loop
+# crossings are published as well; raw reads are those of the finish line.
+def run_daemon(com_port, baud_rate, ring_name=DEFAULT_RING_NAME, capacity=DEFAULT_RING_CAPACITY, metrics_port=None, timing_loops=None):
+    settings = load_settings()
+    configure_metrics(settings, port=metrics_port)
+    ring = SharedRing.create(ring_name, capacity)
+    hub = IngestionHub(settings)
+    hub.frame_listeners.append(lambda frame: ring.append(KIND_READ, frame.data, frame.arrival_ns, frame.wall_ns))
+    hub.crossing_listeners.append(lambda rfid, crossing_ns, wall_ns, lap_ns: ring.append(KIND_CROSSING, rfid, crossing_ns, wall_ns, lap_ns))
+    hub.sector_listeners.append(lambda loop_id, rfid, crossing_ns, wall_ns, split_ns: ring.append(KIND_LOOP_CROSSING + loop_id, rfid, crossing_ns, wall_ns, split_ns))
+    hub.race_listeners.append(lambda: ring.append(KIND_RACE_START, "", 0, 0))
+    # A race resumed from storage is running until the UI stops it
+    ring.set_race_started(hub.race_started)
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+
+    try:
+        if timing_loops:
+            hub.open_loops(timing_loops)
+        else:
+            hub.open_port(com_port, baud_rate)
+        print(f"Timing daemon publishing to shared memory {ring_name!r}")
+        while not stopping.is_set():
+            ring.heartbeat()
+            # The UI writes race control into the ring header
+            race_started = ring.get_race_started()
+            if race_started and not hub.race_started:
+                hub.start_race()
+            elif hub.race_started and not race_started:
+                hub.stop_race()
+            ring.set_stats(hub.get_filter_stats())
+            stopping.wait(POLL_INTERVAL)
+    finally:
+        hub.close()
+        ring.close()
+        print("Timing daemon stopped")
+
+# UI-side stand-in for IngestionHub when the timing daemon owns the ports.
+# The ring wraps within minutes of reads, so the lap mirror is rebuilt from
+# the latest stored session, as IngestionHub does at startup, whenever the
+# UI attaches or falls behind the ring; records still in the ring are then
+# applied on top, skipping crossings storage already had. The mirror is
+# cleared at every race-start record, so a UI that attaches after several
+# races have gone through the ring only shows the latest one. Sector splits
+# are not stored, so after a rebuild they restart from the next crossings.
+class DaemonHub:
+    external = True
+
+    def __init__(self, ring_name=DEFAULT_RING_NAME, loop_count=0):
+        self.ring_name = ring_name
+        self.ring = None
+        self.cursor = 0
+        self.storage = get_storage()
+        self.transponders = self.storage.transponders
+        self.mirror = LapEngine(transponders=self.transponders)
+        self.reads = RingBuffer(DEFAULT_CAPACITY)
+        self.crossings = RingBuffer(DEFAULT_CAPACITY)
+        self.sector_mirror = SectorTimer(loop_count) if loop_count else None
+        self.splits = RingBuffer(DEFAULT_CAPACITY)
+        self.race_generation = 0
+        self.lock = threading.RLock()
+
+    # Attaches on first use, and again whenever the daemon stops heartbeating:
+    # a restarted daemon recreates the segment under the same name while our
+    # mapping still shows the old, dead one. A segment with a new ring id is a
+    # new daemon, read from its start over a mirror rebuilt from storage.
+    def connect(self):
+        with self.lock:
+            if self.ring is not None and self.ring.is_alive():
+                return self.ring
+            try:
+                ring = SharedRing.attach(self.ring_name)
+            except (FileNotFoundError, ValueError):
+                return self.ring
+            if self.ring is not None:
+                if ring.ring_id == self.ring.ring_id:
+                    ring.close()
+                    return self.ring
+                print(f"Timing daemon restarted, attaching to the new shared memory {self.ring_name!r}")
+                self.ring.close()
+            self.ring = ring
+            # Whatever the ring has already dropped is in the rebuilt mirror
+            self.cursor = max(ring.next_seq() - ring.capacity, 0)
+            self.rebuild()
+            return ring
+
+    # race_generation counts the races mirrored, so views cached per race
+    # notice a restart even when race_started reads the same
+    def reset_mirrors(self):
+        self.mirror.reset()
+        if self.sector_mirror is not None:
+            self.sector_mirror.reset()
+        self.race_generation += 1
+
+    def rebuild(self):
+        self.reset_mirrors()
+        session_id = self.storage.latest_session()
+        if session_id is not None:
+            for transponder_id, crossing_ns, wall_ns in self.storage.iter_crossings(session_id):
+                self.mirror.record_crossing(transponder_id, crossing_ns, wall_ns)
+
+    def sync(self):
+        with self.lock:
+            ring = self.connect()
+            if ring is None:
+                return
+            records, self.cursor, missed = ring.read_since(self.cursor)
+            if missed:
+                print(f"UI fell behind the timing daemon, {missed} records were overwritten; rebuilding from storage")
+                self.rebuild()
+            for kind, rfid, crossing_ns, wall_ns, lap_ns in zip(records["kind"], records["rfid"], records["crossing_ns"], records["wall_ns"], records["lap_ns"]):
+                rfid = rfid.decode("ascii")
+                if kind == KIND_READ:
+                    self.reads.append(rfid)
+                elif kind == KIND_RACE_START:
+                    self.reset_mirrors()
+                elif kind == KIND_CROSSING:
+                    transponder_id = self.transponders.intern(rfid)
+                    state = self.mirror.states.get(transponder_id)
+                    if state is not None and crossing_ns <= state.last_crossing_ns:
+                        continue  # Already rebuilt from storage
+                    self.mirror.record_crossing(transponder_id, int(crossing_ns), int(wall_ns))
+                    self.crossings.append((rfid, int(crossing_ns), int(wall_ns), None if lap_ns == NO_LAP else int(lap_ns)))
+                elif kind >= KIND_LOOP_CROSSING and self.sector_mirror is not None:
+                    loop_id = int(kind) - KIND_LOOP_CROSSING
+                    self.sector_mirror.record(loop_id, self.transponders.intern(rfid), int(crossing_ns))
+                    self.splits.append((loop_id, rfid, int(crossing_ns), int(wall_ns), None if lap_ns == NO_LAP else int(lap_ns)))
+
+    @property
+    def lap_engine(self):
+        self.sync()
+        return self.mirror
+
+    @property
+    def sectors(self):
+        self.sync()
+        return self.sector_mirror
+
+    @property
+    def race_started(self):
+        ring = self.connect()
+        return ring is not None and ring.get_race_started()
+
+    # The mirror is cleared once the daemon publishes the race start
+    def start_race(self):
+        ring = self.connect()
+        if ring is not None:
+            ring.set_race_started(True)
+
+    def stop_race(self):
+        ring = self.connect()
+        if ring is not None:
+            ring.set_race_started(False)
+
+    def open_port(self, com_port, baud_rate):
+        raise SerialException(f"Serial ports are owned by the timing daemon; start it with: python timing_daemon.py --port {com_port} --baud {baud_rate}")
+
+    def close_port(self, com_port):
+        print("Serial ports are owned by the timing daemon; stop the daemon to close them.")
+
+    def open_loops(self, timing_loops):
+        raise SerialException("Serial ports are owned by the timing daemon; start it with: python timing_daemon.py")
+
+    def close_loops(self):
+        self.close_port(None)
+
+    def get_loop_reader(self, com_port):
+        return None
+
+    def is_active(self, com_port=None):
+        ring = self.connect()
+        return ring is not None and ring.is_alive()
+
+    def read_crossings(self, cursor):
+        self.sync()
+        return self.crossings.read_since(cursor)
+
+    def read_splits(self, cursor):
+        self.sync()
+        return self.splits.read_since(cursor)
+
+    def read_frames(self, com_port, cursor):
+        self.sync()
+        return self.reads.read_since(cursor)
+
+    def get_filter_stats(self):
+        ring = self.connect()
+        if ring is None:
+            return {"reads": 0, "dropped_reads": 0, "rejected_crossings": 0}
+        return ring.get_stats()
+
+if __name__ == "__main__":
+    settings = load_settings()
+    parser = argparse.ArgumentParser(description="Run serial ingestion and lap timing outside the Streamlit process.")
+    parser.add_argument("--port", help="Read this port alone (default: timing_loops, else selected_com_port, from settings.json)")
+    parser.add_argument("--baud", type=int, default=settings.get("baud_rate", 9600))
+    parser.add_argument("--ring-name", default=settings.get("timing_ring_name", DEFAULT_RING_NAME))
+    parser.add_argument("--capacity", type=int, default=DEFAULT_RING_CAPACITY)
+    parser.add_argument("--metrics-port", type=int, default=settings.get("daemon_metrics_port"), help="Serve pipeline metrics here when metrics_enabled is set")
+    args = parser.parse_args()
+    timing_loops = None if args.port else load_timing_loops(settings)
+    port = args.port or settings.get("selected_com_port")
+    if not port and not timing_loops:
+        parser.error("No COM port given and none saved in settings.json")
+    run_daemon(port, args.baud, args.ring_name, args.capacity, args.metrics_port, timing_loops)
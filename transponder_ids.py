@@ -0,0 +1,53 @@
+import threading
+
+# Maps each transponder EPC to a small integer, once, when its first
+# crossing is recorded. Past that point the pipeline (lap engine,
+# leaderboard, sector timer, storage queue) keys everything on the integer
+# and the 24-character string is only looked up again for display. Raw reads
+# are deduplicated on the EPC, so noise that never becomes a crossing is
+# never interned. With an allocate function (Storage passes its
+# transponders-table insert) the ids are the persistent database ids, shared
+# by every process; without one they count up from 1 in memory.
+class TransponderIds:
+    def __init__(self, allocate=None):
+        self.allocate = allocate
+        self.ids = {}  # rfid -> id
+        self.rfids = {}  # id -> rfid
+        self.lock = threading.Lock()
+
+    def intern(self, rfid):
+        transponder_id = self.ids.get(rfid)
+        if transponder_id is None:
+            transponder_id = self.add(rfid)
+        return transponder_id
+
+    def add(self, rfid):
+        with self.lock:
+            transponder_id = self.ids.get(rfid)
+            if transponder_id is not None:
+                return transponder_id
+            transponder_id = self.allocate(rfid) if self.allocate is not None else len(self.ids) + 1
+            self.rfids[transponder_id] = rfid
+            self.ids[rfid] = transponder_id
+            return transponder_id
+
+    def rfid(self, transponder_id):
+        return self.rfids[transponder_id]
+
+    # mapping is id -> rfid, e.g. Storage.load_transponders()
+    def load(self, mapping):
+        with self.lock:
+            for transponder_id, rfid in mapping.items():
+                self.ids[rfid] = transponder_id
+                self.rfids[transponder_id] = rfid
+
+    # Replaces the whole map in one step, e.g. after a rolled-back
+    # transaction leaves cached ids for transponders that were never stored
+    def reload(self, mapping):
+        ids = {rfid: transponder_id for transponder_id, rfid in mapping.items()}
+        with self.lock:
+            self.ids = ids
+            self.rfids = dict(mapping)
+
+    def __len__(self):
+        return len(self.ids)
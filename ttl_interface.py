@@ -1,25 +1,91 @@
+import re
 import time
+import queue
 import threading
+from collections import namedtuple
 import serial  # Assuming you're using the pyserial library
 from serial import SerialException
+from ring_buffer import RingBuffer, DEFAULT_CAPACITY
+from metrics import metrics
+
+READ_CHUNK_SIZE = 4096  # Upper bound on bytes pulled from the port per read call
+MAX_FRAME_LENGTH = 1024  # Drop buffered bytes that never see a line terminator
+FRAME_DELIMITER = re.compile(rb"[\r\n]")
+
+# arrival_ns is time.monotonic_ns() taken when the bytes came off the port;
+# wall_ns maps it onto the wall clock through the anchor taken at start()
+Frame = namedtuple("Frame", ["data", "arrival_ns", "wall_ns"])
+
+SERIAL_READS = metrics.counter("sippycup_serial_reads_total", "Serial read calls that returned data")
+SERIAL_BYTES = metrics.counter("sippycup_serial_bytes_total", "Bytes read from serial ports")
+FRAMES = metrics.counter("sippycup_frames_total", "Frames parsed from serial input")
+FRAMES_DISCARDED = metrics.counter("sippycup_frames_discarded_total", "Frames discarded as undecodable or unterminated")
+FRAME_PARSE_SECONDS = metrics.histogram("sippycup_frame_parse_seconds", "Time from a read returning to its frames being queued")
+FRAME_QUEUE_SECONDS = metrics.histogram("sippycup_frame_queue_seconds", "Time frames wait between arrival and dispatch")
+FRAME_HANDLE_SECONDS = metrics.histogram("sippycup_frame_handle_seconds", "Time spent in the frame callback")
+
+# Calls handle with a memoryview of every complete line in buffer, then
+# compacts the buffer in place so the same bytearray is reused. Shared by the
+# threaded reader and the asyncio multi-decoder service.
+def split_lines(buffer, handle):
+    start = 0
+    with memoryview(buffer) as view:
+        for match in FRAME_DELIMITER.finditer(buffer):
+            end = match.start()
+            if end > start:
+                handle(view[start:end])
+            start = match.end()
+    if start:
+        del buffer[:start]
+    elif len(buffer) > MAX_FRAME_LENGTH:
+        print(f"Discarding {len(buffer)} bytes without a line terminator")
+        buffer.clear()
+        if metrics.enabled:
+            FRAMES_DISCARDED.inc()
+
+# The frame text, or None for a blank or undecodable line
+def decode_frame(raw):
+    try:
+        line = str(raw, 'utf-8').strip()
+    except UnicodeDecodeError:
+        print(f"Discarding undecodable frame: {bytes(raw)!r}")
+        if metrics.enabled:
+            FRAMES_DISCARDED.inc()
+        return None
+    if line and metrics.enabled:
+        FRAMES.inc()
+    return line or None
 
 class TTLInterface:
-    def __init__(self, callback, com_port, baud_rate=9600):
+    def __init__(self, callback, com_port, baud_rate=9600, read_timeout=0.5, idle_callback=None, idle_interval=0.1, buffer_size=DEFAULT_CAPACITY):
         self.callback = callback
+        self.idle_callback = idle_callback  # Called with monotonic_ns() when no frame arrived for idle_interval
+        self.idle_interval = idle_interval
         self.com_port = com_port
         self.baud_rate = baud_rate
+        self.read_timeout = read_timeout
         self.running = False
         self.serial_conn = None
-        self.received_data = []
+        self.thread = None
+        self.dispatch_thread = None
+        self.buffer = bytearray()
+        self.frames = queue.Queue()
+        self.clock_anchor = None
+        self.received_data = RingBuffer(buffer_size)
 
     def start(self):
         self.running = True
+        self.clock_anchor = (time.monotonic_ns(), time.time_ns())
         try:
-            self.serial_conn = serial.Serial(self.com_port, self.baud_rate, timeout=1)  # Set the appropriate baud rate
-            self.thread = threading.Thread(target=self.read_ttl_signals)
-            self.thread.start()
+            # A read timeout makes read() block in the driver instead of polling in_waiting
+            self.serial_conn = serial.Serial(self.com_port, self.baud_rate, timeout=self.read_timeout)
         except SerialException as e:
+            self.running = False
             raise SerialException(f"Failed to open COM port {self.com_port}: {e}")
+        self.thread = threading.Thread(target=self.read_ttl_signals, daemon=True)
+        self.dispatch_thread = threading.Thread(target=self.dispatch_frames, daemon=True)
+        self.dispatch_thread.start()
+        self.thread.start()
 
     def stop(self):
         self.running = False
@@ -27,20 +93,70 @@ class TTLInterface:
             self.serial_conn.close()
         if self.thread:
             self.thread.join()
+        self.frames.put(None)  # Wake the dispatcher so it can exit
+        if self.dispatch_thread:
+            self.dispatch_thread.join()
 
     def read_ttl_signals(self):
         while self.running:
             try:
-                if self.serial_conn.in_waiting:
-                    line = self.serial_conn.readline().decode('utf-8').strip()  # Read a line of data
-                    if line:  # If a line is read
-                        self.received_data.append(line)
-                        self.callback()
+                # Block for the first byte, then take everything already waiting in one call
+                waiting = self.serial_conn.in_waiting
+                chunk = self.serial_conn.read(min(max(waiting, 1), READ_CHUNK_SIZE))
+                arrival_ns = time.monotonic_ns()
             except Exception as e:
-                print(f"Error reading from COM port: {e}")
+                if self.running:
+                    print(f"Error reading from COM port: {e}")
+                    self.running = False
+                break
+            if chunk:
+                self.buffer += chunk
+                self.split_frames(arrival_ns)
+                if metrics.enabled:
+                    SERIAL_READS.inc()
+                    SERIAL_BYTES.inc(len(chunk))
+                    FRAME_PARSE_SECONDS.observe((time.monotonic_ns() - arrival_ns) / 1e9)
+
+    def wall_time_ns(self, arrival_ns):
+        anchor_mono, anchor_wall = self.clock_anchor
+        return anchor_wall + (arrival_ns - anchor_mono)
+
+    def split_frames(self, arrival_ns):
+        split_lines(self.buffer, lambda raw: self.queue_frame(raw, arrival_ns))
+
+    def queue_frame(self, raw, arrival_ns):
+        line = decode_frame(raw)
+        if line:
+            self.frames.put(Frame(line, arrival_ns, self.wall_time_ns(arrival_ns)))
+
+    def dispatch_frames(self):
+        timeout = self.idle_interval if self.idle_callback else None
+        while True:
+            try:
+                frame = self.frames.get(timeout=timeout)
+            except queue.Empty:
+                try:
+                    self.idle_callback(time.monotonic_ns())
+                except Exception as e:
+                    print(f"Error in idle callback: {e}")
+                continue
+            if frame is None:
+                break
+            self.received_data.append(frame.data)
+            started_ns = time.monotonic_ns() if metrics.enabled else None
+            try:
+                self.callback(frame)
+            except Exception as e:
+                print(f"Error handling frame {frame.data}: {e}")
+            if started_ns is not None:
+                FRAME_QUEUE_SECONDS.observe((started_ns - frame.arrival_ns) / 1e9)
+                FRAME_HANDLE_SECONDS.observe((time.monotonic_ns() - started_ns) / 1e9)
 
     def get_received_data(self):
-        return self.received_data
+        return self.received_data.snapshot()
+
+    def read_since(self, cursor):
+        return self.received_data.read_since(cursor)
 
     def is_active(self):
         return self.running